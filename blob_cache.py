@@ -0,0 +1,175 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from util import hash_value
+
+
+log = logging.getLogger(__name__)
+
+BYTES_PER_MB = 1024 * 1024
+
+
+class BlobCache:
+    """
+    On-disk cache of downloaded origin files keyed by file id and content hash,
+        with least recently used blobs evicted to keep the cache under
+        max_size bytes. Blobs are copied in and out of the cache, so that the
+        cached bytes are never modified by DICOM edits.
+    """
+
+    def __init__(self, directory, max_size):
+        """
+        Args:
+            directory (str): the directory in which to store blobs
+            max_size (int): the maximum size of the cache in bytes
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Get a BlobCache from the gear config or None if download_cache_dir is
+            not set
+        Args:
+            config (dict): the gear config
+
+        Returns:
+            BlobCache or None
+        """
+        directory = config.get("download_cache_dir")
+        if not isinstance(directory, str) or not directory:
+            return None
+        max_size = config.get("download_cache_size_mb", 10240) * BYTES_PER_MB
+        return cls(directory, max_size)
+
+    @staticmethod
+    def get_key(file_entry):
+        """
+        Get the cache key of file_entry, None if file_entry has neither a hash
+            nor a modified timestamp identifying its contents
+        """
+        version = file_entry.get("hash") or file_entry.get("modified")
+        if not (file_entry.id and version):
+            return None
+        return hash_value(f"{file_entry.id}:{version}")
+
+    def get_blob_path(self, file_entry):
+        """Get the path of the blob for file_entry (None if not cacheable)"""
+        key = self.get_key(file_entry)
+        if key is None:
+            return None
+        return os.path.join(self.directory, key)
+
+    def contains(self, file_entry):
+        """Whether the contents of file_entry are cached"""
+        blob_path = self.get_blob_path(file_entry)
+        return bool(blob_path) and os.path.isfile(blob_path)
+
+    def get(self, file_entry, dest_path):
+        """
+        Copy the cached contents of file_entry to dest_path
+
+        Args:
+            file_entry (flywheel.FileEntry): the file to retrieve
+            dest_path (str): the path to which to copy the file
+
+        Returns:
+            bool: whether the file was cached and copied to dest_path
+        """
+        blob_path = self.get_blob_path(file_entry)
+        if not blob_path:
+            return False
+        try:
+            shutil.copyfile(blob_path, dest_path)
+            # the modification time orders blobs for LRU eviction
+            os.utime(blob_path)
+        except FileNotFoundError:
+            return False
+        log.debug("Using cached download of %s", file_entry.name)
+        return True
+
+    def put(self, file_entry, src_path):
+        """
+        Add a copy of the file at src_path to the cache as the contents of
+            file_entry, evicting least recently used blobs if needed
+
+        Args:
+            file_entry (flywheel.FileEntry): the file downloaded to src_path
+            src_path (str): path to the downloaded file
+        """
+        blob_path = self.get_blob_path(file_entry)
+        if not blob_path or os.path.getsize(src_path) > self.max_size:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copyfile(src_path, tmp_path)
+            os.replace(tmp_path, blob_path)
+        except OSError:
+            log.warning("Could not cache %s", file_entry.name, exc_info=True)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    @contextmanager
+    def open_writer(self, file_entry, size=None):
+        """
+        Open a temporary file in the cache to which to write the contents of
+            file_entry as they are read elsewhere (i.e. streamed to an upload).
+            The file is added to the cache if the block exits without an
+            exception and with size bytes written, and discarded otherwise.
+
+        Args:
+            file_entry (flywheel.FileEntry): the file whose contents are written
+            size (int or None): the size of the file (file_entry.size if None)
+
+        Yields:
+            file object or None: the file to write to, None if file_entry is
+                not cacheable
+        """
+        blob_path = self.get_blob_path(file_entry)
+        if not blob_path:
+            yield None
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            # unbuffered, so that closing never fails on a pending write
+            with os.fdopen(fd, "wb", buffering=0) as tmp_fp:
+                yield tmp_fp
+            written = os.path.getsize(tmp_path)
+            if size is None:
+                size = file_entry.size
+            # a partially written file (i.e. after a write error) is discarded
+            if written != size or written > self.max_size:
+                return
+            os.replace(tmp_path, blob_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used blobs until the cache fits in max_size"""
+        with self._lock:
+            blobs = list()
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    blobs.append((stat.st_mtime, stat.st_size, entry.path))
+            total_size = sum(size for _, size, _ in blobs)
+            for _, size, path in sorted(blobs):
+                if total_size <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total_size -= size
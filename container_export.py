@@ -1,17 +1,26 @@
+import io
 import json
 import logging
 import os
 import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from copy import deepcopy
+from functools import partial
 from pprint import pformat
 
 import backoff
 import flywheel
 from flywheel.models.mixins import ContainerBase
 
-from dicom_edit import DicomUpdater
+from blob_cache import BlobCache
+from dicom_edit import DicomUpdater, get_dicom_process_pool
 from dicom_metadata import get_compatible_fw_header
-from export_log import ExportLog
+from export_journal import ExportJournal
+from export_log import ExportFileRecord, ExportLog
+from instrumentation import EXPORT_METRICS
 from util import (
     false_if_exc_is_timeout,
     false_if_exc_is_timeout_or_sub_exists,
@@ -19,7 +28,7 @@ from util import (
     hash_value,
     quote_numeric_string,
 )
-from validate import validate_context
+from validate import container_needs_export, validate_context
 
 
 CONTAINER_KWARGS_KEYS = {
@@ -43,6 +52,14 @@ CONTAINER_KWARGS_KEYS = {
 
 EXCLUDE_TAGS = ["EXPORTED"]
 
+CHILD_CONTAINER_TYPES = {
+    "project": "subject",
+    "subject": "session",
+    "session": "acquisition",
+}
+
+log = logging.getLogger(__name__)
+
 
 class ContainerExporter:
     """
@@ -61,7 +78,14 @@ class ContainerExporter:
         self.fw_client = gear_context.client
         self.config = gear_context.config
         self.origin_container = origin_container
+        self.container_cache = ContainerCache()
+        self.blob_cache = BlobCache.from_config(self.config)
+        # metrics are collected from the resolution of the origin hierarchy
+        EXPORT_METRICS.reset()
+        EXPORT_METRICS.instrument_client(self.fw_client)
         self.origin_hierarchy = self.get_hierarchy(origin_container)
+        # the origin container is fully populated by validate_context
+        self.container_cache.add(origin_container)
         self.export_project = export_project
         self.archive_project = archive_project
         # for abbreviated notation
@@ -69,6 +93,14 @@ class ContainerExporter:
         self.export_log = ExportLog(export_project, archive_project)
         self.status = None
         self._log = None
+        self._container_slots = None
+        # opened by self.export
+        self.journal = None
+        self.dicom_executor = None
+        # origin subject id -> lock and (subject copy, created) for batch export
+        self._subject_locks = dict()
+        self._subject_locks_lock = threading.Lock()
+        self._subject_copies = dict()
 
     @classmethod
     def from_gear_context(cls, gear_context):
@@ -93,6 +125,10 @@ class ContainerExporter:
     @property
     def csv_path(self):
         """Path to which to save the csv record of exported containers"""
+        if self.container_type == "project":
+            csv_name = f"{self.origin_container.label}_export_log.csv"
+            csv_name = get_sanitized_filename(csv_name)
+            return os.path.join(self.gear_context.output_dir, csv_name)
         subject_label = (
             self.origin_hierarchy.subject.label or self.origin_hierarchy.subject.code
         )
@@ -107,6 +143,49 @@ class ContainerExporter:
         csv_path = os.path.join(directory, csv_name)
         return csv_path
 
+    @property
+    def journal_path(self):
+        """Path of the journal recording the progress of the export"""
+        return f"{os.path.splitext(self.csv_path)[0]}_journal.jsonl"
+
+    @property
+    def metrics_path(self):
+        """Path of the JSON API call and stage metrics of the export"""
+        return f"{os.path.splitext(self.csv_path)[0]}_metrics.json"
+
+    @property
+    def files_csv_path(self):
+        """Path of the csv with the transfer and stage times of each file"""
+        return f"{os.path.splitext(self.csv_path)[0]}_files.csv"
+
+    @property
+    def jsonl_path(self):
+        """
+        Path of the JSON Lines copy of the export log, None unless
+            export_log_jsonl is set
+        """
+        if not self.config.get("export_log_jsonl"):
+            return None
+        return f"{os.path.splitext(self.csv_path)[0]}.jsonl"
+
+    @property
+    def max_container_workers(self):
+        """Maximum number of sibling containers to export concurrently"""
+        return self.config.get("max_container_workers", 1) or 1
+
+    def container_slot(self):
+        """
+        Context manager bounding the number of containers that are exported
+            concurrently across all levels of the hierarchy
+        """
+        if self.max_container_workers <= 1:
+            return nullcontext()
+        if self._container_slots is None:
+            self._container_slots = threading.BoundedSemaphore(
+                self.max_container_workers
+            )
+        return self._container_slots
+
     def get_hierarchy(self, container):
         """
         Get a ContainerHierarchy instance for container
@@ -117,7 +196,10 @@ class ContainerExporter:
             ContainerHierarchy: an object with attributes from container.parents
                 but with the container objects instead of the id string
         """
-        return ContainerHierarchy.from_container(self.fw_client, container)
+        with EXPORT_METRICS.stage("hierarchy"):
+            return ContainerHierarchy.from_container(
+                self.fw_client, container, container_cache=self.container_cache
+            )
 
     @staticmethod
     def get_create_container_kwargs(origin_container):
@@ -136,6 +218,10 @@ class ContainerExporter:
         create_container_kwargs["info"] = (
             deepcopy(origin_container.info) if origin_container.info else {}
         )
+        # tags are set in the creation request rather than one request per tag
+        tags = [tag for tag in origin_container.tags or [] if tag not in EXCLUDE_TAGS]
+        if tags:
+            create_container_kwargs["tags"] = tags
         create_container_kwargs["info"]["export"] = {
             "origin_id": hash_value(origin_container.id)
         }
@@ -160,7 +246,10 @@ class ContainerExporter:
         return container_copy_find_queries
 
     @staticmethod
-    def find_container_copy(origin_container, export_parent):
+    @EXPORT_METRICS.timed("find")
+    def find_container_copy(
+        origin_container, export_parent, reload=True, copy_index=None
+    ):
         """
         Returns an existing copy of origin_container if it exists on export_parent,
             otherwise returns None
@@ -169,16 +258,28 @@ class ContainerExporter:
             origin_container (ContainerBase): the container for which to find a copy
             export_parent (ContainerBase): the parent container of the
                 container copy
+            reload (bool): whether to fully populate the found copy's metadata
+                (i.e. file info), which is only needed to export files to it
+            copy_index (ContainerCopyIndex or None): index of the children of
+                export_parent, queried before the API
 
         Returns:
             ContainerBase or None: the found destination container or None
         """
         container_copy = None
+        indexed_copy = None
+        if copy_index is not None:
+            indexed_copy = copy_index.find(hash_value(origin_container.id))
         if (
             origin_container.parents.get(export_parent.container_type)
             == export_parent.id
         ):
             container_copy = origin_container
+        elif indexed_copy is not None:
+            container_copy = indexed_copy.reload() if reload else indexed_copy
+        elif copy_index is not None and copy_index.complete:
+            # a copy missing from a complete index does not exist
+            container_copy = None
         else:
             find_first_func = getattr(
                 getattr(export_parent, f"{origin_container.container_type}s"),
@@ -188,12 +289,13 @@ class ContainerExporter:
                 result = find_first_func(query)
                 # Fully populate container metadata if a container is returned
                 if isinstance(result, flywheel.models.mixins.ContainerBase):
-                    container_copy = result.reload()
+                    container_copy = result.reload() if reload else result
                     break
 
         return container_copy
 
     @staticmethod
+    @EXPORT_METRICS.timed("create")
     def create_container_copy(origin_container, export_parent):
         """
         Creates and returns a copy of self.origin_container on self.export_parent
@@ -212,12 +314,19 @@ class ContainerExporter:
             export_parent, f"add_{origin_container.container_type}"
         )
         create_kwargs = ContainerExporter.get_create_container_kwargs(origin_container)
-        created_container = create_container_func(**create_kwargs)
-        # tags must be added using the add_tag method
-        if origin_container.tags:
-            for tag in origin_container.tags:
-                if tag not in EXCLUDE_TAGS:
-                    created_container.add_tag(tag)
+        try:
+            created_container = create_container_func(**create_kwargs)
+        except flywheel.rest.ApiException as exc:
+            # the API rejects tags in the creation request, create without them
+            if exc.status not in (400, 422) or not create_kwargs.get("tags"):
+                raise exc
+            create_body = {k: v for k, v in create_kwargs.items() if k != "tags"}
+            created_container = create_container_func(**create_body)
+        # fall back to the add_tag method for tags that were not set on creation
+        created_tags = created_container.tags or []
+        for tag in create_kwargs.get("tags", []):
+            if tag not in created_tags:
+                created_container.add_tag(tag)
 
         return created_container
 
@@ -229,7 +338,9 @@ class ContainerExporter:
         giveup=false_if_exc_is_timeout_or_sub_exists,
         jitter=backoff.full_jitter,
     )
-    def find_or_create_container_copy(origin_container, export_parent):
+    def find_or_create_container_copy(
+        origin_container, export_parent, reload=True, copy_index=None
+    ):
         """
         First tries to find a copy of or the original self.origin_id on destination_parent and
             creates a copy if one is not found
@@ -238,6 +349,10 @@ class ContainerExporter:
             origin_container (ContainerBase): the container for which to find or create a copy
             export_parent (ContainerBase): the parent container of the
                 container copy
+            reload (bool): whether to fully populate the metadata of a found
+                copy (see find_container_copy)
+            copy_index (ContainerCopyIndex or None): index of the children of
+                export_parent, to which a created copy is added
 
         Returns:
             tuple(ContainerBase, bool): the found/created container and whether
@@ -254,13 +369,15 @@ class ContainerExporter:
         c_log.debug(debug_str)
         created = False
         found_container = ContainerExporter.find_container_copy(
-            origin_container, export_parent
+            origin_container, export_parent, reload=reload, copy_index=copy_index
         )
         if found_container is None:
             created = True
             return_container = ContainerExporter.create_container_copy(
                 origin_container, export_parent
             )
+            if copy_index is not None:
+                copy_index.add(return_container)
             log_prefix_str = "Created"
         else:
             log_prefix_str = "Found"
@@ -274,7 +391,17 @@ class ContainerExporter:
 
     @staticmethod
     def export_container_files(
-        fw_client, origin_container, export_container, dicom_map
+        fw_client,
+        origin_container,
+        export_container,
+        dicom_map,
+        max_workers=1,
+        max_dicom_workers=1,
+        journal=None,
+        blob_cache=None,
+        export_log=None,
+        origin_path=None,
+        dicom_executor=None,
     ):
         """
         Export origin_container.files to export_container
@@ -284,6 +411,19 @@ class ContainerExporter:
             export_container: container to which to copy origin_container's files
             dicom_map (dict or None): dictionary to use for mapping Flywheel
                 attributes to DICOM file header tags
+            max_workers (int): maximum number of files to export concurrently
+                (downloads, DICOM edits and uploads overlap across files)
+            max_dicom_workers (int): number of processes each file uses to read
+                and edit DICOMs
+            journal (ExportJournal or None): journal of the export, files it
+                records as exported to export_container are not exported again
+            blob_cache (BlobCache or None): cache of downloaded origin files
+            export_log (ExportLog or None): log to which to add a file record
+                (bytes transferred, DICOMs edited and stage times) per file
+            origin_path (str or None): resolver path of origin_container used
+                in the file records
+            dicom_executor (ProcessPoolExecutor or None): process pool of
+                max_dicom_workers processes shared across files
 
         Returns:
             tuple(list, list, list) tuple of lists of found files, created files,
@@ -295,11 +435,54 @@ class ContainerExporter:
             found = list()
             created = list()
             failed = list()
-            for ifile in origin_container.files:
-                file_exporter = FileExporter.from_client(fw_client, ifile, dicom_map)
-                exported_name, file_created = file_exporter.find_or_create_file_copy(
-                    export_container
+
+            # built once and shared by all of the container's FileExporters
+            file_index = FileCopyIndex.from_container(export_container)
+
+            def export_file(ifile):
+                if journal is not None:
+                    journal_file = journal.get_file(
+                        export_container, hash_value(ifile.id)
+                    )
+                    if journal_file is not None:
+                        file_name, created = journal_file
+                        return file_name, created, None
+                file_exporter = FileExporter.from_client(
+                    fw_client,
+                    ifile,
+                    dicom_map,
+                    max_dicom_workers=max_dicom_workers,
+                    blob_cache=blob_cache,
+                    dicom_executor=dicom_executor,
+                )
+                file_name, created = file_exporter.find_or_create_file_copy(
+                    export_container, file_index=file_index
                 )
+                if journal is not None and file_name:
+                    journal.add_file(
+                        export_container, file_exporter.origin_id, file_name, created
+                    )
+                return file_name, created, file_exporter.metrics
+
+            if max_workers and max_workers > 1:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    # map preserves the order of origin_container.files
+                    results = list(executor.map(export_file, origin_container.files))
+            else:
+                results = map(export_file, origin_container.files)
+            for ifile, (exported_name, file_created, file_metrics) in zip(
+                origin_container.files, results
+            ):
+                if export_log is not None:
+                    export_log.add_file_record(
+                        ExportFileRecord.from_metrics(
+                            origin_path,
+                            ifile.name,
+                            exported_name,
+                            file_created,
+                            file_metrics,
+                        )
+                    )
                 if exported_name:
                     if file_created:
                         created.append(exported_name)
@@ -342,6 +525,8 @@ class ContainerExporter:
         export_attachments=False,
         export_hierarchy=None,
         export_children=False,
+        export_log=None,
+        copy_index=None,
     ):
         """
         Export origin_container to self.export_project
@@ -352,38 +537,90 @@ class ContainerExporter:
             export_hierarchy (ContainerHierarchy): ExportHierarchy for origin_container
             export_children (bool): whether to export child containers (i.e.
                 acquisitions for a session, sessions for a subject)
+            export_log (ExportLog or None): the log to which to add records,
+                defaults to self.export_log
+            copy_index (ContainerCopyIndex or None): index of the children of
+                export_parent used to find the copy of origin_container
         Returns:
             copy of the origin_container on export_parent
         """
-
+        if export_log is None:
+            export_log = self.export_log
         c_log = ContainerExporter.get_container_logger(origin_container)
         log_str = (
             f"Exporting {origin_container.container_type} at path "
             f"{export_hierarchy.path}"
         )
         c_log.info(log_str)
-        c_copy, c_created = self.find_or_create_container_copy(
-            origin_container, export_parent
-        )
+        with self.container_slot(), EXPORT_METRICS.container_scope(origin_container):
+            journal_copy = None
+            if self.journal is not None:
+                journal_copy = self.journal.get_container_copy(
+                    self.fw_client, origin_container
+                )
+            export_files = bool(origin_container.files) and (
+                export_attachments or origin_container.container_type == "acquisition"
+            )
+            if journal_copy is not None:
+                c_copy, c_created = journal_copy
+                # files that were not journaled may already exist on the
+                # copy, which are found from the files of the reloaded copy
+                if export_files and not self.journal.has_files(
+                    c_copy, origin_container.files
+                ):
+                    c_copy = c_copy.reload()
+            else:
+                # the files of the copy are only needed to export files to it
+                c_copy, c_created = self.find_or_create_container_copy(
+                    origin_container,
+                    export_parent,
+                    reload=export_files,
+                    copy_index=copy_index,
+                )
+                if self.journal is not None:
+                    self.journal.add_container(origin_container, c_copy, c_created)
 
-        if export_attachments or origin_container.container_type == "acquisition":
+            if export_attachments or origin_container.container_type == "acquisition":
 
-            if self.config.get("map_flywheel_to_dicom"):
-                dicom_map = export_hierarchy.dicom_map
+                if self.config.get("map_flywheel_to_dicom"):
+                    dicom_map = export_hierarchy.compatible_dicom_map
+                else:
+                    dicom_map = None
+                found, created, failed = self.export_container_files(
+                    self.fw_client,
+                    origin_container,
+                    c_copy,
+                    dicom_map,
+                    max_workers=self.config.get("max_file_workers", 1),
+                    max_dicom_workers=self.config.get("max_dicom_workers", 1),
+                    journal=self.journal,
+                    blob_cache=self.blob_cache,
+                    export_log=export_log,
+                    origin_path=export_hierarchy.path,
+                    dicom_executor=self.dicom_executor,
+                )
+                record = export_log.add_container_record(
+                    export_hierarchy.path, c_copy, c_created, found, created, failed
+                )
+                # acquisitions have no children, so they are complete
+                if (
+                    self.journal is not None
+                    and origin_container.container_type == "acquisition"
+                    and not failed
+                ):
+                    self.journal.complete_container(origin_container, record)
             else:
-                dicom_map = None
-            found, created, failed = self.export_container_files(
-                self.fw_client, origin_container, c_copy, dicom_map
-            )
-            self.export_log.add_container_record(
-                export_hierarchy.path, c_copy, c_created, found, created, failed
-            )
-        else:
-            self.export_log.add_container_record(
-                export_hierarchy.path, c_copy, c_created
-            )
+                export_log.add_container_record(
+                    export_hierarchy.path, c_copy, c_created
+                )
         if export_children:
-            self.export_child_containers(origin_container, c_copy, export_hierarchy)
+            self.export_child_containers(
+                origin_container,
+                c_copy,
+                export_hierarchy,
+                export_log=export_log,
+                copy_created=c_created and journal_copy is None,
+            )
 
         return c_copy, c_created
 
@@ -407,28 +644,120 @@ class ContainerExporter:
         else:
             return list()
 
+    def export_child_container(
+        self,
+        child,
+        container_copy,
+        container_hierarchy,
+        export_log=None,
+        copy_index=None,
+    ):
+        """
+        Export a single child container (and its children) to container_copy
+
+        Args:
+            child (ContainerBase): child container of the container being exported
+            container_copy (ContainerBase): exported copy of child's parent
+            container_hierarchy (ContainerHierarchy): hierarchy of child's parent
+            export_log (ExportLog or None): the log to which to add records
+            copy_index (ContainerCopyIndex or None): index of the children of
+                container_copy
+        """
+        if export_log is None:
+            export_log = self.export_log
+        if self.journal is not None:
+            record = self.journal.get_completed_record(child)
+            if record is not None:
+                # completed by a previous run
+                export_log.add_record(record)
+                return
+        # child listings are not fully populated, retrieve the child once
+        with self.container_slot():
+            child = self.container_cache.get(
+                self.fw_client, child.container_type, child.id
+            )
+        child_hierarchy = container_hierarchy.get_child_hierarchy(child)
+        self.export_container(
+            child,
+            container_copy,
+            export_attachments=True,
+            export_hierarchy=child_hierarchy,
+            export_children=True,
+            export_log=export_log,
+            copy_index=copy_index,
+        )
+
+    def get_copy_index(self, origin_container, container_copy, copy_created=False):
+        """
+        Get an index of the children of container_copy if it was created during
+            this export, in which case the copies of the children of
+            origin_container do not need to be queried. Returns None if the
+            copy existed (container listings do not include the info that
+            identifies copies) or if the children are subjects, which are
+            matched by label/code.
+
+        Args:
+            origin_container (ContainerBase): container being exported
+            container_copy (ContainerBase): exported copy of origin_container
+            copy_created (bool): whether container_copy was created during
+                this export (and therefore has no children)
+
+        Returns:
+            ContainerCopyIndex or None
+        """
+        child_type = CHILD_CONTAINER_TYPES.get(origin_container.container_type)
+        if child_type not in ("session", "acquisition") or not copy_created:
+            return None
+        return ContainerCopyIndex()
+
     def export_child_containers(
-        self, origin_container, container_copy, container_hierarchy
+        self,
+        origin_container,
+        container_copy,
+        container_hierarchy,
+        export_log=None,
+        copy_created=False,
     ):
         """
+        Export the child containers of origin_container. If max_container_workers
+            is greater than one, siblings are exported concurrently and their
+            records are merged into export_log in the order the children were
+            listed, as soon as a child and all of the earlier children are
+            exported.
 
         Args:
             origin_container (ContainerBase): container being exported
             container_copy (ContainerBase): exported copy of origin_container
             container_hierarchy (ContainerHierarchy): origin_container's hierarchy
+            export_log (ExportLog or None): the log to which to add records,
+                defaults to self.export_log
+            copy_created (bool): whether container_copy was created during
+                this export
         """
+        if export_log is None:
+            export_log = self.export_log
         child_container_gen = self.get_child_containers_generator(origin_container)
-        for child in child_container_gen:
-            # reload to fully populate metadata
-            child = child.reload()
-            child_hierarchy = container_hierarchy.get_child_hierarchy(child)
-            self.export_container(
-                child,
-                container_copy,
-                export_attachments=True,
-                export_hierarchy=child_hierarchy,
-                export_children=True,
+        copy_index = self.get_copy_index(
+            origin_container, container_copy, copy_created=copy_created
+        )
+        if self.max_container_workers <= 1:
+            for child in child_container_gen:
+                self.export_child_container(
+                    child, container_copy, container_hierarchy, export_log, copy_index
+                )
+            return
+
+        def export_child(child):
+            child_log = export_log.get_child_log()
+            self.export_child_container(
+                child, container_copy, container_hierarchy, child_log, copy_index
             )
+            return child_log
+
+        # raises the child's exception, if any, once the earlier children
+        # were merged
+        for child_log in self.iter_map_containers(export_child, child_container_gen):
+            export_log.extend(child_log)
 
     def export_container_parents(self):
         """
@@ -462,8 +791,173 @@ class ContainerExporter:
             export_hierarchy=session_hierarchy,
         )
 
+    def get_batch_sessions(self):
+        """
+        Get the sessions of the origin project to export in batch mode: the
+            sessions tagged with the export_tag config option (all sessions if
+            it is not set), excluding sessions already exported unless
+            force_export is set
+
+        Returns:
+            list: the selected sessions
+        """
+        export_tag = self.config.get("export_tag")
+        if export_tag:
+            # quoted so that tags with separators (",", "=" or spaces) are
+            # matched as a whole
+            quoted_tag = export_tag.replace("\\", "\\\\").replace('"', '\\"')
+            sessions = self.origin_container.sessions.iter_find(f'tags="{quoted_tag}"')
+        else:
+            sessions = self.origin_container.sessions.iter()
+        return [
+            session
+            for session in sessions
+            if container_needs_export(session, self.config)
+            and (not export_tag or export_tag in (session.tags or []))
+        ]
+
+    def export_batch_subject(self, subject_hierarchy, export_log):
+        """
+        Find or create the copy of the subject of subject_hierarchy in
+            self.export_project, only once per subject when its sessions are
+            exported concurrently
+
+        Args:
+            subject_hierarchy (ContainerHierarchy): hierarchy of the subject
+            export_log (ExportLog): the log to which to add the subject record
+
+        Returns:
+            tuple(ContainerBase, bool): subject copy and whether it was created
+        """
+        subject = subject_hierarchy.subject
+        with self._subject_locks_lock:
+            subject_lock = self._subject_locks.setdefault(subject.id, threading.Lock())
+        with subject_lock:
+            if subject.id not in self._subject_copies:
+                self._subject_copies[subject.id] = self.export_container(
+                    subject,
+                    self.export_project,
+                    export_hierarchy=subject_hierarchy,
+                    export_log=export_log,
+                )
+            return self._subject_copies[subject.id]
+
+    def export_batch_session(self, session, export_log):
+        """
+        Export session and its parent subject in batch mode. Errors are logged
+            rather than raised so that the remaining sessions are exported.
+
+        Args:
+            session (flywheel.Session): the session to export
+            export_log (ExportLog): the log to which to add records
+
+        Returns:
+            bool: whether the session was exported without failures
+        """
+        try:
+            session = self.container_cache.get(self.fw_client, "session", session.id)
+            session_hierarchy = self.get_hierarchy(session)
+            subject_copy, _ = self.export_batch_subject(
+                session_hierarchy.get_parent_hierarchy(), export_log
+            )
+            self.export_container(
+                session,
+                subject_copy,
+                export_attachments=self.config.get("export_attachments"),
+                export_hierarchy=session_hierarchy,
+                export_children=True,
+                export_log=export_log,
+            )
+        except Exception:
+            self.log.exception(f"Failed to export session {session.id}")
+            return False
+        return not export_log.has_failed_files
+
+    def export_batch(self):
+        """
+        Export the sessions of the origin project selected by
+            self.get_batch_sessions. Up to max_container_workers sessions are
+            exported concurrently, their records are merged into
+            self.export_log in the order the sessions were listed (as soon as
+            a session and all of the earlier sessions are exported) and the
+            sessions exported without failures are archived.
+
+        Returns:
+            int: 0 if all sessions were exported without failures (and
+                archived, if an archive project was set), 1 otherwise
+        """
+        sessions = self.get_batch_sessions()
+        self.log.info(f"Exporting {len(sessions)} sessions")
+
+        def export_session(session):
+            session_log = self.export_log.get_child_log()
+            return self.export_batch_session(session, session_log), session_log
+
+        exported_sessions = list()
+        results = self.iter_map_containers(export_session, sessions)
+        for session, (success, session_log) in zip(sessions, results):
+            # written to the open log rather than kept until all sessions end
+            self.export_log.extend(session_log)
+            if success:
+                exported_sessions.append(session)
+        export_success = len(exported_sessions) == len(sessions)
+        if exported_sessions and self.archive_project:
+            if not self.archive_sessions(exported_sessions):
+                export_success = False
+            self.export_log.close(self.export_log.archive_path)
+        return int(not export_success)
+
     def export(self):
-        """Perform GRP-9 export of self.origin_container"""
+        """
+        Perform GRP-9 export of self.origin_container, resuming from the
+            journal of an interrupted export if one exists at self.journal_path
+            (unless force_export is set). The journal is deleted once the
+            export succeeds.
+        """
+        CLASSIFICATION_SCHEMA_CACHE.prefetch(self.fw_client)
+        max_dicom_workers = self.config.get("max_dicom_workers", 1)
+        if max_dicom_workers > 1:
+            # one pool for all of the export's file and container threads
+            self.dicom_executor = get_dicom_process_pool(max_dicom_workers)
+        # force_export exports everything again rather than resuming
+        self.journal = ExportJournal.open(
+            self.journal_path,
+            resume=not self.config.get("force_export"),
+            export_project_id=self.export_project.id,
+        )
+        self.export_log.open(
+            self.csv_path, self.jsonl_path, files_csv_path=self.files_csv_path
+        )
+        return_code = 1
+        try:
+            if self.container_type == "project":
+                return_code = self.export_batch()
+            else:
+                return_code = self.export_origin_container()
+            return return_code
+        finally:
+            # a no-op if the log was closed with the archive path
+            self.export_log.close()
+            if return_code == 0:
+                # a completed export is not resumed by the next run
+                self.journal.discard()
+            else:
+                self.journal.close()
+            if self.dicom_executor is not None:
+                self.dicom_executor.shutdown()
+                self.dicom_executor = None
+            self.log.info(EXPORT_METRICS.format_summary())
+            EXPORT_METRICS.write_json(self.metrics_path)
+
+    def export_origin_container(self):
+        """
+        Export self.origin_container and its parents and archive it if all
+            files were exported
+
+        Returns:
+            int: 0 if all files were exported (and the container archived, if
+                an archive project was set), 1 otherwise
+        """
         export_attachments = self.config.get("export_attachments")
         export_parent, export_parent_created = self.export_container_parents()
         self.export_container(
@@ -474,16 +968,10 @@ class ContainerExporter:
             export_children=True,
         )
 
-        if any(x.failed_files for x in self.export_log.records):
-            export_success = False
-        else:
-            export_success = True
-        # write the log csv
+        export_success = not self.export_log.has_failed_files
         if export_success and self.archive_project:
-            self.archive()
-            self.export_log.write_csv(self.csv_path, self.export_log.archive_path)
-        else:
-            self.export_log.write_csv(self.csv_path)
+            export_success = self.archive()
+            self.export_log.close(self.export_log.archive_path)
         return int(not export_success)
 
     def get_subject_export_params(self):
@@ -496,11 +984,15 @@ class ContainerExporter:
 
         """
         if self.container_type == "subject":
-            origin_subject = self.origin_container.reload()
+            origin_subject = self.container_cache.get(
+                self.fw_client, "subject", self.origin_container.id
+            )
             subject_export_hierarchy = self.origin_hierarchy
             export_attachments = self.config.get("export_attachments")
         else:
-            origin_subject = self.origin_container.subject.reload()
+            origin_subject = self.container_cache.get(
+                self.fw_client, "subject", self.origin_container.subject.id
+            )
             subject_export_hierarchy = self.origin_hierarchy.get_parent_hierarchy()
             export_attachments = False
         return (
@@ -521,9 +1013,118 @@ class ContainerExporter:
         if hasattr(self.origin_container, "sessions"):
             sessions = self.origin_container.sessions.iter()
         else:
-            sessions = [self.origin_container.reload()]
+            sessions = [
+                self.container_cache.get(
+                    self.fw_client, "session", self.origin_container.id
+                )
+            ]
         return sessions
 
+    def iter_map_containers(self, func, *iterables):
+        """
+        Call func on the items of iterables like map, running up to
+            max_container_workers calls concurrently
+
+        Yields:
+            the results of func in the order of iterables, each as soon as it
+                and all of the earlier results are available
+        """
+        if self.max_container_workers <= 1:
+            yield from map(func, *iterables)
+            return
+        with ThreadPoolExecutor(max_workers=self.max_container_workers) as executor:
+            yield from executor.map(func, *iterables)
+
+    def map_containers(self, func, *iterables):
+        """
+        Call func on the items of iterables like map, running up to
+            max_container_workers calls concurrently
+
+        Returns:
+            list: the results of func in the order of iterables
+        """
+        return list(self.iter_map_containers(func, *iterables))
+
+    @staticmethod
+    @EXPORT_METRICS.timed("archive")
+    @backoff.on_exception(
+        backoff.expo,
+        flywheel.rest.ApiException,
+        max_time=300,
+        giveup=false_if_exc_is_timeout,
+        jitter=backoff.full_jitter,
+    )
+    def move_container(container, update_dict):
+        """Move container by applying update_dict, retrying failed requests"""
+        container.update(update_dict)
+
+    def get_archive_subjects(self, session_list):
+        """
+        Get the destination of each distinct subject of the sessions in
+            session_list: a copy of the subject in self.archive_project
+
+        Returns:
+            dict: the destination subject by origin subject id, None for
+                subjects whose copy could not be found or created
+        """
+        dest_subjects = dict()
+        for session in session_list:
+            subject_id = session.subject.id
+            if subject_id in dest_subjects:
+                continue
+            try:
+                origin_subject = self.container_cache.get(
+                    self.fw_client, "subject", subject_id
+                )
+                dest_subjects[subject_id], _ = self.find_or_create_container_copy(
+                    origin_subject, self.archive_project, reload=False
+                )
+            except Exception:
+                self.log.exception(
+                    f"Failed to find or create archive subject {subject_id}"
+                )
+                dest_subjects[subject_id] = None
+        return dest_subjects
+
+    def archive_sessions(self, session_list, dest_subject=None):
+        """
+        Move the sessions in session_list to dest_subject or, if not provided,
+            to a copy of their subject in self.archive_project. Destination
+            subjects are resolved once per subject before up to
+            max_container_workers sessions are moved concurrently. The result
+            of each move is recorded in self.export_log, sessions whose
+            destination subject could not be resolved are recorded as failed.
+
+        Returns:
+            bool: whether all sessions were moved
+        """
+        session_list = list(session_list)
+        if dest_subject:
+            dest_subjects = {
+                session.subject.id: dest_subject for session in session_list
+            }
+        else:
+            dest_subjects = self.get_archive_subjects(session_list)
+
+        def archive_session(session):
+            if dest_subjects[session.subject.id] is None:
+                return False
+            try:
+                self.move_container(
+                    session, {"subject": {"_id": dest_subjects[session.subject.id].id}}
+                )
+            except Exception:
+                self.log.exception(f"Failed to archive session {session.label}")
+                return False
+            return True
+
+        results = self.map_containers(archive_session, session_list)
+        for session, archived in zip(session_list, results):
+            self.export_log.add_archive_result(
+                self.get_hierarchy(session).path, archived
+            )
+        return all(results)
+
     def archive(self):
         """
         If an archive_project was set, move self.origin_container to it.
@@ -531,42 +1132,128 @@ class ContainerExporter:
             already exist in archive_project, otherwise move sessions to
             a copy of the subject in archive_project
 
+        Returns:
+            bool: whether self.origin_container was archived
         """
 
-        def archive_sessions(session_list, dest_subject=None):
-
-            """move sessions in session_list to dest_subject"""
-            for session in session_list:
-                if not dest_subject:
-                    tmp_dest_subject, created = self.find_or_create_container_copy(
-                        session.subject.reload(), self.archive_project
-                    )
-                else:
-                    tmp_dest_subject = dest_subject
-                session.update({"subject": {"_id": tmp_dest_subject.id}})
-
         def archive_subject(origin_subject):
             found_subject = self.find_container_copy(
                 origin_subject, self.archive_project
             )
-            if not found_subject:
-                origin_subject.update(project=self.archive_project.id)
+            if found_subject:
+                return self.archive_sessions(
+                    origin_subject.sessions.iter(), found_subject
+                )
+            try:
+                self.move_container(
+                    origin_subject, {"project": self.archive_project.id}
+                )
+            except Exception:
+                self.log.exception(f"Failed to archive subject {origin_subject.label}")
+                archived = False
             else:
-                archive_sessions(origin_subject.sessions.iter(), found_subject)
+                archived = True
+            self.export_log.add_archive_result(self.origin_hierarchy.path, archived)
+            return archived
+
+        if not self.archive_project:
+            return False
+
+        if self.container_type == "subject":
+            return archive_subject(self.origin_container)
 
-        if self.archive_project:
+        elif self.container_type == "session":
+            return self.archive_sessions([self.origin_container])
 
-            if self.container_type == "subject":
-                archive_subject(self.origin_container)
+        return False
 
-            elif self.container_type == "session":
 
-                archive_sessions([self.origin_container])
+def get_download_response(fw_client, container_id, file_name):
+    """
+    Get the response of the download of file_name from container_id without
+        reading its body, which can then be streamed from response.raw
+    Args:
+        fw_client (flywheel.Client): the flywheel client
+        container_id (str): id of the container of the file
+        file_name (str): name of the file to download
+
+    Returns:
+        requests.Response: the streaming download response
+    """
+    return fw_client.containers_api.download_file_from_container_with_http_info(
+        container_id, file_name, _return_http_data_only=True, _preload_content=False
+    )
+
+
+class DownloadStream(io.RawIOBase):
+    """
+    Raw file object reading the body of a streaming download response in the
+        chunks requested by the reader, so that it can be provided as the
+        contents of a flywheel.FileSpec to upload the file while it is
+        downloaded (the SDK only passes file objects through to the multipart
+        encoder). The multipart encoder sizes the upload from len, the size of
+        the body, minus tell, the number of bytes read. The bytes read are
+        also written to tee_fp if provided (i.e. to add the file to a
+        BlobCache).
+    """
+
+    def __init__(self, response, length, tee_fp=None):
+        """
+        Args:
+            response (requests.Response): the streaming download response
+            length (int): the size of the (decoded) response body
+            tee_fp (file object or None): file to which to write a copy of
+                the bytes read, dropped (not failing the read) if a write fails
+        """
+        super().__init__()
+        self._raw = response.raw
+        self._raw.decode_content = True
+        self.len = length
+        self._position = 0
+        self._tee_fp = tee_fp
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def readinto(self, buffer):
+        """Read up to len(buffer) bytes into buffer"""
+        size = len(buffer)
+        data = self._raw.read(size)
+        if not data and size and self._position < self.len:
+            bytes_left = self.len - self._position
+            raise IOError(f"Download ended with {bytes_left} bytes left to read")
+        buffer[: len(data)] = data
+        self._position += len(data)
+        if self._tee_fp is not None and data:
+            self.tee(data)
+        return len(data)
+
+    def tee(self, data):
+        """Write data to the tee file, dropping the tee if the write fails"""
+        try:
+            written = self._tee_fp.write(data)
+        except OSError:
+            log.warning("Could not copy streamed download", exc_info=True)
+            written = None
+        if written != len(data):
+            # the copy is incomplete, so it is discarded on close
+            self._tee_fp = None
 
 
 class FileExporter:
     def __init__(
-        self, file_entry, classification_schema, upload_function, dicom_map=None
+        self,
+        file_entry,
+        classification_schema,
+        upload_function,
+        dicom_map=None,
+        max_dicom_workers=1,
+        download_function=None,
+        blob_cache=None,
+        dicom_executor=None,
     ):
         """
         Args:
@@ -578,6 +1265,17 @@ class FileExporter:
                 by self.upload
             dicom_map (dict or None): dictionary to use for mapping Flywheel
                 attributes to DICOM file header tags
+            max_dicom_workers (int): number of processes to use for reading
+                and editing DICOMs
+            download_function: function that takes FileEntry.parent.id and
+                file name parameters and returns a streaming download response
+                (see get_download_response). If provided, files that do not
+                need to be modified are streamed from the download to the
+                upload without a local copy
+            blob_cache (BlobCache or None): cache of downloaded origin files
+                used by self.download
+            dicom_executor (ProcessPoolExecutor or None): process pool of
+                max_dicom_workers processes shared across files
         """
         self.sanitized_name = get_sanitized_filename(file_entry.name)
         self.origin_file = file_entry
@@ -587,13 +1285,27 @@ class FileExporter:
         self._classification = file_entry.classification
         self._info = file_entry.info
         self._upload_function = upload_function
+        self._download_function = download_function
+        self.blob_cache = blob_cache
         self._fw_dicom_header = None
         self._log = None
+        # ScopeMetrics of the last self.find_or_create_file_copy
+        self.metrics = None
         self.classification_schema = classification_schema
         self.dicom_map = dicom_map
+        self.max_dicom_workers = max_dicom_workers
+        self.dicom_executor = dicom_executor
 
     @classmethod
-    def from_client(cls, fw_client, file_entry, dicom_map=None):
+    def from_client(
+        cls,
+        fw_client,
+        file_entry,
+        dicom_map=None,
+        max_dicom_workers=1,
+        blob_cache=None,
+        dicom_executor=None,
+    ):
         """
         Initialize a FileExporter instance from a FileEntry and flywheel.Client
         Args:
@@ -601,14 +1313,28 @@ class FileExporter:
             file_entry (flywheel.FileEntry): the file to export
             dicom_map (dict or None): dictionary to use for mapping Flywheel
                 attributes to DICOM file header tags
+            max_dicom_workers (int): number of processes to use for reading
+                and editing DICOMs
+            blob_cache (BlobCache or None): cache of downloaded origin files
+            dicom_executor (ProcessPoolExecutor or None): process pool of
+                max_dicom_workers processes shared across files
 
         Returns:
             FileExporter
         """
         upload_function = fw_client.upload_file_to_container
         modality = cls.get_modality(file_entry)
-        classification_schema = cls.get_classification_schema(fw_client, modality)
-        return cls(file_entry, classification_schema, upload_function, dicom_map)
+        classification_schema = CLASSIFICATION_SCHEMA_CACHE.get(fw_client, modality)
+        return cls(
+            file_entry,
+            classification_schema,
+            upload_function,
+            dicom_map,
+            max_dicom_workers=max_dicom_workers,
+            download_function=partial(get_download_response, fw_client),
+            blob_cache=blob_cache,
+            dicom_executor=dicom_executor,
+        )
 
     @property
     def classification(self):
@@ -716,7 +1442,7 @@ class FileExporter:
                     raise exc
         return schema
 
-    def find_file_copy(self, export_parent):
+    def find_file_copy(self, export_parent, file_index=None):
         """
         Find and return a copy of self.origin_file from export_parent container
             (if a copy exists), else return None
@@ -724,17 +1450,17 @@ class FileExporter:
         Args:
             export_parent (ContainerBase): the container on which to locate a
                 copy of self.origin_file (has a matching origin_id and filename)
+            file_index (FileCopyIndex or None): index of export_parent's files,
+                built from export_parent.files if not provided
 
         Returns:
             flywheel.FileEntry or None (if not found)
         """
-        for file_entry in export_parent.files:
-            file_origin_id = file_entry.info.get("export", {}).get("origin_id")
-            if self.origin_id == file_origin_id and file_entry.name in [
-                self.sanitized_name,
-                self.origin_file.name,
-            ]:
-                return file_entry
+        if file_index is None:
+            file_index = FileCopyIndex.from_container(export_parent)
+        return file_index.find(
+            self.origin_id, (self.sanitized_name, self.origin_file.name)
+        )
 
     @backoff.on_exception(
         backoff.expo,
@@ -745,6 +1471,10 @@ class FileExporter:
     )
     def create_file_copy(self, export_parent):
         """
+        Create a copy of self.origin_file on export_parent. Files that need no
+            content change are streamed from the download to the upload (see
+            self.stream_file_copy), and downloaded and uploaded if they cannot
+            be streamed or streaming fails.
 
         Args:
             export_parent (ContainerBase): the container on which to create
@@ -754,9 +1484,19 @@ class FileExporter:
             str or None: name of the created copy of FileEntry or None if
                 creation of copy was unsuccessful
         """
+        content_change = self.requires_content_change()
+        if not content_change:
+            if self.type == "dicom":
+                self.warn_missing_dicom_header()
+            # cached files are uploaded from the cache instead
+            cached = self.blob_cache is not None and self.blob_cache.contains(
+                self.origin_file
+            )
+            if not cached and self.stream_file_copy(export_parent):
+                return self.sanitized_name
         with tempfile.TemporaryDirectory() as tempdir:
             local_filepath = self.download(tempdir)
-            if self.type == "dicom":
+            if content_change:
                 result = self.update_dicom(local_filepath)
                 if not result:
                     return None
@@ -764,7 +1504,7 @@ class FileExporter:
             self.upload(export_parent, local_filepath)
             return self.sanitized_name
 
-    def find_or_create_file_copy(self, export_parent):
+    def find_or_create_file_copy(self, export_parent, file_index=None):
         """
         Find or create a copy of self.origin_file on export parent and return the
             name of the found/created copy and a boolean indicating if it was
@@ -772,23 +1512,34 @@ class FileExporter:
         Args:
             export_parent (ContainerBase): the container on which to locate/create
                a copy of  self.origin_file
+            file_index (FileCopyIndex or None): index of export_parent's files
+                shared across FileExporters, updated when a copy is created
 
         Returns: tuple((str or None), bool): the name of the found or created
             copy of self.origin_file and whether the copy was created
 
         """
-        file_copy = self.find_file_copy(export_parent)
-        file_name = None
-        created = False
-        if file_copy is None:
-            try:
-                file_name = self.create_file_copy(export_parent)
-                if file_name:
-                    created = True
-            except Exception:
-                self.log.error("Failed to create file copy!", exc_info=True)
-        else:
-            file_name = file_copy.name
+        with EXPORT_METRICS.file_scope(self.origin_file) as file_metrics:
+            self.metrics = file_metrics
+            file_copy = self.find_file_copy(export_parent, file_index=file_index)
+            file_name = None
+            created = False
+            if file_copy is None:
+                try:
+                    file_name = self.create_file_copy(export_parent)
+                    if file_name:
+                        created = True
+                        if file_index is not None:
+                            file_index.add(
+                                flywheel.FileEntry(
+                                    name=file_name,
+                                    info={"export": {"origin_id": self.origin_id}},
+                                )
+                            )
+                except Exception:
+                    self.log.error("Failed to create file copy!", exc_info=True)
+            else:
+                file_name = file_copy.name
 
         return file_name, created
 
@@ -805,40 +1556,128 @@ class FileExporter:
 
         """
         if not self.fw_dicom_header:
+            self.warn_missing_dicom_header()
+            return local_filepath
+        return DicomUpdater.update_fw_dicom(
+            local_filepath,
+            self.fw_dicom_header,
+            max_workers=self.max_dicom_workers,
+            executor=self.dicom_executor,
+        )
+
+    def requires_content_change(self):
+        """
+        Whether the content of the file copy may differ from the origin file,
+            which is only the case for DICOMs with a header to apply. Other
+            files are copied without being read locally.
+        """
+        return self.type == "dicom" and bool(self.fw_dicom_header)
+
+    def warn_missing_dicom_header(self):
+        """Log that the DICOM cannot be updated since it has no header"""
+        warn_str = (
+            "Flywheel DICOM does not have a header at info.header.dicom to "
+            " map to DICOM!"
+        )
+        self.log.warning(warn_str)
+        if self.dicom_map:
             warn_str = (
-                "Flywheel DICOM does not have a header at info.header.dicom to "
-                " map to DICOM!"
+                "map_flywheel_to_dicom is True, but mapping will not be "
+                "performed since info.header.dicom is not defined. "
+                "Please run GRP-3 (medatadata extraction) on DICOMs to which "
+                "you wish to map flywheel metadata"
             )
-            self.log.warning(warn_str)
-            if self.dicom_map:
-                warn_str = (
-                    "map_flywheel_to_dicom is True, but mapping will not be "
-                    "performed since info.header.dicom is not defined. "
-                    "Please run GRP-3 (medatadata extraction) on DICOMs to which "
-                    "you wish to map flywheel metadata"
-                )
 
-                self.log.warning(warn_str)
-            return local_filepath
-        return DicomUpdater.update_fw_dicom(local_filepath, self.fw_dicom_header)
+            self.log.warning(warn_str)
 
-    def download(self, download_dirpath):
+    def stream_file_copy(self, export_parent):
         """
-        Download the file to download_dirpath as self.sanitized_name
+        Upload a copy of the file to export_parent while it is downloaded,
+            without a local copy. Only for files that do not require a
+            content change (see self.requires_content_change). The streamed
+            bytes are added to self.blob_cache if set.
+
         Args:
-            download_dirpath (str): the path of the directory to which to
-                download the file
-        """
+            export_parent (ContainerBase): the container on which to create
+               a copy of self.origin_file
+
+        Returns:
+            bool: whether the file was uploaded, False if the file cannot be
+                streamed (no download_function, parent or size) or streaming
+                failed, in which case it is downloaded and uploaded instead
+        """
+        if self._download_function is None or self.origin_file.parent is None:
+            return False
+        self.warn_if_sanitized()
+        try:
+            return self._stream_file_copy(export_parent)
+        except Exception:
+            self.log.warning(
+                f"Failed to stream {self.origin_file.name}, downloading it instead",
+                exc_info=True,
+            )
+            return False
+
+    def _stream_file_copy(self, export_parent):
+        response = self._download_function(
+            self.origin_file.parent.id, self.origin_file.name
+        )
+        try:
+            length = self.origin_file.size
+            if length is None and not response.headers.get("Content-Encoding"):
+                length = response.headers.get("Content-Length")
+            if length is None:
+                return False
+            if self.blob_cache is not None:
+                cache_writer = self.blob_cache.open_writer(
+                    self.origin_file, size=int(length)
+                )
+            else:
+                cache_writer = nullcontext()
+            with cache_writer as cache_fp:
+                file_spec = flywheel.FileSpec(
+                    self.sanitized_name,
+                    contents=DownloadStream(response, int(length), tee_fp=cache_fp),
+                )
+                self.upload(export_parent, file_spec)
+            EXPORT_METRICS.add_count("bytes_downloaded", int(length))
+            EXPORT_METRICS.add_count("bytes_uploaded", int(length))
+        finally:
+            response.close()
+        return True
+
+    def warn_if_sanitized(self):
+        """Log a warning if the file is exported with a sanitized name"""
         if self.origin_file.name != self.sanitized_name:
             warn_str = (
                 f"{self.origin_file.name} is not a valid file name. Using "
                 f"{self.sanitized_name}"
             )
             self.log.warning(warn_str)
+
+    @EXPORT_METRICS.timed("download")
+    def download(self, download_dirpath):
+        """
+        Download the file to download_dirpath as self.sanitized_name, from
+            self.blob_cache if it contains the file
+        Args:
+            download_dirpath (str): the path of the directory to which to
+                download the file
+        """
+        self.warn_if_sanitized()
         download_path = os.path.join(download_dirpath, self.sanitized_name)
+        if self.blob_cache is not None and self.blob_cache.get(
+            self.origin_file, download_path
+        ):
+            # copies from the cache are not counted as downloaded bytes
+            return download_path
         self.origin_file.download(download_path)
+        EXPORT_METRICS.add_count("bytes_downloaded", self.get_file_size(download_path))
+        if self.blob_cache is not None:
+            self.blob_cache.put(self.origin_file, download_path)
         return download_path
 
+    @EXPORT_METRICS.timed("upload")
     def upload(self, destination_container, local_filepath):
         """
         Upload the file at local_filepath to destination_container with the
@@ -847,14 +1686,28 @@ class FileExporter:
         Args:
             destination_container (ContainerBase): the container to which to upload
                 the file
-            local_filepath (str): path to a local copy of the file
+            local_filepath (str or flywheel.FileSpec): path to a local copy
+                of the file or FileSpec streaming its contents
 
         """
-        return self._upload_function(
+        result = self._upload_function(
             container_id=destination_container.id,
             file=local_filepath,
             metadata=self.get_file_upload_metadata_str(),
         )
+        # streamed uploads are counted by self.stream_file_copy
+        if isinstance(local_filepath, str):
+            upload_size = self.get_file_size(local_filepath)
+            EXPORT_METRICS.add_count("bytes_uploaded", upload_size)
+        return result
+
+    @staticmethod
+    def get_file_size(local_filepath):
+        """Get the size in bytes of the file at local_filepath, 0 if missing"""
+        try:
+            return os.path.getsize(local_filepath)
+        except OSError:
+            return 0
 
     def get_file_upload_metadata_str(self):
         """
@@ -913,6 +1766,243 @@ class FileExporter:
         return classification_copy
 
 
+class ClassificationSchemaCache:
+    """
+    Cache of modality classification schemas. Modalities without a schema
+        (404) are cached as an empty dict so that they are only requested once.
+    """
+
+    def __init__(self, ttl=None):
+        """
+        Args:
+            ttl (float or None): seconds after which a cached schema expires,
+                None to never expire
+        """
+        self.ttl = ttl
+        self._schemas = dict()
+        self._lock = threading.Lock()
+
+    def _get_cached(self, modality):
+        """Return (hit, schema) for modality"""
+        with self._lock:
+            entry = self._schemas.get(modality)
+        if entry is None:
+            return False, None
+        schema, cached_at = entry
+        if self.ttl is not None and time.monotonic() - cached_at > self.ttl:
+            return False, None
+        return True, schema
+
+    def set(self, modality, schema):
+        """Cache schema as the classification schema for modality"""
+        with self._lock:
+            self._schemas[modality] = (schema, time.monotonic())
+
+    def clear(self):
+        """Remove all cached schemas"""
+        with self._lock:
+            self._schemas.clear()
+
+    def get(self, fw_client, modality):
+        """
+        Get the classification schema for modality, requesting it with
+            FileExporter.get_classification_schema if it is not cached
+        Args:
+            fw_client (flywheel.Client): the flywheel client
+            modality (str): the modality for which to get the schema
+        Returns:
+            dict: the classification schema dictionary
+        """
+        if not modality:
+            return dict()
+        hit, schema = self._get_cached(modality)
+        if not hit:
+            schema = FileExporter.get_classification_schema(fw_client, modality)
+            self.set(modality, schema)
+        return schema
+
+    def prefetch(self, fw_client):
+        """
+        Cache the classification schemas of all modalities with a single
+            request. Failures are logged and schemas are then retrieved per
+            modality by self.get
+        Args:
+            fw_client (flywheel.Client): the flywheel client
+        """
+        try:
+            modalities = fw_client.get_all_modalities()
+        except flywheel.rest.ApiException:
+            log.warning("Could not prefetch modality classifications", exc_info=True)
+            return
+        for modality in modalities:
+            self.set(modality.id, modality.get("classification"))
+
+
+CLASSIFICATION_SCHEMA_CACHE = ClassificationSchemaCache()
+
+
+class FileCopyIndex:
+    """
+    Index of the files on an export container keyed by (origin_id, name), shared
+        by the FileExporters exporting to that container
+    """
+
+    def __init__(self, file_entries=None):
+        """
+        Args:
+            file_entries (list or None): FileEntry objects to index
+        """
+        self._index = dict()
+        self._lock = threading.Lock()
+        for file_entry in file_entries or []:
+            self.add(file_entry)
+
+    @classmethod
+    def from_container(cls, container):
+        """Initialize a FileCopyIndex from the files on container"""
+        return cls(container.files)
+
+    @staticmethod
+    def get_origin_id(file_entry):
+        """Get info.export.origin_id for file_entry (None if not defined)"""
+        info = file_entry.info or dict()
+        return (info.get("export") or dict()).get("origin_id")
+
+    def add(self, file_entry):
+        """Add file_entry to the index if it has an export origin_id"""
+        origin_id = self.get_origin_id(file_entry)
+        if origin_id:
+            with self._lock:
+                self._index[(origin_id, file_entry.name)] = file_entry
+
+    def find(self, origin_id, names):
+        """
+        Find the indexed file with origin_id and one of names
+
+        Args:
+            origin_id (str): the hashed id of the origin file
+            names (iterable): acceptable names for the file copy
+
+        Returns:
+            flywheel.FileEntry or None (if not found)
+        """
+        for name in names:
+            file_entry = self._index.get((origin_id, name))
+            if file_entry is not None:
+                return file_entry
+
+
+class ContainerCopyIndex:
+    """
+    Index of the child containers of an export parent created during the
+        export keyed by info.export.origin_id, shared by the exports of the
+        origin parent's children
+    """
+
+    def __init__(self, containers=None):
+        """
+        Args:
+            containers (list or None): containers to index
+        """
+        self._index = dict()
+        self._lock = threading.Lock()
+        # False if a container was added without its info, in which case a
+        # copy missing from the index may still exist
+        self.complete = True
+        for container in containers or []:
+            self.add(container)
+
+    def add(self, container):
+        """Add container to the index if it has an export origin_id"""
+        if container.info is None:
+            self.complete = False
+            return
+        origin_id = FileCopyIndex.get_origin_id(container)
+        if origin_id:
+            with self._lock:
+                self._index[origin_id] = container
+
+    def find(self, origin_id):
+        """
+        Find the indexed container with origin_id
+
+        Args:
+            origin_id (str): the hashed id of the origin container
+
+        Returns:
+            ContainerBase or None (if not found)
+        """
+        return self._index.get(origin_id)
+
+
+class ContainerCache:
+    """
+    Containers retrieved from the API, cached by container type and id for the
+        life of the export
+    """
+
+    def __init__(self):
+        self._containers = dict()
+        self._lock = threading.Lock()
+
+    def add(self, container):
+        """Add container to the cache"""
+        with self._lock:
+            self._containers[(container.container_type, container.id)] = container
+
+    def get(self, fw_client, container_type, container_id):
+        """
+        Get the container with container_id, retrieving it with
+            ContainerHierarchy._get_container if it is not cached
+        Args:
+            fw_client (flywheel.Client): the flywheel client
+            container_type (str): the container type of the container with container_id
+            container_id (str): the Flywheel id of the container to retrieve
+
+        Returns:
+            ContainerBase or None: the container with container_id
+        """
+        if container_id is None:
+            return None
+        with self._lock:
+            container = self._containers.get((container_type, container_id))
+        if container is None:
+            container = ContainerHierarchy._get_container(
+                fw_client, container_type, container_id
+            )
+            with self._lock:
+                self._containers[(container_type, container_id)] = container
+        return container
+
+    def get_many(self, fw_client, container_ids):
+        """
+        Get several containers, retrieving those that are not cached
+            concurrently
+        Args:
+            fw_client (flywheel.Client): the flywheel client
+            container_ids (dict): container type: container id key-value pairs
+
+        Returns:
+            dict: container type: container key-value pairs
+        """
+        if len(container_ids) <= 1:
+            return {
+                container_type: self.get(fw_client, container_type, container_id)
+                for container_type, container_id in container_ids.items()
+            }
+        with ThreadPoolExecutor(max_workers=len(container_ids)) as executor:
+            futures = {
+                container_type: executor.submit(
+                    self.get, fw_client, container_type, container_id
+                )
+                for container_type, container_id in container_ids.items()
+            }
+        return {
+            container_type: future.result()
+            for container_type, future in futures.items()
+        }
+
+
 class ContainerHierarchy:
     """
     Class that presents access to parent containers represented in the dictionary
@@ -928,30 +2018,41 @@ class ContainerHierarchy:
         self.session = kwargs.get("session")
         self.acquisition = kwargs.get("acquisition")
         self._container_type = None
-        self._dicom_map = dict()
-        self._path = None
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name in self.order_tuple:
+            # Cached values depend on the containers in the hierarchy
+            super().__setattr__("_dicom_map", None)
+            super().__setattr__("_compatible_dicom_map", None)
+            super().__setattr__("_path", None)
 
     def __deepcopy__(self, memodict={}):
         return ContainerHierarchy.from_dict(self.to_dict())
 
     @classmethod
-    def from_container(cls, fw_client, container):
+    def from_container(cls, fw_client, container, container_cache=None):
         """
-        Initialize an ContainerHierarchy instance for container
+        Initialize an ContainerHierarchy instance for container. Parent
+            containers are retrieved concurrently.
         Args:
             fw_client (flywheel.Client): the flywheel client
             container (ContainerBase): the container for which to initialize
                 a ContainerHierarchy instance
+            container_cache (ContainerCache or None): cache from which to
+                retrieve parent containers (and to which to add them)
 
         Returns:
             ContainerHierarchy
         """
-        init_kwargs = dict()
-        for parent_type, parent_id in container.parents.items():
-            if parent_id is not None:
-                init_kwargs[parent_type] = cls._get_container(
-                    fw_client, parent_type, parent_id
-                )
+        if container_cache is None:
+            container_cache = ContainerCache()
+        parents = {
+            parent_type: parent_id
+            for parent_type, parent_id in container.parents.items()
+            if parent_id is not None
+        }
+        init_kwargs = container_cache.get_many(fw_client, parents)
         init_kwargs[container.container_type] = container
         return cls(**init_kwargs)
 
@@ -1010,13 +2111,22 @@ class ContainerHierarchy:
     def dicom_map(self):
         """
         The dictionary to use for map_flywheel_to_dicom, a dictionary with
-            DICOM header tag, DICOM header tag value key-value pairs
+            DICOM header tag, DICOM header tag value key-value pairs. Computed
+            once per hierarchy and shared, so it must not be modified.
         """
-        self._dicom_map = self.get_dicom_map_dict(
-            self.acquisition, self.session, self.subject
-        )
+        if self._dicom_map is None:
+            self._dicom_map = self.get_dicom_map_dict(
+                self.acquisition, self.session, self.subject
+            )
         return self._dicom_map
 
+    @property
+    def compatible_dicom_map(self):
+        """self.dicom_map with values fixed based on the DICOM tag VMs"""
+        if self._compatible_dicom_map is None:
+            self._compatible_dicom_map = get_compatible_fw_header(self.dicom_map)
+        return self._compatible_dicom_map
+
     @property
     def path(self):
         """
@@ -1122,7 +2232,8 @@ class ContainerHierarchy:
     def get_parent_hierarchy(self):
         """Get an ContainerHierarchy instance for self.parent"""
         hierarchy_dict = self.to_dict()
-        hierarchy_dict.pop(self._container_type)
+        # container_type resolves the type of a hierarchy that was not accessed
+        hierarchy_dict.pop(self.container_type)
         return ContainerHierarchy.from_dict(hierarchy_dict)
 
     def to_dict(self):
@@ -1,20 +1,61 @@
+import copy
+import io
 import logging
+import math
+import multiprocessing
 import os
+import struct
 import tempfile
 import zipfile
-from collections import namedtuple
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import partial
 from pprint import pformat
 
 import pydicom
 from flywheel_metadata.file.dicom.fixer import fw_pydicom_config
+from pydicom.charset import default_encoding
 from pydicom.datadict import dictionary_VR, keyword_dict
+from pydicom.filebase import DicomBytesIO
+from pydicom.filewriter import correct_ambiguous_vr_element, write_data_element
 
-from dicom_metadata import get_compatible_fw_header, get_header_dict_list
-from util import get_dict_list_common_dict
+from dicom_metadata import (
+    PYDICOM_CONFIG_LOCK,
+    get_compatible_fw_header,
+    get_header_dict_list,
+    get_zip_header_dict_list,
+    is_header_keyword,
+)
+from instrumentation import EXPORT_METRICS
+from util import DictListTable
 
 
 log = logging.getLogger(__name__)
 
+# fw_pydicom_config kwargs used for the single-pass edit, the first
+# configuration attempted by get_dicom_save_config_kwargs
+SINGLE_PASS_CONFIG_KWARGS = {"use_fw_callback": False}
+# Size of the chunks in which zip member data is copied
+ZIP_COPY_CHUNK_SIZE = 1024 * 1024
+# Private zipfile.ZipFile attributes with which copy_zip_member_raw registers
+# a copied member
+ZIP_WRITER_ATTRIBUTES = ("fp", "start_dir", "filelist", "NameToInfo", "_didModify")
+# Maximum number of DICOMs submitted to a worker process as a single task
+MAX_DICOM_CHUNK_SIZE = 16
+
+
+@contextmanager
+def locked_pydicom_config(**fw_config_kwargs):
+    """
+    fw_pydicom_config holding PYDICOM_CONFIG_LOCK, so that no other thread
+        reads or writes a DICOM until pydicom.config is restored
+    Args:
+        **fw_config_kwargs: kwargs to pass to fw_pydicom_config
+    """
+    with PYDICOM_CONFIG_LOCK, fw_pydicom_config(**fw_config_kwargs):
+        yield
+
 
 def write_dcm_to_tempfile(dicom_ds):
     """
@@ -37,7 +78,7 @@ def write_dcm_at_path_to_temp_with_config(dicom_path, **fw_config_kwargs):
         dicom_path (str or path-like): path to the DICOM to save to a tempfile
         **fw_config_kwargs: kwargs to pass to fw_pydicom_config
     """
-    with fw_pydicom_config(**fw_config_kwargs):
+    with locked_pydicom_config(**fw_config_kwargs):
         dcm = pydicom.dcmread(dicom_path, force=True)
         write_dcm_to_tempfile(dcm)
 
@@ -65,7 +106,7 @@ def get_dicom_save_config_kwargs(dicom_path):
             with any known config kwargs
     """
     log.debug("Getting save configuration for %s", dicom_path)
-    default_pydicom_config = {"use_fw_callback": False}
+    default_pydicom_config = SINGLE_PASS_CONFIG_KWARGS
     fw_fixer_config = {"callback": character_set_callback, "fix_vm1_strings": False}
     fw_fixer_un_vr_config = {
         "callback": character_set_callback,
@@ -102,7 +143,7 @@ def can_update_dicom_tag(dicom_path, tag_keyword, tag_value, **fw_config_kwargs)
     if not pydicom.datadict.tag_for_keyword(tag_keyword):
         log.error("Unknown DICOM keyword: %s. Tag will not be added.", tag_keyword)
         return can_update_tag
-    with fw_pydicom_config(**fw_config_kwargs):
+    with locked_pydicom_config(**fw_config_kwargs):
         dcm = pydicom.dcmread(dicom_path, force=True)
     if tag_keyword in dcm:
         # We could have decode problems with the current tag/value
@@ -128,7 +169,7 @@ def can_update_dicom_tag(dicom_path, tag_keyword, tag_value, **fw_config_kwargs)
     )
     try:
         setattr(dcm, tag_keyword, tag_value)
-        with fw_pydicom_config(**fw_config_kwargs):
+        with locked_pydicom_config(**fw_config_kwargs):
             write_dcm_to_tempfile(dcm)
         can_update_tag = True
     except:
@@ -172,9 +213,141 @@ def can_update_dicom(dicom_path, update_dict, fw_config_kwargs):
         return True
 
 
-def edit_dicom(dicom_path, update_dict):
+def can_encode_dataset_element(dicom_ds, tag_keyword):
+    """
+    Determine whether the data element for tag_keyword can be encoded with
+        the transfer syntax and character set of dicom_ds. Only the element is
+        serialized (to memory), so pixel data is never written.
+    Args:
+        dicom_ds (pydicom.Dataset): the dataset containing tag_keyword
+        tag_keyword: keyword of the public DICOM tag to encode
+
+    Returns:
+        bool: whether the data element can be written
+    """
+    fp = DicomBytesIO()
+    fp.is_little_endian = dicom_ds.is_little_endian in (True, None)
+    fp.is_implicit_VR = bool(dicom_ds.is_implicit_VR)
+    encodings = dicom_ds.get("SpecificCharacterSet", default_encoding)
+    try:
+        data_element = correct_ambiguous_vr_element(
+            dicom_ds[tag_keyword], dicom_ds, fp.is_little_endian
+        )
+        write_data_element(fp, data_element, encodings)
+        return True
+    except:
+        log.debug("Cannot encode %s", tag_keyword, exc_info=True)
+        return False
+
+
+def update_dataset(dicom_ds, update_dict):
+    """
+    Set the DICOM tags in update_dict on dicom_ds, checking that each updated
+        data element can be encoded
+    Args:
+        dicom_ds (pydicom.Dataset): the dataset to update in place
+        update_dict (dict): dictionary with DICOM tag keyword:update value key:value
+            pairs
+
+    Returns:
+        list: keywords of the tags that could not be updated (empty on success)
     """
-    Edit the DICOM file at dicom_path according to  update_dict
+    error_tags = list()
+    for tag_keyword, tag_value in update_dict.items():
+        if not pydicom.datadict.tag_for_keyword(tag_keyword):
+            log.error("Unknown DICOM keyword: %s. Tag will not be added.", tag_keyword)
+            error_tags.append(tag_keyword)
+            continue
+        try:
+            setattr(dicom_ds, tag_keyword, tag_value)
+        except:
+            log.debug("Cannot set %s as %s", tag_keyword, str(tag_value), exc_info=True)
+            error_tags.append(tag_keyword)
+            continue
+        if not can_encode_dataset_element(dicom_ds, tag_keyword):
+            error_tags.append(tag_keyword)
+    return error_tags
+
+
+def save_dataset_replacing_path(dicom_ds, dicom_path):
+    """
+    Save dicom_ds to a tempfile next to dicom_path and move it over dicom_path
+        so that a failed write never leaves a truncated file behind
+    Args:
+        dicom_ds (pydicom.Dataset): Dataset object to save
+        dicom_path (str or path-like): path of the file to replace
+    """
+    dicom_dir = os.path.dirname(os.path.abspath(dicom_path))
+    with tempfile.NamedTemporaryFile(
+        dir=dicom_dir, suffix=".dcm", delete=False
+    ) as tempf:
+        temp_path = tempf.name
+    try:
+        dicom_ds.save_as(temp_path)
+        os.replace(temp_path, dicom_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def get_updated_dataset(dicom_file, update_dict):
+    """
+    Read the DICOM dicom_file and apply update_dict to it in memory
+    Args:
+        dicom_file (str or path-like or file-like): the DICOM to read
+        update_dict (dict): dictionary with DICOM tag keyword:update value key:value
+            pairs
+
+    Returns:
+        None or pydicom.Dataset: the updated dataset, None if the file cannot be
+            read or one or more tags cannot be updated
+    """
+    try:
+        dcm = pydicom.dcmread(dicom_file, force=True)
+    except:
+        log.debug("Cannot read DICOM", exc_info=True)
+        return None
+    error_tags = update_dataset(dcm, update_dict)
+    if error_tags:
+        log.debug(
+            "The following tags cannot be updated in a single pass: %s",
+            str(error_tags),
+        )
+        return None
+    return dcm
+
+
+def edit_dicom_single_pass(dicom_path, update_dict):
+    """
+    Edit the DICOM file at dicom_path according to update_dict, reading and
+        writing the file once. Updates are validated against the in-memory
+        dataset rather than by saving tempfiles.
+    Args:
+        dicom_path (str or path-like): path to the DICOM file to edit
+        update_dict (dict): dictionary with DICOM tag keyword:update value key:value
+            pairs
+
+    Returns:
+        None or str: path to the edited file on success, None on failure
+    """
+    with locked_pydicom_config(**SINGLE_PASS_CONFIG_KWARGS):
+        dcm = get_updated_dataset(dicom_path, update_dict)
+        if dcm is None:
+            return None
+        try:
+            save_dataset_replacing_path(dcm, dicom_path)
+            log.debug("Sucessfully saved edited %s", dicom_path)
+            return dicom_path
+        except:
+            log.debug("Single-pass edit failed for %s", dicom_path, exc_info=True)
+            return None
+
+
+def edit_dicom_with_probing(dicom_path, update_dict):
+    """
+    Edit the DICOM file at dicom_path according to update_dict, first probing
+        for a fw_pydicom_config configuration with which the file can be saved
+        and testing each tag update by saving to a tempfile
     Args:
         dicom_path (str or path-like): path to the DICOM file to edit
         update_dict (dict): dictionary with DICOM tag keyword:update value key:value
@@ -192,7 +365,7 @@ def edit_dicom(dicom_path, update_dict):
     if not can_update_dicom(dicom_path, update_dict, fw_config_kwargs):
         log.error("%s cannot be updated", dicom_path)
         return None
-    with fw_pydicom_config(**fw_config_kwargs):
+    with locked_pydicom_config(**fw_config_kwargs):
         try:
             dcm = pydicom.dcmread(dicom_path, force=True)
             for key, value in update_dict.items():
@@ -205,6 +378,202 @@ def edit_dicom(dicom_path, update_dict):
             return None
 
 
+def edit_dicom(dicom_path, update_dict):
+    """
+    Edit the DICOM file at dicom_path according to  update_dict. A single-pass
+        edit is attempted first, falling back to edit_dicom_with_probing if it
+        fails.
+    Args:
+        dicom_path (str or path-like): path to the DICOM file to edit
+        update_dict (dict): dictionary with DICOM tag keyword:update value key:value
+            pairs
+
+    Returns:
+        None or str: path to the edited file on success, None on failure
+    """
+    edited_path = edit_dicom_single_pass(dicom_path, update_dict)
+    if edited_path is None:
+        log.debug("Falling back to probing edit for %s", dicom_path)
+        edited_path = edit_dicom_with_probing(dicom_path, update_dict)
+    return edited_path
+
+
+def edit_dicom_bytes(dicom_bytes, update_dict):
+    """
+    Edit the DICOM dicom_bytes in memory according to update_dict, falling back
+        to edit_dicom on a tempfile if the single-pass edit fails
+    Args:
+        dicom_bytes (bytes): the content of the DICOM file to edit
+        update_dict (dict): dictionary with DICOM tag keyword:update value key:value
+            pairs
+
+    Returns:
+        None or bytes: content of the edited DICOM on success, None on failure
+    """
+    with locked_pydicom_config(**SINGLE_PASS_CONFIG_KWARGS):
+        dcm = get_updated_dataset(io.BytesIO(dicom_bytes), update_dict)
+        if dcm is not None:
+            try:
+                out_fp = io.BytesIO()
+                dcm.save_as(out_fp)
+                return out_fp.getvalue()
+            except:
+                log.debug("Single-pass edit failed", exc_info=True)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_path = os.path.join(temp_dir, "edit.dcm")
+        with open(temp_path, "wb") as temp_fp:
+            temp_fp.write(dicom_bytes)
+        if edit_dicom_with_probing(temp_path, update_dict) is None:
+            return None
+        with open(temp_path, "rb") as temp_fp:
+            return temp_fp.read()
+
+
+def strip_zip64_extra(extra):
+    """Remove the ZIP64 extended information fields from a zip extra field"""
+    stripped = b""
+    idx = 0
+    while idx + 4 <= len(extra):
+        field_id, field_size = struct.unpack("<HH", extra[idx : idx + 4])
+        field_end = idx + 4 + field_size
+        if field_id != 1:
+            stripped += extra[idx:field_end]
+        idx = field_end
+    return stripped
+
+
+def can_copy_zip_member_raw(src_zipf, dst_zipf):
+    """
+    Whether the private zipfile internals used by copy_zip_member_raw are
+        available in this Python version and dst_zipf has no open write handle
+    """
+    return (
+        all(hasattr(zipfile, name) for name in ("structFileHeader", "sizeFileHeader"))
+        and hasattr(zipfile.ZipInfo, "header_offset")
+        and hasattr(zipfile.ZipInfo, "FileHeader")
+        and getattr(src_zipf, "fp", None) is not None
+        and all(hasattr(dst_zipf, name) for name in ZIP_WRITER_ATTRIBUTES)
+        and getattr(dst_zipf, "_writing", True) is False
+    )
+
+
+def copy_zip_member_raw(src_zipf, dst_zipf, zinfo):
+    """
+    Copy the member zinfo of src_zipf to dst_zipf without decompressing and
+        recompressing its data. Falls back to recompressing the member if the
+        zipfile internals it relies on are not available.
+    Args:
+        src_zipf (zipfile.ZipFile): archive opened for reading
+        dst_zipf (zipfile.ZipFile): archive opened for writing
+        zinfo (zipfile.ZipInfo): the src_zipf member to copy
+    """
+    if not can_copy_zip_member_raw(src_zipf, dst_zipf):
+        dst_info = copy.copy(zinfo)
+        dst_info.extra = strip_zip64_extra(zinfo.extra)
+        dst_zipf.writestr(dst_info, src_zipf.read(zinfo))
+        return
+    src_fp = src_zipf.fp
+    src_fp.seek(zinfo.header_offset)
+    local_header = struct.unpack(
+        zipfile.structFileHeader, src_fp.read(zipfile.sizeFileHeader)
+    )
+    # Skip the local file name and extra field to get to the member data
+    src_fp.seek(local_header[-2] + local_header[-1], os.SEEK_CUR)
+
+    dst_info = copy.copy(zinfo)
+    # FileHeader adds a ZIP64 field when needed
+    dst_info.extra = strip_zip64_extra(zinfo.extra)
+    # Sizes and CRC are known, so no data descriptor follows the data
+    dst_info.flag_bits &= ~0x08
+    dst_fp = dst_zipf.fp
+    dst_fp.seek(dst_zipf.start_dir)
+    dst_info.header_offset = dst_fp.tell()
+    dst_fp.write(dst_info.FileHeader())
+    remaining = zinfo.compress_size
+    while remaining > 0:
+        chunk = src_fp.read(min(remaining, ZIP_COPY_CHUNK_SIZE))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Truncated member {zinfo.filename}")
+        dst_fp.write(chunk)
+        remaining -= len(chunk)
+    # Register the member so that it is written to the central directory
+    dst_zipf.start_dir = dst_fp.tell()
+    dst_zipf.filelist.append(dst_info)
+    dst_zipf.NameToInfo[dst_info.filename] = dst_info
+    dst_zipf._didModify = True
+
+
+def get_chunk_size(item_count, max_workers):
+    """
+    Get the number of items to submit per task so that each worker gets
+        several tasks (for load balancing) without exceeding MAX_DICOM_CHUNK_SIZE
+    """
+    return max(1, min(MAX_DICOM_CHUNK_SIZE, math.ceil(item_count / (max_workers * 4))))
+
+
+def get_dicom_process_pool(max_workers):
+    """
+    Get a process pool for reading and editing DICOMs. Worker processes are
+        spawned rather than forked since the pool is used from the export's
+        worker threads, and a forked child inherits the locks (i.e. logging
+        handler and connection pool locks) that other threads hold.
+    Args:
+        max_workers (int): number of worker processes
+
+    Returns:
+        concurrent.futures.ProcessPoolExecutor
+    """
+    return ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+def iter_chunk_results(chunk_func, items, max_workers, executor=None):
+    """
+    Apply chunk_func to chunks of items in a process pool and yield the results
+        for each item in the order of items. At most 2 * max_workers chunks are
+        in flight so that results (i.e. edited DICOM bytes) do not accumulate.
+    Args:
+        chunk_func (callable): picklable function taking a list of items and
+            returning a list with a result per item
+        items (list): the items to process
+        max_workers (int): number of worker processes
+        executor (ProcessPoolExecutor or None): the process pool to use (see
+            get_dicom_process_pool), a pool is created for the call if None
+
+    Yields:
+        the result for each item
+    """
+    if executor is None:
+        with get_dicom_process_pool(max_workers) as executor:
+            yield from iter_chunk_results(chunk_func, items, max_workers, executor)
+        return
+    chunk_size = get_chunk_size(len(items), max_workers)
+    pending = deque()
+    for idx in range(0, len(items), chunk_size):
+        pending.append(executor.submit(chunk_func, items[idx : idx + chunk_size]))
+        if len(pending) >= 2 * max_workers:
+            yield from pending.popleft().result()
+    while pending:
+        yield from pending.popleft().result()
+
+
+def edit_dicom_list(update_dict, dicom_path_list):
+    """edit_dicom for each path in dicom_path_list (a process pool task)"""
+    return [edit_dicom(dicom_path, update_dict) for dicom_path in dicom_path_list]
+
+
+def edit_zip_members(zip_path, update_dict, member_list):
+    """
+    edit_dicom_bytes for each member of the zip at zip_path in member_list
+        (a process pool task)
+    """
+    with zipfile.ZipFile(zip_path) as zipf:
+        return [
+            edit_dicom_bytes(zipf.read(member), update_dict) for member in member_list
+        ]
+
+
 class DicomUpdater:
     """
     Class for comparing and updating DICOM files against Flywheel DICOM metadata
@@ -212,7 +581,14 @@ class DicomUpdater:
 
     exclude_vrs = ("OF", "SQ", "UI", None)
 
-    def __init__(self, dicom_path_list, flywheel_header, files_log):
+    def __init__(
+        self,
+        dicom_path_list,
+        flywheel_header,
+        files_log,
+        max_workers=1,
+        executor=None,
+    ):
         """
 
         Args:
@@ -221,12 +597,23 @@ class DicomUpdater:
             flywheel_header (dict): flywheel dicom metadata to use for comparison
                 and update of DICOM files in dicom_path_list
             files_log (logging.Logger): logger to use
+            max_workers (int): number of processes to use for reading headers
+                and editing DICOMs (1 reads and edits in this process)
+            executor (ProcessPoolExecutor or None): process pool shared across
+                updaters (see get_dicom_process_pool), a pool is created per
+                read or edit if None and max_workers > 1
         """
         self.dicom_path_list = dicom_path_list
         self.log = files_log
+        self.max_workers = max_workers or 1
+        self.executor = executor
         # Backwards compatibility for VM strings
-        self.fw_header = get_compatible_fw_header(flywheel_header)
+        fw_header = get_compatible_fw_header(flywheel_header)
+        # Local headers are read up to PixelData, so tags after it (i.e.
+        # DataSetTrailingPadding) cannot be compared
+        self.fw_header = {k: v for k, v in fw_header.items() if is_header_keyword(k)}
         self._dicom_dict_list = None
+        self._header_table = None
         self._local_common_dicom_dict = None
         self._local_dicom_tags = None
         self._header_diff_dict = None
@@ -236,26 +623,63 @@ class DicomUpdater:
     @property
     def dicom_dict_list(self):
         """
-        List of dictionaries representing the local DICOM headers for the files
-            in self.dicom_path_list + a `path` key. Files without public DICOM
-            tags are excluded from this list.
+        List of dictionaries representing the local DICOM headers (up to
+            PixelData) for the files in self.dicom_path_list + a `path` key.
+            Files without public DICOM tags are excluded from this list.
 
         """
         if not isinstance(self._dicom_dict_list, list):
-            self._dicom_dict_list = get_header_dict_list(self.dicom_path_list)
+            with EXPORT_METRICS.stage("header_parse"):
+                self._dicom_dict_list = self.map_dicoms(
+                    get_header_dict_list, self.dicom_path_list
+                )
         return self._dicom_dict_list
 
+    @property
+    def use_process_pool(self):
+        """whether DICOMs are read and edited in a process pool"""
+        return self.max_workers > 1 and len(self.dicom_path_list) > 1
+
+    def map_dicoms(self, chunk_func, items):
+        """
+        Apply chunk_func to items, in a process pool if self.use_process_pool
+        Args:
+            chunk_func (callable): picklable function taking a list of items and
+                returning a list of results
+            items (list): the items to process
+
+        Returns:
+            list: the concatenated results of chunk_func
+        """
+        if self.use_process_pool:
+            return list(
+                iter_chunk_results(
+                    chunk_func, items, self.max_workers, executor=self.executor
+                )
+            )
+        return chunk_func(items)
+
     @property
     def non_dicom_paths(self):
         """paths from the list to files that do not contain public DICOM tags"""
         dict_paths = {idict.get("path") for idict in self.dicom_dict_list}
         return [path for path in self.dicom_path_list if path not in dict_paths]
 
+    @property
+    def header_table(self):
+        """
+        DictListTable of self.dicom_dict_list, from which the common and
+            defined tags of the local DICOMs are computed in a single pass
+        """
+        if not isinstance(self._header_table, DictListTable):
+            self._header_table = DictListTable(self.dicom_dict_list)
+        return self._header_table
+
     @property
     def local_common_dicom_dict(self):
         """dict with local DICOM tags that share the same value across all files."""
         if not isinstance(self._local_common_dicom_dict, dict):
-            common_dict = get_dict_list_common_dict(self.dicom_dict_list)
+            common_dict = self.header_table.common_dict
             # Remove non-dicom tags such as path for list of 1 file
             common_dict = {k: v for k, v in common_dict.items() if k in keyword_dict}
             self._local_common_dicom_dict = common_dict
@@ -265,8 +689,9 @@ class DicomUpdater:
     def local_dicom_tags(self):
         """List of DICOM tags that are defined in the list of local DICOMs"""
         if not isinstance(self._local_dicom_tags, list):
-            key_list = list(set().union(*(d.keys() for d in self.dicom_dict_list)))
-            self._local_dicom_tags = [key for key in key_list if keyword_dict.get(key)]
+            self._local_dicom_tags = [
+                key for key in self.header_table.keys if keyword_dict.get(key)
+            ]
         return self._local_dicom_tags
 
     @property
@@ -379,9 +804,13 @@ class DicomUpdater:
         if self.safe_to_update:
             dicom_paths = [dcm["path"] for dcm in self.dicom_dict_list]
             if self.update_dict:
-                updated_paths = [
-                    edit_dicom(path, self.update_dict) for path in dicom_paths
-                ]
+                with EXPORT_METRICS.stage("edit"):
+                    updated_paths = self.map_dicoms(
+                        partial(edit_dicom_list, self.update_dict), dicom_paths
+                    )
+                EXPORT_METRICS.add_count(
+                    "dicoms_edited", sum(path is not None for path in updated_paths)
+                )
                 if all(updated_paths):
                     info_str = f"Successfully updated {len(updated_paths)} DICOMs"
                     self.log.info(info_str)
@@ -398,68 +827,46 @@ class DicomUpdater:
                 self.log.info("No DICOM tags to update!")
                 return dicom_paths
 
-    @staticmethod
-    def replace_zip_contents(file_directory_path, file_list, zip_path):
-        """
-        Replace the zip at zip_path with a zip of the files in file_list
-        Args:
-            file_directory_path (str): path to the directory containing the files
-                in file_list
-            file_list (list): absolute paths to the files to add to the zip at
-                zip_path
-            zip_path (str): path to the zip to replace
-
-        Returns:
-            path to the replaced zip
-
-        """
-        # Remove the original if it exists
-        if os.path.exists(zip_path):
-            os.remove(zip_path)
-        with zipfile.ZipFile(
-            zip_path, "w", zipfile.ZIP_DEFLATED, allowZip64=True
-        ) as zipf:
-            for path in file_list:
-                zipf.write(path, os.path.relpath(path, file_directory_path))
-        return zip_path
-
     @classmethod
-    def update_dicom_zip(cls, zip_path, fw_header, files_log):
+    def update_dicom_zip(
+        cls, zip_path, fw_header, files_log, max_workers=1, executor=None
+    ):
         """
         Update the DICOM files within the zip at zip_path to match fw_header
         Args:
             zip_path (str): path to the DICOM zip to update
             fw_header (dict): flywheel's info.header.dicom metadata for the zip
-            files_log (logging.Logger): the log to use for DicomUpdater created
+            files_log (logging.Logger): the log to use for ZipDicomUpdater created
                 for updating the zip DICOM files
+            max_workers (int): number of processes to use for reading headers
+                and editing DICOMs
+            executor (ProcessPoolExecutor or None): shared process pool
 
         Returns:
             None or str: path to the updated zip if update was successful,
                 else None
         """
-        with tempfile.TemporaryDirectory() as temp_dir:
-            with zipfile.ZipFile(zip_path) as zipf:
-                extracted_files = [
-                    os.path.join(temp_dir, rel_path.filename)
-                    for rel_path in zipf.infolist()
-                    if not rel_path.is_dir()
-                ]
-                zipf.extractall(temp_dir)
-            updater = cls(extracted_files, fw_header, files_log)
-            res = updater.update_dicoms()
-            if not res:
-                return None
-            else:
-                return cls.replace_zip_contents(temp_dir, extracted_files, zip_path)
+        updater = ZipDicomUpdater(
+            zip_path, fw_header, files_log, max_workers, executor=executor
+        )
+        res = updater.update_dicoms()
+        if not res:
+            return None
+        else:
+            return zip_path
 
     @classmethod
-    def update_fw_dicom(cls, dicom_path, fw_header):
+    def update_fw_dicom(cls, dicom_path, fw_header, max_workers=1, executor=None):
         """
         Update the DICOM file/zip to match fw_header
         Args:
             dicom_path (str): path to the DICOM file/zip to update
             fw_header (dict): flywheel's info.header.dicom metadata for the
                 DICOM file/zip
+            max_workers (int): number of processes to use for reading headers
+                and editing the DICOMs of a zip
+            executor (ProcessPoolExecutor or None): process pool shared across
+                files (see get_dicom_process_pool)
 
         Returns:
              None or str: path to the updated DICOM file/zip if update was
@@ -467,7 +874,9 @@ class DicomUpdater:
         """
         files_log = logging.getLogger(os.path.basename(dicom_path))
         if zipfile.is_zipfile(dicom_path):
-            return cls.update_dicom_zip(dicom_path, fw_header, files_log)
+            return cls.update_dicom_zip(
+                dicom_path, fw_header, files_log, max_workers, executor=executor
+            )
         else:
             updater = cls([dicom_path], fw_header, files_log)
             updated_list = updater.update_dicoms()
@@ -475,3 +884,143 @@ class DicomUpdater:
                 return None
             else:
                 return updated_list[0]
+
+
+class ZipDicomUpdater(DicomUpdater):
+    """
+    DicomUpdater for the DICOM members of a zip archive. Members are read and
+        edited one at a time and streamed to a new archive rather than
+        extracting the archive to disk. Members that are not edited are copied
+        without being decompressed.
+    """
+
+    def __init__(
+        self, zip_path, flywheel_header, files_log, max_workers=1, executor=None
+    ):
+        """
+
+        Args:
+            zip_path (str): path to the DICOM zip to compare against
+                flywheel_header
+            flywheel_header (dict): flywheel dicom metadata to use for comparison
+                and update of the DICOM members of the zip
+            files_log (logging.Logger): logger to use
+            max_workers (int): number of processes to use for reading headers
+                and editing members
+            executor (ProcessPoolExecutor or None): shared process pool
+        """
+        self.zip_path = zip_path
+        with zipfile.ZipFile(zip_path) as zipf:
+            member_list = [
+                zinfo.filename for zinfo in zipf.infolist() if not zinfo.is_dir()
+            ]
+        super().__init__(
+            member_list, flywheel_header, files_log, max_workers, executor=executor
+        )
+
+    @property
+    def dicom_dict_list(self):
+        """
+        List of dictionaries representing the DICOM headers (up to PixelData)
+            of the zip members in self.dicom_path_list + a `path` key with the
+            member name. Members without public DICOM tags are excluded.
+        """
+        if not isinstance(self._dicom_dict_list, list):
+            with EXPORT_METRICS.stage("header_parse"):
+                self._dicom_dict_list = self.map_dicoms(
+                    partial(get_zip_header_dict_list, self.zip_path),
+                    self.dicom_path_list,
+                )
+        return self._dicom_dict_list
+
+    def update_dicoms(self):
+        """
+        Update the DICOM members of the zip to match self.fw_header, replacing
+            the zip at self.zip_path if any member was updated
+
+        Returns:
+            list of member names
+        """
+        if self.safe_to_update:
+            dicom_members = [dcm["path"] for dcm in self.dicom_dict_list]
+            if not self.update_dict:
+                self.log.info("No DICOM tags to update!")
+                return dicom_members
+            updated_members = self.rewrite_zip(set(dicom_members))
+            EXPORT_METRICS.add_count("dicoms_edited", len(updated_members))
+            if len(updated_members) == len(dicom_members):
+                info_str = f"Successfully updated {len(updated_members)} DICOMs"
+                self.log.info(info_str)
+            else:
+                failed_list = list(set(dicom_members) - set(updated_members))
+                warn_str = f"Failed to update {len(failed_list)} DICOMs: {failed_list}"
+                self.log.warning(warn_str)
+            return updated_members
+
+    def iter_edited_members(self, member_list):
+        """
+        Yield the edited bytes (or None on failure) for each member in
+            member_list, edited in worker processes that read the members
+            from self.zip_path
+        """
+        return iter_chunk_results(
+            partial(edit_zip_members, self.zip_path, self.update_dict),
+            member_list,
+            self.max_workers,
+            executor=self.executor,
+        )
+
+    @EXPORT_METRICS.timed("rezip")
+    def rewrite_zip(self, dicom_members):
+        """
+        Stream the members of self.zip_path to a new archive, editing the
+            members in dicom_members with self.update_dict, and replace
+            self.zip_path with it if any member was updated
+        Args:
+            dicom_members (set): names of the members to edit
+
+        Returns:
+            list: names of the members that were updated
+        """
+        updated_members = list()
+        edited_iter = None
+        zip_dir = os.path.dirname(os.path.abspath(self.zip_path))
+        with tempfile.NamedTemporaryFile(
+            dir=zip_dir, suffix=".zip", delete=False
+        ) as tempf:
+            temp_path = tempf.name
+        try:
+            with zipfile.ZipFile(self.zip_path) as src_zipf, zipfile.ZipFile(
+                temp_path, "w", zipfile.ZIP_DEFLATED, allowZip64=True
+            ) as dst_zipf:
+                if self.use_process_pool:
+                    # members are edited in archive order
+                    edited_iter = self.iter_edited_members(
+                        [
+                            zinfo.filename
+                            for zinfo in src_zipf.infolist()
+                            if zinfo.filename in dicom_members
+                        ]
+                    )
+                for zinfo in src_zipf.infolist():
+                    edited_bytes = None
+                    if zinfo.filename in dicom_members and edited_iter:
+                        edited_bytes = next(edited_iter)
+                    elif zinfo.filename in dicom_members:
+                        edited_bytes = edit_dicom_bytes(
+                            src_zipf.read(zinfo), self.update_dict
+                        )
+                    if edited_bytes is None:
+                        copy_zip_member_raw(src_zipf, dst_zipf, zinfo)
+                    else:
+                        edited_info = zipfile.ZipInfo(zinfo.filename, zinfo.date_time)
+                        edited_info.external_attr = zinfo.external_attr
+                        edited_info.compress_type = zipfile.ZIP_DEFLATED
+                        dst_zipf.writestr(edited_info, edited_bytes)
+                        updated_members.append(zinfo.filename)
+            if updated_members:
+                os.replace(temp_path, self.zip_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return updated_members
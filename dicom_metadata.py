@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 import logging
+import os
 import re
 import string
+import threading
+import zipfile
 
 import pydicom
 from pydicom.datadict import DicomDictionary, get_entry, tag_for_keyword
@@ -9,6 +12,16 @@ from pydicom.datadict import DicomDictionary, get_entry, tag_for_keyword
 
 log = logging.getLogger("dicom-metadata")
 
+# Values larger than this are not loaded by read_dicom_header until accessed.
+# Deferred values are read again from the file path, so file-like inputs (i.e.
+# zip members) are always read in full.
+HEADER_DEFER_SIZE = "1 MB"
+PIXEL_DATA_TAG = 0x7FE00010
+# pydicom.config is process-wide, so changes to it (fw_pydicom_config) are made
+# while holding this lock to keep concurrent file and container exports from
+# reading or writing DICOMs with another thread's configuration
+PYDICOM_CONFIG_LOCK = threading.RLock()
+
 
 def assign_type(s):
     """
@@ -297,6 +310,38 @@ def get_compatible_fw_header(fw_header):
     return new_header
 
 
+def read_dicom_header(dcm_path):
+    """
+    Read the header of the DICOM at dcm_path, stopping before the pixel data
+        and deferring the read of large values until they are accessed. Use
+        pydicom.dcmread for a full read (i.e. for editing the file).
+
+    Args:
+        dcm_path (str or path-like or file-like): the DICOM to read. Values
+            of file-like inputs are not deferred since pydicom reads deferred
+            values by reopening the file at their name.
+
+    Returns:
+        pydicom.Dataset: the DICOM header without PixelData
+    """
+    if isinstance(dcm_path, (str, os.PathLike)):
+        defer_size = HEADER_DEFER_SIZE
+    else:
+        defer_size = None
+    return pydicom.dcmread(
+        dcm_path, force=True, stop_before_pixels=True, defer_size=defer_size
+    )
+
+
+def is_header_keyword(keyword):
+    """
+    Whether the tag for keyword precedes PixelData and is therefore read by
+        read_dicom_header (unknown keywords are considered header keywords)
+    """
+    tag = tag_for_keyword(keyword)
+    return tag is None or tag < PIXEL_DATA_TAG
+
+
 def get_header_dict_list(dcm_path_list):
     """
     Get a list of dictionaries representing the headers for the DICOMs at the
@@ -311,10 +356,39 @@ def get_header_dict_list(dcm_path_list):
     """
     dict_list = list()
     for dcm_path in dcm_path_list:
-        dcm = pydicom.dcmread(dcm_path, force=True)
-        data_dict_tmp = get_pydicom_header(dcm)
+        # values are decoded on access, with the pydicom.config of that time
+        with PYDICOM_CONFIG_LOCK:
+            dcm = read_dicom_header(dcm_path)
+            data_dict_tmp = get_pydicom_header(dcm)
         # Exclude files with no public keys (unlikely to be dicoms)
         if data_dict_tmp:
             data_dict_tmp["path"] = dcm_path
             dict_list.append(data_dict_tmp)
     return dict_list
+
+
+def get_zip_header_dict_list(zip_path, member_list):
+    """
+    Get a list of dictionaries representing the headers for the DICOMs stored
+        as member_list in the zip at zip_path, excluding any members without
+        public DICOM tags (unlikely to be DICOM). Members are read from the
+        archive without extracting it.
+
+    Args:
+        zip_path (str): path to the zip archive
+        member_list (list): names of the zip members to read
+
+    Returns:
+        list of dicts representing DICOM headers with the member name as `path`
+    """
+    dict_list = list()
+    with zipfile.ZipFile(zip_path) as zipf:
+        for member in member_list:
+            with zipf.open(member) as dcm_fp, PYDICOM_CONFIG_LOCK:
+                dcm = read_dicom_header(dcm_fp)
+                data_dict_tmp = get_pydicom_header(dcm)
+            # Exclude files with no public keys (unlikely to be dicoms)
+            if data_dict_tmp:
+                data_dict_tmp["path"] = member
+                dict_list.append(data_dict_tmp)
+    return dict_list
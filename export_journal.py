@@ -0,0 +1,248 @@
+import json
+import logging
+import os
+import threading
+from dataclasses import asdict
+
+import flywheel
+
+from export_log import ExportRecord
+from util import hash_value
+
+
+log = logging.getLogger(__name__)
+
+
+class ExportJournal:
+    """
+    Append-only journal of the containers and files exported, one JSON entry per
+        line, used to resume an interrupted export without looking up the
+        completed work via the API. Entries are keyed by the hashed origin id
+        (the same value as the info.export.origin_id of the copies) and record
+        the export project, entries of another export project are ignored.
+    """
+
+    def __init__(self, path, export_project_id=None):
+        """
+        Args:
+            path (str): path of the journal file
+            export_project_id (str or None): id of the project to which the
+                containers are exported
+        """
+        self.path = path
+        self.export_project_id = export_project_id
+        # origin_id -> container entry
+        self.containers = dict()
+        # (container copy id, file origin_id) -> file entry
+        self.files = dict()
+        # origin_id -> ExportRecord of a completed container
+        self.completed = dict()
+        self._lock = threading.Lock()
+        self._file = None
+
+    @classmethod
+    def open(cls, path, resume=True, export_project_id=None):
+        """
+        Load the entries of the journal at path (if it exists) and open it for
+            appending
+        Args:
+            path (str): path of the journal file
+            resume (bool): whether to load the entries of an existing journal,
+                if False it is discarded and a new journal is started
+            export_project_id (str or None): id of the project to which the
+                containers are exported
+
+        Returns:
+            ExportJournal
+        """
+        journal = cls(path, export_project_id=export_project_id)
+        if resume:
+            journal.load()
+        elif os.path.exists(path):
+            log.info("Discarding journal %s", path)
+            os.remove(path)
+        journal._file = open(path, "a")
+        if journal._file.tell() > 0:
+            # terminate a line left incomplete by an interrupted run
+            with open(path, "rb") as fp:
+                fp.seek(-1, os.SEEK_END)
+                if fp.read(1) != b"\n":
+                    journal._file.write("\n")
+        return journal
+
+    def load(self):
+        """Apply the entries of the journal file to the journal, if it exists"""
+        if not os.path.exists(self.path):
+            return
+        ignored = 0
+        with open(self.path) as fp:
+            for line in fp:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    log.warning("Ignoring incomplete journal entry: %s", line)
+                    continue
+                # the copies of another export project cannot be reused
+                if entry.get("export_project_id") != self.export_project_id:
+                    ignored += 1
+                    continue
+                self._apply(entry)
+        if ignored:
+            log.info("Ignoring %d journal entries of another export project", ignored)
+        log.info(
+            "Resuming export from journal %s (%d containers, %d files)",
+            self.path,
+            len(self.containers),
+            len(self.files),
+        )
+
+    def close(self):
+        """Close the journal file"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def discard(self):
+        """
+        Close and delete the journal file, i.e. once the export completed so
+            that the next export in the same output directory is not resumed
+        """
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _apply(self, entry):
+        event = entry.get("event")
+        if event == "container":
+            self.containers[entry["origin_id"]] = entry
+        elif event == "file":
+            self.files[(entry["parent_id"], entry["origin_id"])] = entry
+        elif event == "complete":
+            record = entry["record"]
+            for key in ("_found_files", "_created_files", "_failed_files"):
+                record[key] = tuple(record[key])
+            self.completed[entry["origin_id"]] = ExportRecord(**record)
+
+    def _append(self, entry):
+        entry["export_project_id"] = self.export_project_id
+        with self._lock:
+            line = json.dumps(entry)
+            self._apply(json.loads(line))
+            if self._file is not None:
+                self._file.write(line + "\n")
+                self._file.flush()
+                os.fsync(self._file.fileno())
+
+    def add_container(self, origin_container, container_copy, created):
+        """
+        Record the copy of origin_container found or created during export
+
+        Args:
+            origin_container (ContainerBase): the exported container
+            container_copy (ContainerBase): the copy of origin_container
+            created (bool): whether container_copy was created
+        """
+        self._append(
+            {
+                "event": "container",
+                "origin_id": hash_value(origin_container.id),
+                "container_type": container_copy.container_type,
+                "copy_id": container_copy.id,
+                "label": container_copy.label,
+                "created": created,
+            }
+        )
+
+    def get_container_copy(self, fw_client, origin_container):
+        """
+        Get the journaled copy of origin_container without an API call. Only
+            the id and label of the copy are populated.
+
+        Args:
+            fw_client (flywheel.Client): the client used by the copy's methods
+            origin_container (ContainerBase): the exported container
+
+        Returns:
+            tuple(ContainerBase, bool) or None: the copy and whether it was
+                created, None if no copy was journaled
+        """
+        entry = self.containers.get(hash_value(origin_container.id))
+        if entry is None:
+            return None
+        container_class = getattr(flywheel, entry["container_type"].capitalize())
+        container_copy = container_class(id=entry["copy_id"], label=entry["label"])
+        container_copy._set_context(fw_client)
+        return container_copy, entry["created"]
+
+    def add_file(self, container_copy, origin_id, name, created):
+        """
+        Record the copy of a file exported to container_copy
+
+        Args:
+            container_copy (ContainerBase): the container to which the file was
+                exported
+            origin_id (str): hashed id of the origin file
+            name (str): name of the file copy
+            created (bool): whether the file copy was created
+        """
+        self._append(
+            {
+                "event": "file",
+                "parent_id": container_copy.id,
+                "origin_id": origin_id,
+                "name": name,
+                "created": created,
+            }
+        )
+
+    def get_file(self, container_copy, origin_id):
+        """
+        Get the name of the journaled copy of a file on container_copy
+
+        Returns:
+            tuple(str, bool) or None: the name of the copy and whether it was
+                created, None if no copy was journaled
+        """
+        entry = self.files.get((container_copy.id, origin_id))
+        if entry is None:
+            return None
+        return entry["name"], entry["created"]
+
+    def has_files(self, container_copy, files):
+        """
+        Whether a copy of each of files was journaled on container_copy
+
+        Args:
+            container_copy (ContainerBase): the container to which the files
+                are exported
+            files (list): the origin flywheel.FileEntry objects
+        """
+        return all(
+            (container_copy.id, hash_value(file_entry.id)) in self.files
+            for file_entry in files
+        )
+
+    def complete_container(self, origin_container, record):
+        """
+        Record that origin_container was completely exported
+
+        Args:
+            origin_container (ContainerBase): the exported container
+            record (ExportRecord): the export record of origin_container
+        """
+        self._append(
+            {
+                "event": "complete",
+                "origin_id": hash_value(origin_container.id),
+                "record": asdict(record),
+            }
+        )
+
+    def get_completed_record(self, origin_container):
+        """
+        Get the export record of origin_container if it was completely exported
+
+        Returns:
+            ExportRecord or None
+        """
+        return self.completed.get(hash_value(origin_container.id))
@@ -1,12 +1,36 @@
 import csv
-from dataclasses import dataclass
+import json
+import os
+from dataclasses import dataclass, field
 from pathlib import PurePosixPath
 
 from flywheel.models.mixins import ContainerBase
 
 
+CSV_FIELDNAMES = ["Container", "Name", "Status", "Origin Path", "Export Path"]
+CSV_FILE_FIELDNAMES = ["Found Files", "Created Files", "Failed Files"]
+# Stages of exporting a file timed in the file detail csv
+FILE_STAGES = ("download", "header_parse", "edit", "rezip", "upload")
+FILE_DETAIL_FIELDNAMES = [
+    "Origin Path",
+    "File",
+    "Export Name",
+    "Status",
+    "Bytes Downloaded",
+    "Bytes Uploaded",
+    "DICOMs Edited",
+    *(f"{stage.replace('_', ' ').title()} s" for stage in FILE_STAGES),
+    "Elapsed s",
+]
+
+
 class ExportLog:
-    """Log to record containers exported"""
+    """
+    Log to record containers exported. Records are kept in self.records, or,
+        once the log is opened with self.open, written to the csv (and JSON
+        Lines) log as they are added so that memory stays bounded and the log
+        survives an interrupted export.
+    """
 
     def __init__(self, export_project=None, archive_project=None):
         """
@@ -21,6 +45,12 @@ class ExportLog:
         self.export_project = export_project
         self.created_dict = {"subjects": [], "sessions": [], "acquisitions": []}
         self.records = list()
+        # origin path -> whether the container was moved to archive_project
+        self.archive_results = dict()
+        self.failed_file_count = 0
+        self._writers = list()
+        self.file_records = list()
+        self._file_writer = None
         self.export_path = PurePosixPath(
             f"{export_project.group}/{export_project.label}"
         )
@@ -37,6 +67,28 @@ class ExportLog:
             )
         return self._archive_path
 
+    def get_child_log(self):
+        """
+        Get an empty ExportLog for the same projects, used to collect the
+            records of a child container exported concurrently so that they can
+            be merged back in a deterministic order with self.extend
+        """
+        return ExportLog(self.export_project, self.archive_project)
+
+    def extend(self, other_log):
+        """
+        Append the records and created container ids of other_log to this log
+        Args:
+            other_log (ExportLog): the log to merge into this log
+        """
+        for key, created_ids in other_log.created_dict.items():
+            self.created_dict[key].extend(created_ids)
+        for record in other_log.records:
+            self.add_record(record)
+        for file_record in other_log.file_records:
+            self.add_file_record(file_record)
+        self.archive_results.update(other_log.archive_results)
+
     def add_container_record(
         self,
         origin_path,
@@ -57,6 +109,8 @@ class ExportLog:
             created_files (list): list of files created during export
             failed_files (list): list of files that failed to export
 
+        Returns:
+            ExportRecord: the added record
         """
         if created_copy:
             created_dict_key = container_copy.container_type + "s"
@@ -70,32 +124,222 @@ class ExportLog:
             tuple(created_files),
             tuple(failed_files),
         )
-        self.records.append(record)
+        self.add_record(record)
+        return record
+
+    def add_record(self, record):
+        """
+        Add a record to the log, writing it to the open csv and JSON Lines logs
+            instead of keeping it in self.records if the log was opened
+        Args:
+            record (ExportRecord): the record to add
+        """
+        if record._failed_files:
+            self.failed_file_count += len(record._failed_files)
+        if not self._writers:
+            self.records.append(record)
+            return
+        row = record.get_csv_dict(
+            export_project_path=self.export_path,
+            archive_project_path=self.archive_path,
+        )
+        for writer in self._writers:
+            writer.write(row)
+
+    def add_file_record(self, file_record):
+        """
+        Add the record of a file export to the file detail log, writing it to
+            the open file detail csv instead of keeping it in
+            self.file_records if one was opened
+        Args:
+            file_record (ExportFileRecord): the record to add
+        """
+        if self._file_writer is None:
+            self.file_records.append(file_record)
+        else:
+            self._file_writer.write(file_record.get_csv_dict())
+
+    @property
+    def has_failed_files(self):
+        """Whether any of the containers recorded had files that failed to export"""
+        return self.failed_file_count > 0
+
+    def get_fieldnames(self, archive_project_path=None):
+        """Get the csv columns, with Archive Path if archive_project_path is set"""
+        fieldnames = list(CSV_FIELDNAMES)
+        if archive_project_path:
+            fieldnames.append("Archive Path")
+        return fieldnames + CSV_FILE_FIELDNAMES
+
+    def open(self, csv_path, jsonl_path=None, files_csv_path=None):
+        """
+        Write the records added from now on to csv_path (and jsonl_path, if
+            set) as they are added. Rows include the Archive Path of the
+            records until self.close is called with the outcome of the archive.
+        Args:
+            csv_path (str): path to which to write the csv
+            jsonl_path (str or None): path to which to write the JSON Lines log
+            files_csv_path (str or None): path to which to write the file
+                detail csv
+        """
+        fieldnames = self.get_fieldnames(self.archive_path)
+        self._writers.append(CsvLogWriter(csv_path, fieldnames))
+        if jsonl_path:
+            self._writers.append(JsonLinesLogWriter(jsonl_path, fieldnames))
+        if files_csv_path:
+            self._file_writer = CsvLogWriter(files_csv_path, FILE_DETAIL_FIELDNAMES)
+
+    def close(self, archive_project_path=None):
+        """
+        Close the logs opened by self.open. Unless archive_project_path is set
+            the Archive Path column is removed and, if set, the Archive Path of
+            records of containers that failed to move to the archive project is
+            cleared. Logs are rewritten row by row only if either is needed.
+        Args:
+            archive_project_path (str or None): resolver path of the archive
+                project if the exported containers were archived
+        """
+        if self._file_writer is not None:
+            self._file_writer.close()
+            self._file_writer = None
+        writers, self._writers = self._writers, list()
+        for writer in writers:
+            writer.close()
+            if not self.archive_path:
+                continue
+            if not archive_project_path:
+                writer.rewrite(self.get_fieldnames(), lambda row: row)
+            elif self.failed_archive_paths:
+                writer.rewrite(writer.fieldnames, self._clear_archive_path)
+
+    def _clear_archive_path(self, row):
+        if not self.is_archived(row["Origin Path"]):
+            row["Archive Path"] = ""
+        return row
+
+    def add_archive_result(self, origin_path, archived):
+        """
+        Record the result of moving a container to the archive project
+        Args:
+            origin_path (str): resolver path of the container in the origin project
+            archived (bool): whether the container was moved
+        """
+        self.archive_results[str(origin_path)] = archived
+
+    @property
+    def failed_archive_paths(self):
+        """origin paths of the containers that failed to move to the archive project"""
+        return [path for path, archived in self.archive_results.items() if not archived]
+
+    def is_archived(self, origin_path):
+        """
+        Whether the container at origin_path was not left behind by a failed
+            move to the archive project (i.e. neither it nor a parent failed)
+        """
+        origin_path = str(origin_path)
+        for failed_path in self.failed_archive_paths:
+            if origin_path == failed_path or origin_path.startswith(failed_path + "/"):
+                return False
+        return True
 
     def write_csv(self, path, archive_project_path=None):
         """
         Write a csv representation of self.records to path
         Args:
             path (str): path to which to write the csv
-            archive_project_path (str or None): resolver path of the archive project
+            archive_project_path (str or None): resolver path of the archive
+                project, left empty for records of containers that failed to
+                move to it
         """
-        fieldnames = ["Container", "Name", "Status", "Origin Path", "Export Path"]
-        if archive_project_path:
-            fieldnames.append("Archive Path")
-        fieldnames = fieldnames + ["Found Files", "Created Files", "Failed Files"]
+        fieldnames = self.get_fieldnames(archive_project_path)
         with open(path, "w") as csvfile:
             writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
 
             writer.writeheader()
             for record in self.records:
+                if archive_project_path and self.is_archived(record.origin_path):
+                    record_archive_path = archive_project_path
+                else:
+                    record_archive_path = None
                 writer.writerow(
                     record.get_csv_dict(
                         export_project_path=self.export_path,
-                        archive_project_path=archive_project_path,
+                        archive_project_path=record_archive_path,
                     )
                 )
 
 
+class CsvLogWriter:
+    """Writer of the rows of an ExportLog to a csv file, flushed row by row"""
+
+    def __init__(self, path, fieldnames):
+        """
+        Args:
+            path (str): path to which to write the csv
+            fieldnames (list): the columns of the csv
+        """
+        self.path = path
+        self.fieldnames = fieldnames
+        self._file = open(path, "w", newline="")
+        self._writer = csv.DictWriter(
+            self._file, fieldnames=fieldnames, extrasaction="ignore"
+        )
+        self._writer.writeheader()
+        self._file.flush()
+
+    def write(self, row):
+        """Write row (a dict keyed by column) and flush it to the file"""
+        self._writer.writerow(row)
+        self._file.flush()
+
+    def close(self):
+        """Close the file"""
+        self._file.close()
+
+    def read_rows(self):
+        """Iterate over the rows of the written file"""
+        with open(self.path, newline="") as fp:
+            yield from csv.DictReader(fp)
+
+    def rewrite(self, fieldnames, update_row):
+        """
+        Rewrite the closed file row by row with fieldnames as the columns,
+            applying update_row to each row
+        Args:
+            fieldnames (list): the columns of the rewritten file
+            update_row (callable): function returning the row to write given
+                a row read from the file
+        """
+        tmp_path = self.path + ".tmp"
+        writer = type(self)(tmp_path, fieldnames)
+        try:
+            for row in self.read_rows():
+                writer.write(update_row(row))
+        finally:
+            writer.close()
+        os.replace(tmp_path, self.path)
+        self.fieldnames = fieldnames
+
+
+class JsonLinesLogWriter(CsvLogWriter):
+    """Writer of the rows of an ExportLog as JSON objects, one per line"""
+
+    def __init__(self, path, fieldnames):
+        self.path = path
+        self.fieldnames = fieldnames
+        self._file = open(path, "w")
+
+    def write(self, row):
+        row = {key: row.get(key, "") for key in self.fieldnames}
+        self._file.write(json.dumps(row) + "\n")
+        self._file.flush()
+
+    def read_rows(self):
+        with open(self.path) as fp:
+            for line in fp:
+                yield json.loads(line)
+
+
 @dataclass
 class ExportRecord:
     """
@@ -191,3 +435,77 @@ class ExportRecord:
             key = " ".join([x.capitalize() for x in item.split("_")])
             csv_dict[key] = getattr(self, item)
         return csv_dict
+
+
+@dataclass
+class ExportFileRecord:
+    """
+    Class to represent export of a file: the bytes transferred, the DICOMs
+        edited and the time spent in each stage
+    """
+
+    origin_path: str
+    file_name: str
+    export_name: str = None
+    created: bool = False
+    bytes_downloaded: int = 0
+    bytes_uploaded: int = 0
+    dicoms_edited: int = 0
+    stage_times: dict = field(default_factory=dict)
+    elapsed: float = 0.0
+
+    @classmethod
+    def from_metrics(cls, origin_path, file_name, export_name, created, metrics):
+        """
+        Get the record of a file export from its metrics
+        Args:
+            origin_path (str): resolver path of the container of the file
+            file_name (str): name of the origin file
+            export_name (str or None): name of the copy, None if export failed
+            created (bool): whether the copy was created
+            metrics (instrumentation.ScopeMetrics or None): the metrics of the
+                file's scope, None if the file was not exported by this run
+                (i.e. it was recorded by the journal of a previous run)
+
+        Returns:
+            ExportFileRecord
+        """
+        file_record = cls(origin_path, file_name, export_name, created)
+        if metrics is not None:
+            file_record.bytes_downloaded = metrics.counts.get("bytes_downloaded", 0)
+            file_record.bytes_uploaded = metrics.counts.get("bytes_uploaded", 0)
+            file_record.dicoms_edited = metrics.counts.get("dicoms_edited", 0)
+            file_record.stage_times = {
+                stage: metrics.get_stage_time(stage) for stage in FILE_STAGES
+            }
+            file_record.elapsed = metrics.elapsed
+        return file_record
+
+    @property
+    def status(self):
+        """str representing status of export of the file"""
+        if not self.export_name:
+            return "failed"
+        return "created" if self.created else "used_existing"
+
+    def get_csv_dict(self):
+        """
+        Get a dictionary to be appended to the file detail csv
+
+        Returns:
+            dict: representation of the record to be written to a csv
+        """
+        csv_dict = {
+            "Origin Path": str(self.origin_path),
+            "File": self.file_name,
+            "Export Name": self.export_name or "",
+            "Status": self.status,
+            "Bytes Downloaded": self.bytes_downloaded,
+            "Bytes Uploaded": self.bytes_uploaded,
+            "DICOMs Edited": self.dicoms_edited,
+        }
+        for stage in FILE_STAGES:
+            key = f"{stage.replace('_', ' ').title()} s"
+            csv_dict[key] = round(self.stage_times.get(stage, 0.0), 6)
+        csv_dict["Elapsed s"] = round(self.elapsed, 6)
+        return csv_dict
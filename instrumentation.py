@@ -0,0 +1,246 @@
+import functools
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+# Pipeline stages timed during export
+STAGES = (
+    "hierarchy",
+    "find",
+    "create",
+    "download",
+    "header_parse",
+    "edit",
+    "rezip",
+    "upload",
+    "archive",
+)
+
+
+@dataclass
+class TimingStats:
+    """Count and durations of a timed operation"""
+
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+    def add(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total_s": round(self.total, 6),
+            "mean_s": round(self.total / self.count, 6) if self.count else 0.0,
+            "max_s": round(self.max, 6),
+        }
+
+
+class ScopeMetrics:
+    """The stage and API call timings and counts of a container or file"""
+
+    def __init__(self):
+        self.elapsed = 0.0
+        self.stages = defaultdict(TimingStats)
+        self.api_calls = defaultdict(TimingStats)
+        self.counts = defaultdict(int)
+
+    def get_stage_time(self, name):
+        """Total seconds spent in stage name (0 if the stage did not run)"""
+        stats = self.stages.get(name)
+        return stats.total if stats else 0.0
+
+    def to_dict(self):
+        return {
+            "elapsed_s": round(self.elapsed, 6),
+            "stages": {k: v.to_dict() for k, v in self.stages.items()},
+            "api_calls": {k: v.to_dict() for k, v in self.api_calls.items()},
+            "counts": dict(self.counts),
+        }
+
+
+class ExportMetrics:
+    """
+    Thread-safe collector of the counts and durations of Flywheel API calls and
+        export pipeline stages, overall and per container and file scope.
+        API calls and stages are attributed to the innermost scope entered by
+        the calling thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        """Clear the collected metrics and restart the elapsed time"""
+        with self._lock:
+            self.start_time = time.perf_counter()
+            self.stages = defaultdict(TimingStats)
+            self.api_calls = defaultdict(TimingStats)
+            self.counts = defaultdict(int)
+            # scope kind (container/file) -> scope name -> ScopeMetrics
+            self.scopes = {"container": dict(), "file": dict()}
+
+    @property
+    def _scope_stack(self):
+        if not hasattr(self._local, "scopes"):
+            self._local.scopes = list()
+        return self._local.scopes
+
+    @property
+    def current_scope(self):
+        """The innermost ScopeMetrics entered by this thread, None if none"""
+        return self._scope_stack[-1] if self._scope_stack else None
+
+    @contextmanager
+    def scope(self, kind, name):
+        """
+        Attribute the API calls and stages of the calling thread to the
+            scope name of kind (container or file) while the context is active
+        """
+        with self._lock:
+            scope_metrics = self.scopes[kind].setdefault(name, ScopeMetrics())
+        self._scope_stack.append(scope_metrics)
+        start = time.perf_counter()
+        try:
+            yield scope_metrics
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                scope_metrics.elapsed += elapsed
+            self._scope_stack.pop()
+
+    def container_scope(self, container):
+        """Scope of the metrics of exporting container"""
+        label = container.label or container.get("code")
+        return self.scope(
+            "container", f"{container.container_type} {label} ({container.id})"
+        )
+
+    def file_scope(self, file_entry):
+        """Scope of the metrics of exporting file_entry"""
+        parent = file_entry.parent
+        parent_id = parent.id if parent is not None else None
+        return self.scope("file", f"{file_entry.name} ({parent_id})")
+
+    def _record(self, attribute, name, elapsed):
+        scope_metrics = self.current_scope
+        with self._lock:
+            getattr(self, attribute)[name].add(elapsed)
+            if scope_metrics is not None:
+                getattr(scope_metrics, attribute)[name].add(elapsed)
+
+    def add_count(self, name, value=1):
+        """Add value to the counter name (i.e. bytes_downloaded)"""
+        scope_metrics = self.current_scope
+        with self._lock:
+            self.counts[name] += value
+            if scope_metrics is not None:
+                scope_metrics.counts[name] += value
+
+    @contextmanager
+    def stage(self, name):
+        """Time the stage name of the export"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record("stages", name, time.perf_counter() - start)
+
+    def timed(self, name):
+        """Decorator timing each call of the decorated function as stage name"""
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def instrument_client(self, fw_client):
+        """
+        Count and time the API calls made by fw_client, which all go through
+            its ApiClient.call_api. Calls are keyed by method and endpoint
+            (i.e. "GET /sessions/{SessionId}").
+        """
+        api_client = fw_client.api_client
+        if getattr(api_client, "_export_metrics_instrumented", None) is True:
+            return
+        call_api = api_client.call_api
+
+        @functools.wraps(call_api)
+        def timed_call_api(resource_path, method, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return call_api(resource_path, method, *args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self._record("api_calls", f"{method} {resource_path}", elapsed)
+
+        api_client.call_api = timed_call_api
+        api_client._export_metrics_instrumented = True
+
+    def to_dict(self):
+        """Get a JSON serializable representation of the metrics"""
+        with self._lock:
+            return {
+                "elapsed_s": round(time.perf_counter() - self.start_time, 6),
+                "api_call_count": sum(s.count for s in self.api_calls.values()),
+                "stages": {k: v.to_dict() for k, v in self.stages.items()},
+                "api_calls": {k: v.to_dict() for k, v in self.api_calls.items()},
+                "counts": dict(self.counts),
+                "containers": {
+                    k: v.to_dict() for k, v in self.scopes["container"].items()
+                },
+                "files": {k: v.to_dict() for k, v in self.scopes["file"].items()},
+            }
+
+    def write_json(self, path):
+        """Write the metrics as JSON to path"""
+        with open(path, "w") as fp:
+            json.dump(self.to_dict(), fp, indent=2)
+
+    def format_summary(self):
+        """Get a table of the stage and API call totals"""
+        metrics = self.to_dict()
+        lines = [
+            f"Export metrics ({metrics['elapsed_s']:.2f} s, "
+            f"{metrics['api_call_count']} API calls)",
+            f"{'':<44} {'count':>7} {'total s':>9} {'mean ms':>9} {'max ms':>9}",
+        ]
+        stage_names = sorted(
+            metrics["stages"],
+            key=lambda k: STAGES.index(k) if k in STAGES else len(STAGES),
+        )
+        sections = (
+            ("stage", [(k, metrics["stages"][k]) for k in stage_names]),
+            (
+                "api",
+                sorted(
+                    metrics["api_calls"].items(),
+                    key=lambda item: item[1]["total_s"],
+                    reverse=True,
+                ),
+            ),
+        )
+        for prefix, rows in sections:
+            for name, stats in rows:
+                lines.append(
+                    f"{prefix + ' ' + name:<44.44} {stats['count']:>7} "
+                    f"{stats['total_s']:>9.2f} {stats['mean_s'] * 1000:>9.1f} "
+                    f"{stats['max_s'] * 1000:>9.1f}"
+                )
+        return "\n".join(lines)
+
+
+EXPORT_METRICS = ExportMetrics()
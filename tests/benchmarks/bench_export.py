@@ -0,0 +1,232 @@
+"""
+Benchmark of ContainerExporter.export against a FakeFlywheelAPI populated
+    with synthetic sessions of N acquisitions of M-slice DICOM zips and a
+    NIfTI file
+
+Usage:
+    PYTHONPATH=. python -m tests.benchmarks.bench_export --acquisitions 4 \
+        --slices 50 --latency 0.02 --bandwidth-mbps 200
+"""
+import argparse
+import json
+import logging
+import resource
+import tempfile
+import time
+from dataclasses import dataclass
+
+from container_export import CLASSIFICATION_SCHEMA_CACHE, ContainerExporter
+from tests.benchmarks.fake_flywheel_api import FakeFlywheelAPI
+from tests.benchmarks.synthetic_dicom import BYTES_PER_MB, make_dicom_zip
+
+
+@dataclass
+class BenchmarkGearContext:
+    """The attributes of a flywheel.GearContext used by ContainerExporter"""
+
+    client: object
+    config: dict
+    destination: dict
+    output_dir: str
+
+
+def populate(
+    api, sessions=1, acquisitions=4, slices=50, rows=64, columns=64, batch=False
+):
+    """
+    Add an origin and an export project to api with sessions sessions of
+        acquisitions acquisitions, each with a DICOM zip of slices slices and
+        a NIfTI file (which needs no content change, so it is streamed)
+
+    Returns:
+        str: id of the analysis to use as gear destination (on the origin
+            project if batch, otherwise on the subject)
+    """
+    api.add_container("group", "bench")
+    origin_id = api.add_container("project", "origin", "bench")
+    api.add_container("project", "export", "bench")
+    subject_id = api.add_container("subject", "subject", origin_id)
+    for i in range(sessions):
+        session_id = api.add_container("session", f"session_{i}", subject_id)
+        for j in range(acquisitions):
+            acquisition_id = api.add_container(
+                "acquisition", f"acquisition_{j}", session_id
+            )
+            contents, header = make_dicom_zip(slices, rows, columns)
+            header["PatientID"] = "exported_patient"
+            api.add_file(
+                acquisition_id,
+                f"acquisition_{j}.dicom.zip",
+                contents,
+                type="dicom",
+                modality="CT",
+                info={"header": {"dicom": header}},
+            )
+            api.add_file(
+                acquisition_id,
+                f"acquisition_{j}.nii.gz",
+                bytes(rows * columns * slices),
+                type="nifti",
+                modality="CT",
+            )
+    return api.add_analysis(origin_id if batch else subject_id)
+
+
+def count_exported_files(api):
+    """Get the number of files of the acquisitions of the export project"""
+    export_ids = [
+        c["_id"]
+        for c in api.containers.values()
+        if c["container_type"] == "project" and c["label"] == "export"
+    ]
+    return sum(len(c["files"]) for c in api.get_children(export_ids[0], "acquisition"))
+
+
+def run_benchmark(
+    sessions=1,
+    acquisitions=4,
+    slices=50,
+    rows=64,
+    columns=64,
+    latency=0.0,
+    bandwidth=None,
+    config=None,
+    batch=False,
+):
+    """
+    Export a synthetic subject from a FakeFlywheelAPI
+
+    Args:
+        sessions (int): number of sessions of the subject
+        acquisitions (int): number of acquisitions per session
+        slices (int): number of slices of the DICOM zip of each acquisition
+        rows (int): number of pixel rows of the slices
+        columns (int): number of pixel columns of the slices
+        latency (float): seconds added to each request
+        bandwidth (float or None): bytes per second of file transfers
+        config (dict or None): gear config overrides
+        batch (bool): whether to export the sessions of the origin project in
+            batch mode rather than the subject
+
+    Returns:
+        dict: the benchmark metrics
+    """
+    CLASSIFICATION_SCHEMA_CACHE.clear()
+    with FakeFlywheelAPI(latency=latency, bandwidth=bandwidth) as api:
+        analysis_id = populate(
+            api, sessions, acquisitions, slices, rows, columns, batch=batch
+        )
+        # a DICOM zip and a NIfTI file per acquisition
+        n_files = 2 * sessions * acquisitions
+        origin_bytes = sum(len(c) for c in api.file_contents.values())
+        gear_config = {"export_project": "bench/export", "force_export": True}
+        gear_config.update(config or {})
+        with tempfile.TemporaryDirectory() as output_dir:
+            context = BenchmarkGearContext(
+                client=api.get_client(),
+                config=gear_config,
+                destination={"id": analysis_id},
+                output_dir=output_dir,
+            )
+            api.reset_counters()
+            rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            start = time.perf_counter()
+            exporter = ContainerExporter.from_gear_context(context)
+            return_code = exporter.export()
+            elapsed = time.perf_counter() - start
+            rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        exported_files = count_exported_files(api)
+        # subject, sessions and acquisitions
+        n_containers = 1 + sessions * (1 + acquisitions)
+        return {
+            "return_code": return_code,
+            "sessions": sessions,
+            "acquisitions": acquisitions,
+            "slices": slices,
+            "files": n_files,
+            "exported_files": exported_files,
+            "origin_mb": origin_bytes / BYTES_PER_MB,
+            "elapsed_s": elapsed,
+            "files_per_s": n_files / elapsed,
+            "mb_per_s": origin_bytes / BYTES_PER_MB / elapsed,
+            "api_calls": api.call_count,
+            "api_calls_per_container": api.call_count / n_containers,
+            "api_calls_by_route": dict(api.calls),
+            "downloaded_mb": api.bytes_downloaded / BYTES_PER_MB,
+            "uploaded_mb": api.bytes_uploaded / BYTES_PER_MB,
+            # ru_maxrss is in KiB on Linux; it includes the fake's file store
+            "peak_rss_mb": rss_after / 1024,
+            "peak_rss_increase_mb": (rss_after - rss_before) / 1024,
+        }
+
+
+def format_report(metrics):
+    """Get a human readable report of the metrics of run_benchmark"""
+    lines = [
+        "{sessions} session(s) x {acquisitions} acquisition(s) x {slices} slices "
+        "({origin_mb:.1f} MB), return code {return_code}, "
+        "{exported_files}/{files} files exported".format(**metrics),
+        "  elapsed:         {elapsed_s:.2f} s".format(**metrics),
+        "  throughput:      {files_per_s:.2f} files/s, {mb_per_s:.2f} MB/s".format(
+            **metrics
+        ),
+        "  API calls:       {api_calls} ({api_calls_per_container:.1f} per "
+        "container)".format(**metrics),
+        "  transferred:     {downloaded_mb:.1f} MB down, "
+        "{uploaded_mb:.1f} MB up".format(**metrics),
+        "  peak RSS:        {peak_rss_mb:.0f} MB (+{peak_rss_increase_mb:.0f} MB "
+        "during export)".format(**metrics),
+    ]
+    for route, count in sorted(metrics["api_calls_by_route"].items()):
+        lines.append(f"    {route:<20} {count}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, default=1)
+    parser.add_argument("--acquisitions", type=int, default=4)
+    parser.add_argument("--slices", type=int, default=50)
+    parser.add_argument("--rows", type=int, default=64)
+    parser.add_argument("--columns", type=int, default=64)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added to each request"
+    )
+    parser.add_argument(
+        "--bandwidth-mbps",
+        type=float,
+        default=None,
+        help="MB/s of file transfers (unlimited if not set)",
+    )
+    parser.add_argument(
+        "--config", type=json.loads, default=None, help="gear config overrides (JSON)"
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="export the sessions of the origin project in batch mode",
+    )
+    parser.add_argument("--json", help="path to which to write the metrics as JSON")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    bandwidth = args.bandwidth_mbps * BYTES_PER_MB if args.bandwidth_mbps else None
+    metrics = run_benchmark(
+        sessions=args.sessions,
+        acquisitions=args.acquisitions,
+        slices=args.slices,
+        rows=args.rows,
+        columns=args.columns,
+        latency=args.latency,
+        bandwidth=bandwidth,
+        config=args.config,
+        batch=args.batch,
+    )
+    print(format_report(metrics))
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump(metrics, fp, indent=2)
+    return metrics["return_code"]
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
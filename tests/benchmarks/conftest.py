@@ -0,0 +1,89 @@
+import time
+import tracemalloc
+
+import pytest
+
+try:
+    import pytest_benchmark  # noqa: F401
+except ImportError:
+    pytest_benchmark = None
+
+
+FULL_SIZES_OPTION = "--benchmark-full-sizes"
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        FULL_SIZES_OPTION,
+        action="store_true",
+        default=False,
+        help="also run the DICOM benchmarks on zips of 1,000 and 5,000 slices",
+    )
+
+
+def pytest_generate_tests(metafunc):
+    if "zip_slices" in metafunc.fixturenames:
+        sizes = [100]
+        if metafunc.config.getoption(FULL_SIZES_OPTION):
+            sizes.extend([1000, 5000])
+        metafunc.parametrize("zip_slices", sizes, scope="module")
+
+
+class SingleRunBenchmark:
+    """
+    Stand-in for the pytest-benchmark fixture when the plugin is not
+        installed: the target is run once (per round) and timed, so that the
+        benchmarks still run as tests
+    """
+
+    def __init__(self):
+        self.extra_info = dict()
+        self.timings = list()
+
+    def __call__(self, target, *args, **kwargs):
+        return self.pedantic(target, args=args, kwargs=kwargs)
+
+    def pedantic(
+        self, target, args=(), kwargs=None, setup=None, rounds=1, iterations=1, **_
+    ):
+        result = None
+        for _ in range(rounds):
+            round_args, round_kwargs = args, kwargs or dict()
+            if setup:
+                setup_result = setup()
+                if setup_result is not None:
+                    round_args, round_kwargs = setup_result
+            start = time.perf_counter()
+            for _ in range(iterations):
+                result = target(*round_args, **round_kwargs)
+            self.timings.append((time.perf_counter() - start) / iterations)
+        return result
+
+
+if pytest_benchmark is None:
+
+    @pytest.fixture
+    def benchmark():
+        return SingleRunBenchmark()
+
+
+@pytest.fixture
+def record_allocations(benchmark):
+    """
+    Function running a target once more with tracemalloc tracing (outside of
+        the timed rounds, as tracing slows allocations down) and recording its
+        peak and retained allocated memory in benchmark.extra_info
+    """
+
+    def record(target, *args, **kwargs):
+        tracemalloc.start()
+        try:
+            result = target(*args, **kwargs)
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        benchmark.extra_info["peak_allocated_kb"] = round(peak / 1024, 1)
+        benchmark.extra_info["retained_allocated_kb"] = round(current / 1024, 1)
+        return result
+
+    return record
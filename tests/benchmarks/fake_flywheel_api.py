@@ -0,0 +1,510 @@
+"""
+In-process fake of the Flywheel REST endpoints used by ContainerExporter,
+    served over HTTP on localhost so that a real flywheel.Client (and therefore
+    the real SDK request, serialization and upload code) can be benchmarked
+    without a Flywheel instance
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import flywheel
+
+
+CONTAINER_TYPES = ("group", "project", "subject", "session", "acquisition")
+PARENT_TYPES = {
+    "project": "group",
+    "subject": "project",
+    "session": "subject",
+    "acquisition": "session",
+}
+CONTAINER_ROUTE = (
+    r"/api/(?P<collection>groups|projects|subjects|sessions|acquisitions|containers)"
+    r"/(?P<id>[^/]+)"
+)
+ROUTES = [
+    ("GET", r"/api/version", "get_version"),
+    ("GET", r"/api/modalities", "get_modalities"),
+    ("GET", r"/api/modalities/(?P<id>[^/]+)", "get_modality"),
+    ("POST", r"/api/lookup", "lookup"),
+    ("GET", r"/api/analyses/(?P<id>[^/]+)", "get_analysis"),
+    (
+        "POST",
+        r"/api/(?P<collection>subjects|sessions|acquisitions)",
+        "add_container",
+    ),
+    ("GET", CONTAINER_ROUTE, "get_container"),
+    ("PUT", CONTAINER_ROUTE, "update_container"),
+    (
+        "GET",
+        CONTAINER_ROUTE + r"/(?P<child>subjects|sessions|acquisitions)",
+        "get_children",
+    ),
+    ("POST", CONTAINER_ROUTE + r"/tags", "add_tag"),
+    ("POST", CONTAINER_ROUTE + r"/info", "update_info"),
+    ("POST", CONTAINER_ROUTE + r"/files", "upload_file"),
+    ("GET", CONTAINER_ROUTE + r"/files/(?P<name>[^/]+)", "download_file"),
+    ("POST", CONTAINER_ROUTE + r"/files/(?P<name>[^/]+)/info", "update_file_info"),
+]
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class FakeFlywheelAPI:
+    """
+    In-memory Flywheel hierarchy served over HTTP, with a latency applied to
+        every request and file transfers throttled to a bandwidth
+
+    Attributes:
+        latency (float): seconds to wait before responding to each request
+        bandwidth (float or None): bytes per second at which file contents are
+            transferred (unlimited if None)
+        calls (collections.Counter): number of requests by route name
+        container_calls (collections.Counter): number of requests by id of the
+            container requested
+    """
+
+    def __init__(self, latency=0.0, bandwidth=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.containers = dict()
+        self.analyses = dict()
+        # (container id, file name) -> bytes
+        self.file_contents = dict()
+        self.calls = Counter()
+        self.container_calls = Counter()
+        self.bytes_downloaded = 0
+        self.bytes_uploaded = 0
+        self._lock = threading.RLock()
+        self._server = None
+        self._thread = None
+        self._routes = [
+            (method, re.compile(pattern + "$"), name)
+            for method, pattern, name in ROUTES
+        ]
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        """Serve the API on a free localhost port from a daemon thread"""
+        api = self
+
+        class Handler(FakeFlywheelRequestHandler):
+            fake_api = api
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving the API"""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def api_key(self):
+        """API key of a flywheel.Client connecting to the fake over HTTP"""
+        port = self._server.server_address[1]
+        return f"127.0.0.1:{port}:__force_insecure:benchmark"
+
+    def get_client(self):
+        """Get a flywheel.Client connected to the fake"""
+        return flywheel.Client(self.api_key)
+
+    def reset_counters(self):
+        """Reset the request and transfer counters"""
+        with self._lock:
+            self.calls.clear()
+            self.container_calls.clear()
+            self.bytes_downloaded = 0
+            self.bytes_uploaded = 0
+
+    @property
+    def call_count(self):
+        """Total number of requests handled"""
+        return sum(self.calls.values())
+
+    # hierarchy setup
+
+    def add_container(self, container_type, label, parent_id=None, **fields):
+        """
+        Add a container to the hierarchy
+
+        Args:
+            container_type (str): group, project, subject, session or
+                acquisition
+            label (str): the container label (the id of a group)
+            parent_id (str or None): id of the parent container
+            **fields: other fields of the container (i.e. info, tags)
+
+        Returns:
+            str: the id of the container
+        """
+        with self._lock:
+            container_id = label if container_type == "group" else uuid.uuid4().hex
+            parents = dict()
+            if parent_id:
+                parent = self.containers[parent_id]
+                parents = dict(parent["parents"])
+                parents[parent["container_type"]] = parent_id
+            container = {
+                "_id": container_id,
+                "container_type": container_type,
+                "label": label,
+                "parents": parents,
+                "info": {},
+                "tags": [],
+                "files": [],
+                "created": "2020-01-01T00:00:00+00:00",
+                "modified": "2020-01-01T00:00:00+00:00",
+            }
+            container.update(fields)
+            self._set_parent_fields(container)
+            self.containers[container_id] = container
+            return container_id
+
+    def add_file(self, container_id, name, contents, **fields):
+        """
+        Add a file with contents to the container with container_id
+
+        Args:
+            container_id (str): id of the container
+            name (str): name of the file
+            contents (bytes): contents of the file
+            **fields: other fields of the file entry (i.e. type, info)
+        """
+        with self._lock:
+            file_entry = {
+                "_id": uuid.uuid4().hex,
+                "name": name,
+                "size": len(contents),
+                "hash": hashlib.sha384(contents).hexdigest(),
+                "info": {},
+                "tags": [],
+                "classification": {},
+                "created": "2020-01-01T00:00:00+00:00",
+                "modified": "2020-01-01T00:00:00+00:00",
+            }
+            file_entry.update(fields)
+            files = self.containers[container_id]["files"]
+            files[:] = [f for f in files if f["name"] != name] + [file_entry]
+            self.file_contents[(container_id, name)] = contents
+
+    def add_analysis(self, parent_id):
+        """Add an analysis (the destination of a gear run) to a container"""
+        analysis_id = uuid.uuid4().hex
+        parent = self.containers[parent_id]
+        self.analyses[analysis_id] = {
+            "_id": analysis_id,
+            "label": "GRP-9 benchmark",
+            "parent": {"type": parent["container_type"], "id": parent_id},
+            "parents": dict(parent["parents"], **{parent["container_type"]: parent_id}),
+            "files": [],
+        }
+        return analysis_id
+
+    def get_children(self, container_id, child_type):
+        """
+        Get the stored descendant containers of child_type of a container
+            (i.e. the sessions of a project, not only the direct children)
+        """
+        container_type = self.containers[container_id]["container_type"]
+        return [
+            c
+            for c in self.containers.values()
+            if c["container_type"] == child_type
+            and c["parents"].get(container_type) == container_id
+        ]
+
+    def _set_parent_fields(self, container):
+        """Set the parent fields of a container (i.e. session.subject)"""
+        parents = container["parents"]
+        container_type = container["container_type"]
+        if container_type == "project":
+            container["group"] = parents.get("group")
+        elif container_type == "subject":
+            container["project"] = parents.get("project")
+            container.setdefault("code", container["label"])
+        elif container_type == "session":
+            container["project"] = parents.get("project")
+            subject = self.containers.get(parents.get("subject"), {})
+            container["subject"] = {
+                "_id": parents.get("subject"),
+                "label": subject.get("label"),
+                "code": subject.get("code"),
+            }
+        elif container_type == "acquisition":
+            container["session"] = parents.get("session")
+
+    # request handling
+
+    def handle(self, method, path, query, headers, body):
+        """
+        Handle a request
+
+        Returns:
+            tuple(int, dict or list or bytes): the status and the JSON
+                response or file contents
+        """
+        path = unquote(path)
+        for route_method, pattern, name in self._routes:
+            match = pattern.match(path)
+            if route_method == method and match:
+                break
+        else:
+            return 404, {"message": f"{method} {path} is not faked"}
+        params = match.groupdict()
+        with self._lock:
+            self.calls[name] += 1
+            if "id" in params:
+                self.container_calls[params["id"]] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            return 200, getattr(self, f"_{name}")(params, query, headers, body)
+        except ApiError as exc:
+            return exc.status, {"message": str(exc)}
+
+    def throttle(self, size):
+        """Wait for size bytes to be transferred at self.bandwidth"""
+        if self.bandwidth:
+            time.sleep(size / self.bandwidth)
+
+    def _get(self, container_id):
+        container = self.containers.get(container_id)
+        if container is None:
+            raise ApiError(404, f"container {container_id} not found")
+        return container
+
+    def _get_version(self, params, query, headers, body):
+        return {"flywheel_release": "12.4.0"}
+
+    def _get_modalities(self, params, query, headers, body):
+        return []
+
+    def _get_modality(self, params, query, headers, body):
+        raise ApiError(404, f"modality {params['id']} not found")
+
+    def _lookup(self, params, query, headers, body):
+        path = json.loads(body)["path"]
+        parent_id = None
+        for container_type, label in zip(CONTAINER_TYPES, path):
+            if parent_id is None:
+                candidates = self.containers.values()
+            else:
+                candidates = self.get_children(parent_id, container_type)
+            matches = [
+                c
+                for c in candidates
+                if c["container_type"] == container_type and c["label"] == label
+            ]
+            if not matches:
+                raise ApiError(404, f"{'/'.join(path)} not found")
+            parent_id = matches[0]["_id"]
+        return dict(self.containers[parent_id], node_type=container_type)
+
+    def _get_analysis(self, params, query, headers, body):
+        analysis = self.analyses.get(params["id"])
+        if analysis is None:
+            raise ApiError(404, f"analysis {params['id']} not found")
+        return analysis
+
+    def _add_container(self, params, query, headers, body):
+        container_type = params["collection"][:-1]
+        fields = json.loads(body)
+        parent_type = PARENT_TYPES[container_type]
+        parent_id = fields.pop(parent_type)
+        if isinstance(parent_id, dict):
+            parent_id = parent_id.get("_id")
+        self._get(parent_id)
+        if container_type == "subject":
+            fields.setdefault("label", fields.get("code"))
+            subjects = self.get_children(parent_id, "subject")
+            if self._find(subjects, {"code": fields["label"]}):
+                raise ApiError(409, "subject code already exists in project")
+        label = fields.pop("label", None)
+        fields.pop("project", None)
+        container_id = self.add_container(container_type, label, parent_id, **fields)
+        return {"_id": container_id}
+
+    def _get_container(self, params, query, headers, body):
+        return self._get(params["id"])
+
+    def _update_container(self, params, query, headers, body):
+        container = self._get(params["id"])
+        update = json.loads(body)
+        if "subject" in update and container["container_type"] == "session":
+            subject_id = update.pop("subject")["_id"]
+            subject = self._get(subject_id)
+            container["parents"] = dict(subject["parents"], subject=subject_id)
+            self._move_children(container)
+        if "project" in update:
+            project_id = update.pop("project")
+            project = self._get(project_id)
+            container["parents"] = dict(project["parents"], project=project_id)
+            self._move_children(container)
+        container.update(update)
+        self._set_parent_fields(container)
+        return {"modified": 1}
+
+    def _move_children(self, container):
+        """Update the parents of the descendants of a moved container"""
+        for child in self.containers.values():
+            if child["parents"].get(container["container_type"]) == container["_id"]:
+                child["parents"].update(container["parents"])
+                self._set_parent_fields(child)
+
+    def _get_children(self, params, query, headers, body):
+        self._get(params["id"])
+        children = self.get_children(params["id"], params["child"][:-1])
+        filters = dict()
+        for term in query.get("filter", [""])[0].split(","):
+            if "=" in term:
+                key, value = term.split("=", 1)
+                filters[key] = value.strip('"')
+        children = self._find(children, filters)
+        if "after_id" in query:
+            # pages of iter() continue after the last id of the previous page
+            ids = [c["_id"] for c in children]
+            children = children[ids.index(query["after_id"][0]) + 1 :]
+        if "limit" in query:
+            children = children[: int(query["limit"][0])]
+        # listings do not include info
+        return [{k: v for k, v in c.items() if k != "info"} for c in children]
+
+    @staticmethod
+    def _find(containers, filters):
+        def matches(container, key, value):
+            for part in key.split("."):
+                if not isinstance(container, dict):
+                    return False
+                container = container.get(part)
+            return str(container) == value
+
+        return [
+            c
+            for c in containers
+            if all(matches(c, key, value) for key, value in filters.items())
+        ]
+
+    def _add_tag(self, params, query, headers, body):
+        container = self._get(params["id"])
+        tag = json.loads(body)["value"]
+        if tag not in container["tags"]:
+            container["tags"].append(tag)
+        return {"modified": 1}
+
+    def _update_info(self, params, query, headers, body):
+        container = self._get(params["id"])
+        update = json.loads(body)
+        if "replace" in update:
+            container["info"] = update["replace"]
+        container["info"].update(update.get("set", {}))
+        for key in update.get("delete", []):
+            container["info"].pop(key, None)
+        return {"modified": 1}
+
+    def _upload_file(self, params, query, headers, body):
+        container = self._get(params["id"])
+        self.throttle(len(body))
+        message = BytesParser(policy=HTTP).parsebytes(
+            b"Content-Type: " + headers["Content-Type"].encode() + b"\r\n\r\n" + body
+        )
+        metadata = dict()
+        uploaded = list()
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name == "metadata":
+                metadata = json.loads(part.get_content())
+            else:
+                uploaded.append((part.get_filename(), part.get_payload(decode=True)))
+        with self._lock:
+            self.bytes_uploaded += sum(len(contents) for _, contents in uploaded)
+        for file_name, contents in uploaded:
+            fields = {
+                k: v
+                for k, v in metadata.items()
+                if k in ("type", "modality", "classification", "info", "tags")
+            }
+            self.add_file(container["_id"], file_name, contents, **fields)
+        return [{"name": file_name} for file_name, _ in uploaded]
+
+    def _download_file(self, params, query, headers, body):
+        contents = self.file_contents.get((params["id"], params["name"]))
+        if contents is None:
+            raise ApiError(404, f"file {params['name']} not found")
+        self.throttle(len(contents))
+        with self._lock:
+            self.bytes_downloaded += len(contents)
+        return contents
+
+    def _update_file_info(self, params, query, headers, body):
+        container = self._get(params["id"])
+        for file_entry in container["files"]:
+            if file_entry["name"] == params["name"]:
+                update = json.loads(body)
+                if "replace" in update:
+                    file_entry["info"] = update["replace"]
+                file_entry["info"].update(update.get("set", {}))
+                return {"modified": 1}
+        raise ApiError(404, f"file {params['name']} not found")
+
+
+class FakeFlywheelRequestHandler(BaseHTTPRequestHandler):
+    """Request handler delegating to the FakeFlywheelAPI fake_api"""
+
+    fake_api = None
+    protocol_version = "HTTP/1.1"
+    # responses are written as headers then body, which Nagle's algorithm
+    # would delay by the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle_request(self, method):
+        url = urlparse(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        status, response = self.fake_api.handle(
+            method, url.path, parse_qs(url.query), self.headers, body
+        )
+        if isinstance(response, bytes):
+            content_type = "application/octet-stream"
+        else:
+            content_type = "application/json"
+            response = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_PUT(self):
+        self.handle_request("PUT")
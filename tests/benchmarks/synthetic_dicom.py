@@ -0,0 +1,160 @@
+"""Synthetic DICOM files, zips and Flywheel headers for the benchmarks"""
+import io
+import zipfile
+
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.sequence import Sequence
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+from dicom_metadata import get_pydicom_header
+
+
+BYTES_PER_MB = 1024 * 1024
+CT_IMAGE_STORAGE = "1.2.840.10008.5.1.4.1.1.2"
+ENHANCED_CT_IMAGE_STORAGE = "1.2.840.10008.5.1.4.1.1.2.1"
+# keywords that differ between the slices of a series
+PER_SLICE_KEYWORDS = ("InstanceNumber", "ImagePositionPatient", "SOPInstanceUID")
+
+
+def make_dataset(sop_class_uid, series_uid, instance_number, rows, columns, frames=1):
+    """Get a CT dataset with pixel data of frames frames of rows x columns"""
+    file_meta = FileMetaDataset()
+    file_meta.MediaStorageSOPClassUID = sop_class_uid
+    file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    dcm = Dataset()
+    dcm.file_meta = file_meta
+    dcm.is_little_endian = True
+    dcm.is_implicit_VR = False
+    dcm.SOPClassUID = sop_class_uid
+    dcm.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+    dcm.Modality = "CT"
+    dcm.PatientID = "origin_patient"
+    dcm.PatientName = "Origin^Patient"
+    dcm.StudyInstanceUID = "1.2.3"
+    dcm.SeriesInstanceUID = series_uid
+    dcm.SeriesDescription = "benchmark"
+    dcm.InstanceNumber = instance_number
+    dcm.ImagePositionPatient = [0, 0, instance_number]
+    dcm.Rows = rows
+    dcm.Columns = columns
+    dcm.BitsAllocated = 16
+    dcm.BitsStored = 12
+    dcm.HighBit = 11
+    dcm.PixelRepresentation = 0
+    dcm.SamplesPerPixel = 1
+    dcm.PhotometricInterpretation = "MONOCHROME2"
+    if frames > 1:
+        dcm.NumberOfFrames = frames
+    pixel = (instance_number % 4096).to_bytes(2, "little")
+    dcm.PixelData = pixel * (rows * columns * frames)
+    return dcm
+
+
+def to_bytes(dcm):
+    """Get the bytes of dcm written as a DICOM file"""
+    buffer = io.BytesIO()
+    pydicom.dcmwrite(buffer, dcm, write_like_original=False)
+    return buffer.getvalue()
+
+
+def make_dicom_slice(series_uid, instance_number, rows=64, columns=64):
+    """
+    Get the bytes of a synthetic single-frame CT slice
+
+    Args:
+        series_uid (str): the SeriesInstanceUID of the slice
+        instance_number (int): the InstanceNumber of the slice
+        rows (int): number of pixel rows
+        columns (int): number of pixel columns
+
+    Returns:
+        bytes: the DICOM file
+    """
+    return to_bytes(
+        make_dataset(CT_IMAGE_STORAGE, series_uid, instance_number, rows, columns)
+    )
+
+
+def make_enhanced_multiframe(frames, rows=64, columns=64):
+    """
+    Get the bytes of a synthetic enhanced CT with frames frames, each with
+        its own item of the per-frame functional groups sequence
+
+    Returns:
+        bytes: the DICOM file
+    """
+    dcm = make_dataset(
+        ENHANCED_CT_IMAGE_STORAGE, generate_uid(), 1, rows, columns, frames=frames
+    )
+    per_frame = list()
+    for i in range(frames):
+        position = Dataset()
+        position.ImagePositionPatient = [0, 0, i]
+        content = Dataset()
+        content.InStackPositionNumber = i + 1
+        content.DimensionIndexValues = [1, i + 1]
+        frame = Dataset()
+        frame.PlanePositionSequence = Sequence([position])
+        frame.FrameContentSequence = Sequence([content])
+        per_frame.append(frame)
+    dcm.PerFrameFunctionalGroupsSequence = Sequence(per_frame)
+    orientation = Dataset()
+    orientation.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+    shared = Dataset()
+    shared.PlaneOrientationSequence = Sequence([orientation])
+    dcm.SharedFunctionalGroupsSequence = Sequence([shared])
+    return to_bytes(dcm)
+
+
+def make_private_sequence_dicom(items, rows=64, columns=64):
+    """
+    Get the bytes of a synthetic CT slice with a private sequence of items
+        items, each with a few private elements
+
+    Returns:
+        bytes: the DICOM file
+    """
+    dcm = make_dataset(CT_IMAGE_STORAGE, generate_uid(), 1, rows, columns)
+    block = dcm.private_block(0x0029, "BENCHMARK", create=True)
+    sequence = list()
+    for i in range(items):
+        item = Dataset()
+        item_block = item.private_block(0x0029, "BENCHMARK", create=True)
+        item_block.add_new(0x01, "LO", f"item {i}")
+        item_block.add_new(0x02, "DS", str(i * 0.5))
+        item_block.add_new(0x03, "OB", bytes(256))
+        sequence.append(item)
+    block.add_new(0x10, "SQ", Sequence(sequence))
+    return to_bytes(dcm)
+
+
+def make_dicom_zip(n_slices, rows=64, columns=64):
+    """
+    Get the bytes of a zip of n_slices synthetic slices of one series and the
+        Flywheel header of the series (the values common to all slices, as
+        extracted by GRP-3)
+
+    Returns:
+        tuple(bytes, dict): the zip and its info.header.dicom
+    """
+    series_uid = generate_uid()
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zipf:
+        for i in range(n_slices):
+            slice_bytes = make_dicom_slice(series_uid, i + 1, rows, columns)
+            zipf.writestr(f"slice_{i:05d}.dcm", slice_bytes)
+    return buffer.getvalue(), get_fw_header(slice_bytes)
+
+
+def get_fw_header(dicom_bytes):
+    """
+    Get the info.header.dicom of a series from the bytes of one of its slices,
+        without the keywords that differ between slices
+    """
+    dcm = pydicom.dcmread(io.BytesIO(dicom_bytes), stop_before_pixels=True)
+    header = get_pydicom_header(dcm)
+    for keyword in PER_SLICE_KEYWORDS:
+        header.pop(keyword, None)
+    return header
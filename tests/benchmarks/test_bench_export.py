@@ -0,0 +1,27 @@
+import pytest
+
+from tests.benchmarks.bench_export import format_report, run_benchmark
+
+
+@pytest.mark.parametrize("batch", [False, True])
+@pytest.mark.parametrize("workers", [1, 2])
+def test_run_benchmark(workers, batch):
+    metrics = run_benchmark(
+        acquisitions=2,
+        slices=3,
+        config={"max_container_workers": workers},
+        batch=batch,
+    )
+    assert metrics["return_code"] == 0
+    # a DICOM zip and a streamed NIfTI file per acquisition
+    assert metrics["files"] == 4
+    assert metrics["exported_files"] == 4
+    calls = metrics["api_calls_by_route"]
+    assert calls["download_file"] == 4
+    assert calls["upload_file"] == 4
+    # subject, session and acquisitions copies
+    assert calls["add_container"] == 4
+    assert metrics["downloaded_mb"] == pytest.approx(metrics["origin_mb"])
+    assert metrics["uploaded_mb"] > 0
+    assert metrics["api_calls_per_container"] == metrics["api_calls"] / 4
+    assert "files/s" in format_report(metrics)
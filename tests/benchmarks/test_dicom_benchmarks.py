@@ -0,0 +1,157 @@
+"""
+Benchmarks of the DICOM header and edit paths, run with pytest-benchmark if
+    installed (once, as plain tests, otherwise):
+
+    PYTHONPATH=. pytest tests/benchmarks/test_dicom_benchmarks.py \
+        --benchmark-full-sizes --benchmark-columns=mean,max,rounds
+
+Each benchmark records the allocations of one extra run in extra_info.
+"""
+import io
+import logging
+import zipfile
+
+import pydicom
+import pytest
+
+from dicom_edit import DicomUpdater, ZipDicomUpdater, edit_dicom
+from dicom_metadata import get_pydicom_header
+from tests.benchmarks.synthetic_dicom import (
+    make_dicom_slice,
+    make_dicom_zip,
+    make_enhanced_multiframe,
+    make_private_sequence_dicom,
+)
+from util import get_dict_list_common_dict
+
+
+UPDATE_DICT = {"PatientID": "exported_patient"}
+DICOM_FACTORIES = {
+    "single_frame": lambda: make_dicom_slice("1.2.3.4", 1, rows=256, columns=256),
+    "enhanced_multiframe": lambda: make_enhanced_multiframe(200),
+    "private_sequence": lambda: make_private_sequence_dicom(2000),
+}
+files_log = logging.getLogger("benchmark")
+
+
+@pytest.fixture(scope="module", params=list(DICOM_FACTORIES))
+def dicom_bytes(request):
+    return DICOM_FACTORIES[request.param]()
+
+
+@pytest.fixture(scope="module")
+def dicom_zip(zip_slices):
+    return make_dicom_zip(zip_slices)
+
+
+@pytest.fixture
+def zip_copier(dicom_zip, tmp_path):
+    """Function writing a new copy of the benchmark zip (i.e. per round)"""
+    zip_bytes, _ = dicom_zip
+    counter = iter(range(1 << 30))
+
+    def copy():
+        zip_path = tmp_path / f"dicom_{next(counter)}.zip"
+        zip_path.write_bytes(zip_bytes)
+        return str(zip_path)
+
+    return copy
+
+
+def get_updater(zip_path, fw_header, **attributes):
+    updater = ZipDicomUpdater(zip_path, fw_header, files_log)
+    for name, value in attributes.items():
+        setattr(updater, name, value)
+    return updater
+
+
+def test_get_pydicom_header(benchmark, record_allocations, dicom_bytes):
+    dcm = pydicom.dcmread(io.BytesIO(dicom_bytes), stop_before_pixels=True)
+    header = benchmark(get_pydicom_header, dcm)
+    record_allocations(get_pydicom_header, dcm)
+    assert header["PatientID"] == "origin_patient"
+
+
+def test_edit_dicom(benchmark, record_allocations, dicom_bytes, tmp_path):
+    dicom_path = tmp_path / "dicom.dcm"
+
+    def setup():
+        dicom_path.write_bytes(dicom_bytes)
+        return (str(dicom_path), UPDATE_DICT), dict()
+
+    benchmark.pedantic(edit_dicom, setup=setup, rounds=5)
+    setup()
+    assert record_allocations(edit_dicom, str(dicom_path), UPDATE_DICT)
+    assert pydicom.dcmread(str(dicom_path)).PatientID == "exported_patient"
+
+
+# Stages of DicomUpdater.update_dicom_zip
+
+
+def test_zip_read_headers(benchmark, record_allocations, zip_copier, dicom_zip):
+    zip_path = zip_copier()
+    _, fw_header = dicom_zip
+
+    def read_headers():
+        return get_updater(zip_path, fw_header).dicom_dict_list
+
+    dict_list = benchmark.pedantic(read_headers, rounds=3)
+    record_allocations(read_headers)
+    assert len(dict_list) == len(get_updater(zip_path, fw_header).dicom_path_list)
+
+
+def test_zip_common_dict(benchmark, record_allocations, zip_copier, dicom_zip):
+    _, fw_header = dicom_zip
+    dict_list = get_updater(zip_copier(), fw_header).dicom_dict_list
+    common_dict = benchmark(get_dict_list_common_dict, dict_list)
+    record_allocations(get_dict_list_common_dict, dict_list)
+    assert common_dict["PatientID"] == "origin_patient"
+    assert "InstanceNumber" not in common_dict
+
+
+def test_zip_update_dict(benchmark, record_allocations, zip_copier, dicom_zip):
+    zip_path = zip_copier()
+    _, fw_header = dicom_zip
+    fw_header = dict(fw_header, **UPDATE_DICT)
+    dict_list = get_updater(zip_path, fw_header).dicom_dict_list
+
+    def get_update_dict():
+        updater = get_updater(zip_path, fw_header, _dicom_dict_list=dict_list)
+        return updater.safe_to_update and updater.update_dict
+
+    update_dict = benchmark(get_update_dict)
+    record_allocations(get_update_dict)
+    assert update_dict == UPDATE_DICT
+
+
+def test_zip_rewrite(benchmark, record_allocations, zip_copier, dicom_zip):
+    _, fw_header = dicom_zip
+    members = set(get_updater(zip_copier(), fw_header).dicom_path_list)
+
+    def setup():
+        updater = get_updater(zip_copier(), fw_header, _update_dict=UPDATE_DICT)
+        return (updater,), dict()
+
+    def rewrite_zip(updater):
+        return updater.rewrite_zip(members)
+
+    updated = benchmark.pedantic(rewrite_zip, setup=setup, rounds=3)
+    (updater,), _ = setup()
+    record_allocations(rewrite_zip, updater)
+    assert len(updated) == len(members)
+
+
+def test_update_dicom_zip(benchmark, record_allocations, zip_copier, dicom_zip):
+    _, fw_header = dicom_zip
+    fw_header = dict(fw_header, **UPDATE_DICT)
+
+    def setup():
+        return (zip_copier(), fw_header, files_log), dict()
+
+    update_dicom_zip = DicomUpdater.update_dicom_zip
+    zip_path = benchmark.pedantic(update_dicom_zip, setup=setup, rounds=3)
+    record_allocations(update_dicom_zip, zip_copier(), fw_header, files_log)
+    with zipfile.ZipFile(zip_path) as zipf:
+        member = zipf.namelist()[0]
+        dcm = pydicom.dcmread(io.BytesIO(zipf.read(member)))
+    assert dcm.PatientID == "exported_patient"
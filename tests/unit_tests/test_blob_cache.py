@@ -0,0 +1,93 @@
+import os
+from unittest.mock import MagicMock
+
+import flywheel
+import pytest
+
+from blob_cache import BYTES_PER_MB, BlobCache
+
+
+def write_file(path, contents):
+    with open(path, "w") as fp:
+        fp.write(contents)
+    return str(path)
+
+
+def test_blob_cache_from_config(tmp_path):
+    assert BlobCache.from_config({}) is None
+    assert BlobCache.from_config({"download_cache_dir": ""}) is None
+    # only a directory path enables the cache
+    assert BlobCache.from_config(MagicMock()) is None
+    cache_dir = str(tmp_path / "cache")
+    blob_cache = BlobCache.from_config(
+        {"download_cache_dir": cache_dir, "download_cache_size_mb": 2}
+    )
+    assert blob_cache.directory == cache_dir
+    assert blob_cache.max_size == 2 * BYTES_PER_MB
+    assert os.path.isdir(cache_dir)
+
+
+def test_blob_cache_get_key():
+    key = BlobCache.get_key(flywheel.FileEntry(id="id", hash="hash"))
+    assert key == BlobCache.get_key(flywheel.FileEntry(id="id", hash="hash"))
+    # a new version of the file has a new key
+    assert key != BlobCache.get_key(flywheel.FileEntry(id="id", hash="other"))
+    assert BlobCache.get_key(flywheel.FileEntry(id="id")) is None
+
+
+def test_blob_cache(tmp_path):
+    blob_cache = BlobCache(str(tmp_path / "cache"), 10)
+    files = [flywheel.FileEntry(name=str(i), id=str(i), hash=str(i)) for i in range(3)]
+    dest_path = str(tmp_path / "dest")
+    assert not blob_cache.contains(files[0])
+    assert not blob_cache.get(files[0], dest_path)
+
+    blob_cache.put(files[0], write_file(tmp_path / "0", "0000"))
+    blob_cache.put(files[1], write_file(tmp_path / "1", "1111"))
+    assert blob_cache.get(files[0], dest_path)
+    with open(dest_path) as fp:
+        assert fp.read() == "0000"
+    # the cached copy is not modified with the retrieved copy
+    write_file(dest_path, "edited")
+    assert blob_cache.get(files[0], dest_path)
+    with open(dest_path) as fp:
+        assert fp.read() == "0000"
+
+    # files[1] is the least recently used blob
+    os.utime(blob_cache.get_blob_path(files[1]), (0, 0))
+    blob_cache.put(files[2], write_file(tmp_path / "2", "2222"))
+    assert blob_cache.contains(files[0])
+    assert not blob_cache.contains(files[1])
+    assert blob_cache.contains(files[2])
+
+    # files larger than the cache are not cached
+    large_file = flywheel.FileEntry(name="large", id="large", hash="large")
+    blob_cache.put(large_file, write_file(tmp_path / "large", "x" * 11))
+    assert not blob_cache.contains(large_file)
+    assert blob_cache.contains(files[0])
+
+
+def test_blob_cache_open_writer(tmp_path):
+    blob_cache = BlobCache(str(tmp_path / "cache"), 10)
+    file_entry = flywheel.FileEntry(name="a", id="a", hash="a", size=4)
+    with blob_cache.open_writer(file_entry) as fp:
+        fp.write(b"00")
+    # the file is incomplete
+    assert not blob_cache.contains(file_entry)
+    with pytest.raises(ValueError):
+        with blob_cache.open_writer(file_entry) as fp:
+            fp.write(b"0000")
+            raise ValueError
+    assert not blob_cache.contains(file_entry)
+    with blob_cache.open_writer(file_entry) as fp:
+        fp.write(b"0000")
+    assert blob_cache.contains(file_entry)
+    # the size of a file without size is provided
+    other_entry = flywheel.FileEntry(name="b", id="b", hash="b")
+    with blob_cache.open_writer(other_entry, size=2) as fp:
+        fp.write(b"00")
+    assert blob_cache.contains(other_entry)
+    # files without a cache key are not cached
+    with blob_cache.open_writer(flywheel.FileEntry(id="c")) as fp:
+        assert fp is None
+    assert not [name for name in os.listdir(blob_cache.directory) if ".tmp" in name]
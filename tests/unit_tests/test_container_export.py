@@ -1,28 +1,53 @@
+import csv
+import io
+import json
 import os
 import tempfile
+import threading
+import time
+from contextlib import nullcontext
 from contextlib import nullcontext as does_not_raise
 from copy import deepcopy
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, PropertyMock
 
 import flywheel
 import flywheel_gear_toolkit
 import pytest
 
+from blob_cache import BlobCache
 from container_export import (
+    CLASSIFICATION_SCHEMA_CACHE,
     CONTAINER_KWARGS_KEYS,
     EXCLUDE_TAGS,
+    ClassificationSchemaCache,
+    ContainerCache,
+    ContainerCopyIndex,
     ContainerExporter,
     ContainerHierarchy,
+    DownloadStream,
+    FileCopyIndex,
     FileExporter,
 )
+from export_journal import ExportJournal
+from export_log import ExportLog, ExportRecord
+from instrumentation import EXPORT_METRICS, ScopeMetrics
+from tests.benchmarks.fake_flywheel_api import FakeFlywheelAPI
 from util import hash_value
 
 
+@pytest.fixture(autouse=True)
+def clear_schema_cache():
+    CLASSIFICATION_SCHEMA_CACHE.clear()
+    yield
+    CLASSIFICATION_SCHEMA_CACHE.clear()
+
+
 @pytest.fixture
 def gear_context(sdk_mock):
     spec = dir(flywheel_gear_toolkit.GearToolkitContext)
     context_mock = MagicMock(spec=spec)
     context_mock.client = sdk_mock
+    context_mock.config = dict()
     return context_mock
 
 
@@ -69,6 +94,7 @@ class TestContainerExporter:
         gear_context_mock = MagicMock(
             spec=dir(flywheel_gear_toolkit.GearToolkitContext)
         )
+        gear_context_mock.config = dict()
         hierarchy_patch = mocker.patch(
             "container_export.ContainerExporter.get_hierarchy"
         )
@@ -101,6 +127,7 @@ class TestContainerExporter:
         gear_context_mock = MagicMock(
             spec=dir(flywheel_gear_toolkit.GearToolkitContext)
         )
+        gear_context_mock.config = dict()
         log_patch = mocker.patch("container_export.ExportLog")
         hierarchy_patch = mocker.patch(
             "container_export.ContainerExporter.get_hierarchy"
@@ -152,7 +179,9 @@ class TestContainerExporter:
         export, mocks = container_export("test", "test", flywheel.Session())
 
         hierarchy_mock.assert_called_once_with(
-            mocks["context"].client, flywheel.Session()
+            mocks["context"].client,
+            flywheel.Session(),
+            container_cache=export.container_cache,
         )
 
     @pytest.mark.parametrize("info", [{"test": "test"}, {"test": None}, {}])
@@ -175,8 +204,14 @@ class TestContainerExporter:
                 flywheel.Session(id="test"),
                 (f"info.export.origin_id={hash_value('test')}",),
             ),
-            (flywheel.Subject(label="test", code="test"), ("label=test", "code=test"),),
-            (flywheel.Subject(label="5", code="5"), ('label="5"', 'code="5"'),),
+            (
+                flywheel.Subject(label="test", code="test"),
+                ("label=test", "code=test"),
+            ),
+            (
+                flywheel.Subject(label="5", code="5"),
+                ('label="5"', 'code="5"'),
+            ),
         ],
     )
     def test_get_container_find_queries(self, container, label):
@@ -227,6 +262,75 @@ class TestContainerExporter:
         else:
             assert out == origin
 
+    @pytest.mark.parametrize(
+        "indexed,complete", [(True, True), (False, True), (False, False)]
+    )
+    def test_find_container_copy_index(self, indexed, complete):
+        origin = flywheel.Acquisition(
+            id="test", parents=flywheel.ContainerParents(session="origin_session")
+        )
+        parent = MagicMock(spec=dir(flywheel.Session) + ["acquisitions"])
+        parent.container_type = "session"
+        parent.id = "export_session"
+        found = flywheel.Acquisition(
+            id="found", info={"export": {"origin_id": hash_value("test")}}
+        )
+        copy_index = ContainerCopyIndex([found] if indexed else [])
+        if not complete:
+            # added without info
+            copy_index.add(flywheel.Acquisition(id="other"))
+
+        out = ContainerExporter.find_container_copy(
+            origin, parent, reload=False, copy_index=copy_index
+        )
+
+        if indexed:
+            assert out is found
+        else:
+            assert out is None
+        if complete:
+            parent.acquisitions.find_first.assert_not_called()
+        else:
+            parent.acquisitions.find_first.assert_called_once()
+
+    def test_get_copy_index(self, container_export):
+        export, _ = container_export("test", None, flywheel.Session(), mock=True)
+        copy = MagicMock(spec=dir(flywheel.Session) + ["acquisitions"])
+        # SDK listings do not include info
+        copy.acquisitions.iter.return_value = [flywheel.Acquisition(id="listed")]
+        subject = flywheel.Subject()
+        session = flywheel.Session()
+
+        assert export.get_copy_index(flywheel.Project(), copy) is None
+        assert export.get_copy_index(flywheel.Project(), copy, True) is None
+        assert export.get_copy_index(subject, copy, copy_created=True).complete
+        # the children of an existing copy are queried individually
+        assert export.get_copy_index(session, copy) is None
+        # a created copy has no children
+        copy_index = export.get_copy_index(session, copy, copy_created=True)
+        assert copy_index.complete
+        assert copy_index.find("origin_id") is None
+        copy.acquisitions.iter.assert_not_called()
+
+    @pytest.mark.parametrize("reload", [True, False])
+    def test_find_container_copy_reload(self, reload):
+        origin = flywheel.Session(
+            id="test", parents=flywheel.ContainerParents(subject="origin_subject")
+        )
+        parent = MagicMock(spec=dir(flywheel.Subject) + ["sessions"])
+        parent.container_type = "subject"
+        parent.id = "export_subject"
+        found = MagicMock(spec=flywheel.Session)
+        parent.sessions.find_first.return_value = found
+
+        out = ContainerExporter.find_container_copy(origin, parent, reload=reload)
+
+        if reload:
+            assert out is found.reload.return_value
+        else:
+            assert out is found
+            found.reload.assert_not_called()
+
     @pytest.mark.parametrize(
         "origin,parent",
         [
@@ -244,6 +348,49 @@ class TestContainerExporter:
         assert out.label == origin.label
         assert out.tags == origin.tags
 
+    @pytest.mark.parametrize("created_tags", [["test", "one"], ["test"], None])
+    def test_create_container_copy_tags(self, created_tags):
+        origin = flywheel.Session(id="test", tags=["test", "EXPORTED", "one"])
+        parent = MagicMock(spec=dir(flywheel.Subject))
+        created = MagicMock(spec=dir(flywheel.Session))
+        created.tags = created_tags
+        parent.add_session.return_value = created
+
+        ContainerExporter.create_container_copy(origin, parent)
+
+        # tags are sent with the creation request, excluding EXPORTED
+        assert parent.add_session.call_args[1]["tags"] == ["test", "one"]
+        missing_tags = [
+            tag for tag in ["test", "one"] if tag not in (created_tags or [])
+        ]
+        assert [c[0][0] for c in created.add_tag.call_args_list] == missing_tags
+
+    @pytest.mark.parametrize(
+        "status,tags,raises",
+        [
+            (400, ["test", "one"], does_not_raise()),
+            (422, ["test", "one"], does_not_raise()),
+            (500, ["test", "one"], pytest.raises(flywheel.rest.ApiException)),
+            (400, [], pytest.raises(flywheel.rest.ApiException)),
+        ],
+    )
+    def test_create_container_copy_tags_rejected(self, status, tags, raises):
+        origin = flywheel.Session(id="test", tags=tags)
+        parent = MagicMock(spec=dir(flywheel.Subject))
+        created = MagicMock(spec=dir(flywheel.Session))
+        created.tags = None
+        parent.add_session.side_effect = [
+            flywheel.rest.ApiException(status=status),
+            created,
+        ]
+
+        with raises:
+            ContainerExporter.create_container_copy(origin, parent)
+            # the container is created without tags, which are then added
+            assert parent.add_session.call_count == 2
+            assert "tags" not in parent.add_session.call_args[1]
+            assert [c[0][0] for c in created.add_tag.call_args_list] == tags
+
     @pytest.mark.parametrize("found", [None, flywheel.Subject(label="test")])
     def test_find_or_create_container_copy(self, mocker, found):
         find_mock = mocker.patch(
@@ -279,39 +426,570 @@ class TestContainerExporter:
         exporter_mock.return_value.find_or_create_file_copy.side_effect = side_effect
 
         found, created, failed = ContainerExporter.export_container_files(
-            sdk_mock, origin, "other", None
+            sdk_mock, origin, flywheel.Session(files=[]), None
+        )
+        assert failed == ["1", "3", "5", "7", "9"]
+        assert created == ["0", "6"]
+        assert found == ["2", "4", "8"]
+
+    def test_export_container_files_workers(self, sdk_mock, mocker):
+        def from_client(fw_client, file_entry, dicom_map, max_dicom_workers, **kwargs):
+            i = int(file_entry.name)
+            file_exporter = MagicMock()
+            file_exporter.find_or_create_file_copy.return_value = (
+                str(i) if i % 2 == 0 else None,
+                True if i % 3 == 0 else False,
+            )
+            return file_exporter
+
+        mocker.patch(
+            "container_export.FileExporter.from_client", side_effect=from_client
+        )
+        origin = flywheel.Session(
+            files=[flywheel.FileEntry(name=str(i)) for i in range(10)]
+        )
+
+        found, created, failed = ContainerExporter.export_container_files(
+            sdk_mock, origin, flywheel.Session(files=[]), None, max_workers=4
         )
         assert failed == ["1", "3", "5", "7", "9"]
         assert created == ["0", "6"]
         assert found == ["2", "4", "8"]
 
+    def test_export_container_files_journal(self, sdk_mock, mocker, tmp_path):
+        exporter_mock = mocker.patch("container_export.FileExporter.from_client")
+        exporter_mock.return_value.find_or_create_file_copy.return_value = ("1", True)
+        exporter_mock.return_value.origin_id = hash_value("file_1")
+        origin = flywheel.Session(
+            files=[flywheel.FileEntry(name=str(i), id=f"file_{i}") for i in range(2)]
+        )
+        export_container = flywheel.Session(id="copy_id", files=[])
+        journal = ExportJournal.open(str(tmp_path / "journal.jsonl"))
+        journal.add_file(export_container, hash_value("file_0"), "0", False)
+
+        found, created, failed = ContainerExporter.export_container_files(
+            sdk_mock, origin, export_container, None, journal=journal
+        )
+
+        assert found == ["0"]
+        assert created == ["1"]
+        # only the file missing from the journal is exported
+        assert exporter_mock.call_count == 1
+        assert journal.get_file(export_container, hash_value("file_1")) == ("1", True)
+
+    def test_export_container_files_export_log(self, sdk_mock, mocker):
+        exporter_mock = mocker.patch("container_export.FileExporter.from_client")
+        exporter_mock.return_value.find_or_create_file_copy.side_effect = [
+            ("0", True),
+            (None, False),
+        ]
+        file_metrics = ScopeMetrics()
+        file_metrics.counts["bytes_uploaded"] = 10
+        exporter_mock.return_value.metrics = file_metrics
+        origin = flywheel.Acquisition(
+            files=[flywheel.FileEntry(name=str(i)) for i in range(2)]
+        )
+        export_log = ExportLog(flywheel.Project(group="group", label="export"))
+
+        ContainerExporter.export_container_files(
+            sdk_mock,
+            origin,
+            flywheel.Acquisition(files=[]),
+            None,
+            export_log=export_log,
+            origin_path="group/project/subject/session/acquisition",
+        )
+
+        assert [
+            (r.file_name, r.status, r.bytes_uploaded) for r in export_log.file_records
+        ] == [("0", "created", 10), ("1", "failed", 10)]
+        assert {r.origin_path for r in export_log.file_records} == {
+            "group/project/subject/session/acquisition"
+        }
+
+    def test_export_child_container_journal(self, mocker, container_export, tmp_path):
+        export, _ = container_export("test", None, flywheel.Session(), mock=True)
+        export.journal = ExportJournal.open(str(tmp_path / "journal.jsonl"))
+        child = MagicMock(spec=dir(flywheel.Acquisition))
+        child.id = "child_id"
+        record = ExportRecord("acquisition", "child", "group/project/child", True)
+        export.journal.complete_container(child, record)
+        export_mock = mocker.patch.object(export, "export_container")
+
+        export.export_child_container(child, "copy", MagicMock())
+
+        export.export_log.add_record.assert_called_once_with(record)
+        child.reload.assert_not_called()
+        export_mock.assert_not_called()
+
+    @pytest.mark.parametrize("journaled", [True, False])
+    def test_export_container_journal_copy(
+        self, mocker, container_export, tmp_path, journaled
+    ):
+        export_project = flywheel.Project(id="export_id", label="export")
+        export, _ = container_export(
+            export_project, None, flywheel.Session(), mock=True
+        )
+        export.journal = ExportJournal.open(
+            str(tmp_path / "journal.jsonl"), export_project_id="export_id"
+        )
+        origin = flywheel.Acquisition(
+            id="origin_id",
+            label="acquisition",
+            files=[flywheel.FileEntry(name="a.txt", id="file_a")],
+        )
+        journal_copy = flywheel.Acquisition(id="copy_id", label="acquisition")
+        export.journal.add_container(origin, journal_copy, False)
+        if journaled:
+            export.journal.add_file(journal_copy, hash_value("file_a"), "a.txt", False)
+        reloaded = flywheel.Acquisition(
+            id="copy_id", label="acquisition", files=[flywheel.FileEntry(name="a.txt")]
+        )
+        reload_mock = mocker.patch.object(
+            flywheel.Acquisition, "reload", return_value=reloaded
+        )
+        find_mock = mocker.patch.object(export, "find_or_create_container_copy")
+        files_mock = mocker.patch.object(
+            export, "export_container_files", return_value=([], [], ["a.txt"])
+        )
+
+        c_copy, created = export.export_container(
+            origin, "parent", export_hierarchy=MagicMock(path="g/p/acquisition")
+        )
+
+        find_mock.assert_not_called()
+        assert c_copy.id == "copy_id"
+        assert created is False
+        # the copy is reloaded to find the files that were not journaled
+        assert reload_mock.called is not journaled
+        assert (files_mock.call_args[0][2] is reloaded) is not journaled
+
     @pytest.mark.parametrize(
-        "container",
+        "return_code,force_export,resumed",
+        [(0, False, False), (1, False, True), (1, True, False)],
+    )
+    def test_export_twice(
+        self, mocker, container_export, tmp_path, return_code, force_export, resumed
+    ):
+        origin = flywheel.Session(label="session", id="session_id")
+        export, mocks = container_export(
+            flywheel.Project(id="export_id", label="test"),
+            None,
+            origin,
+            config={"force_export": force_export},
+            mock=True,
+        )
+        mocks["context"].client.get_all_modalities.return_value = []
+        mocker.patch.object(
+            ContainerExporter,
+            "csv_path",
+            new_callable=PropertyMock,
+            return_value=str(tmp_path / "session_export_log.csv"),
+        )
+        journal_copies = list()
+
+        def export_origin_container():
+            journal_copies.append(
+                export.journal.get_container_copy(export.fw_client, origin)
+            )
+            export.journal.add_container(
+                origin, flywheel.Session(label="session", id="copy_id"), True
+            )
+            return return_code
+
+        mocker.patch.object(
+            export, "export_origin_container", side_effect=export_origin_container
+        )
+
+        assert export.export() == return_code
+        # the journal of a completed export is deleted
+        assert os.path.exists(export.journal_path) is bool(return_code)
+        assert export.export() == return_code
+
+        assert journal_copies[0] is None
+        if resumed:
+            assert journal_copies[1][0].id == "copy_id"
+        else:
+            assert journal_copies[1] is None
+
+    @pytest.mark.parametrize("workers", [1, 4])
+    def test_export_child_containers(self, mocker, container_export, workers):
+        mocker.patch("container_export.ContainerHierarchy.from_container")
+        export_project = flywheel.Project(group="export_group", label="export")
+        origin = MagicMock(spec=dir(flywheel.Session) + ["acquisitions"])
+        origin.container_type = "session"
+        children = list()
+        for i in range(8):
+            child = MagicMock(spec=dir(flywheel.Acquisition))
+            child.container_type = "acquisition"
+            child.id = child.label = str(i)
+            children.append(child)
+        origin.acquisitions.iter.return_value = children
+        export, mocks = container_export(
+            export_project, None, origin, config={"max_container_workers": workers}
+        )
+        get_mock = mocks["context"].client.get_acquisition
+        get_mock.side_effect = lambda child_id: children[int(child_id)]
+
+        def export_container(child, *args, **kwargs):
+            # later children finish first
+            time.sleep(0.01 * (8 - int(child.label)))
+            kwargs["export_log"].add_container_record(child.label, child, False)
+            return child, False
+
+        mocker.patch.object(export, "export_container", side_effect=export_container)
+        hierarchy = MagicMock()
+
+        export.export_child_containers(origin, "copy", hierarchy, copy_created=True)
+
+        assert [r.origin_path for r in export.export_log.records] == [
+            str(i) for i in range(8)
+        ]
+        # each child is retrieved once and cached
+        assert get_mock.call_count == 8
+        assert export.container_cache.get(None, "acquisition", "0") is children[0]
+        assert all(child.reload.call_count == 0 for child in children)
+
+    @pytest.mark.parametrize(
+        "config,finder_args",
         [
-            flywheel.Subject(label="test"),
-            flywheel.Session(label="test", subject=flywheel.Subject(label="test")),
+            ({"force_export": False}, None),
+            ({"force_export": False, "export_tag": "export"}, ('tags="export"',)),
+            ({"force_export": True, "export_tag": "export"}, ('tags="export"',)),
+            (
+                {"force_export": True, "export_tag": "to export,now"},
+                ('tags="to export,now"',),
+            ),
         ],
     )
-    def test_get_subject_export_params(self, mocker, container_export, container):
-        if container.container_type == "subject":
-            cont_mock = mocker.patch.object(container, "reload")
-            cont_mock.return_value = "mocked"
+    def test_get_batch_sessions(self, container_export, config, finder_args):
+        origin = MagicMock(spec=dir(flywheel.Project) + ["sessions"])
+        origin.container_type = "project"
+        export_tag = config.get("export_tag", "export")
+        sessions = [
+            flywheel.Session(label="1", tags=[export_tag]),
+            flywheel.Session(label="2", tags=[export_tag, "EXPORTED"]),
+        ]
+        # sessions matched by the filter without the exact tag are skipped
+        other_session = flywheel.Session(label="3", tags=["to export"])
+        origin.sessions.iter.return_value = iter(sessions)
+        origin.sessions.iter_find.return_value = iter(sessions + [other_session])
+        export, _ = container_export("test", None, origin, config=config, mock=True)
+
+        batch_sessions = export.get_batch_sessions()
+
+        if finder_args:
+            origin.sessions.iter_find.assert_called_once_with(*finder_args)
+        else:
+            origin.sessions.iter.assert_called_once_with()
+        if config["force_export"]:
+            assert batch_sessions == sessions
         else:
-            cont_mock = mocker.patch.object(container.subject, "reload")
-            cont_mock.return_value = "mocked"
+            assert batch_sessions == sessions[:1]
+
+    @pytest.mark.parametrize("workers", [1, 4])
+    def test_export_batch(self, mocker, container_export, workers, tmp_path):
+        mocker.patch("container_export.ContainerHierarchy.from_container")
+        export_project = flywheel.Project(group="export_group", label="export")
+        archive_project = flywheel.Project(group="export_group", label="archive")
+        origin = flywheel.Project(label="origin", id="origin_id")
+        subjects = [flywheel.Subject(label=f"sub{i}", id=f"sub{i}") for i in range(2)]
+        sessions = list()
+        for i in range(6):
+            session = MagicMock(spec=dir(flywheel.Session))
+            session.id = session.label = str(i)
+            session.subject = subjects[i % 2]
+            sessions.append(session)
+        export, mocks = container_export(
+            export_project,
+            archive_project,
+            origin,
+            config={"max_container_workers": workers, "max_dicom_workers": workers},
+        )
+        mocks["context"].output_dir = str(tmp_path)
+        mocks["context"].client.get_all_modalities.return_value = []
+        mocker.patch.object(export, "get_batch_sessions", return_value=sessions)
+        mocker.patch.object(
+            export.container_cache,
+            "get",
+            side_effect=lambda fw, ctype, cid: sessions[int(cid)],
+        )
+
+        mocker.patch.object(
+            export,
+            "get_hierarchy",
+            side_effect=lambda session: ContainerHierarchy(
+                subject=session.subject, session=session
+            ),
+        )
 
+        dicom_executors = set()
+        flushed_paths = list()
+
+        def export_container(container, *args, **kwargs):
+            dicom_executors.add(export.dicom_executor)
+            if container.label == "5":
+                with open(tmp_path / "origin_export_log.csv") as csvfile:
+                    flushed_paths.extend(
+                        row["Origin Path"] for row in csv.DictReader(csvfile)
+                    )
+            if container.label == "3":
+                raise flywheel.rest.ApiException(status=500)
+            time.sleep(0.001 * (6 - int(container.id[-1])))
+            failed = ["file"] if container.label == "4" else []
+            kwargs["export_log"].add_container_record(
+                container.label, container, False, failed_files=failed
+            )
+            return container, False
+
+        export_mock = mocker.patch.object(
+            export, "export_container", side_effect=export_container
+        )
+        archive_mock = mocker.patch.object(
+            export, "archive_sessions", return_value=True
+        )
+
+        assert export.export() == 1
+
+        # each subject is exported once, in the log of its first session
+        subject_calls = [
+            c for c in export_mock.call_args_list if c[0][1] is export_project
+        ]
+        assert len(subject_calls) == 2
+        # records are written to the csv as they are merged
+        assert export.export_log.records == []
+        with open(tmp_path / "origin_export_log.csv") as csvfile:
+            rows = list(csv.DictReader(csvfile))
+        origin_paths = [row["Origin Path"] for row in rows]
+        assert sorted(p for p in origin_paths if p.startswith("sub")) == [
+            "sub0",
+            "sub1",
+        ]
+        # session records are merged in listing order
+        assert [p for p in origin_paths if not p.startswith("sub")] == [
+            "0",
+            "1",
+            "2",
+            "4",
+            "5",
+        ]
+        assert all("Archive Path" in row for row in rows)
+        if workers == 1:
+            # the earlier sessions were written before the last one ended
+            assert [p for p in flushed_paths if not p.startswith("sub")] == [
+                "0",
+                "1",
+                "2",
+                "4",
+            ]
+        archive_mock.assert_called_once_with(
+            [sessions[0], sessions[1], sessions[2], sessions[5]]
+        )
+        metrics = json.loads((tmp_path / "origin_export_log_metrics.json").read_text())
+        assert set(metrics) >= {"stages", "api_calls", "containers", "files"}
+        assert (tmp_path / "origin_export_log_journal.jsonl").exists()
+        assert (tmp_path / "origin_export_log_files.csv").exists()
+        # a single DICOM process pool is shared by the export's threads
+        assert len(dicom_executors) == 1
+        assert (dicom_executors.pop() is not None) is (workers > 1)
+        assert export.dicom_executor is None
+
+    @pytest.mark.parametrize("workers", [1, 4])
+    def test_archive_sessions(self, mocker, container_export, workers):
+        mocker.patch("container_export.ContainerHierarchy.from_container")
+        archive_project = flywheel.Project(group="export_group", label="archive")
+        subjects = [flywheel.Subject(label=f"sub{i}", id=f"sub{i}") for i in range(2)]
+        sessions = list()
+        for i in range(4):
+            session = MagicMock(spec=dir(flywheel.Session))
+            session.id = session.label = str(i)
+            session.subject = subjects[i % 2]
+            if i == 3:
+                session.update.side_effect = flywheel.rest.ApiException(status=400)
+            sessions.append(session)
+        export, mocks = container_export(
+            flywheel.Project(group="export_group", label="export"),
+            archive_project,
+            flywheel.Project(label="origin"),
+            config={"max_container_workers": workers},
+        )
+        mocker.patch.object(
+            export.container_cache,
+            "get",
+            side_effect=lambda fw, ctype, cid: subjects[int(cid[-1])],
+        )
+        dest_subjects = [flywheel.Subject(id=f"dest{i}") for i in range(2)]
+        find_mock = mocker.patch.object(
+            export,
+            "find_or_create_container_copy",
+            side_effect=lambda origin, parent, **kwargs: (
+                dest_subjects[int(origin.id[-1])],
+                False,
+            ),
+        )
+        mocker.patch.object(
+            export,
+            "get_hierarchy",
+            side_effect=lambda session: MagicMock(path=f"g/p/s/{session.label}"),
+        )
+
+        assert export.archive_sessions(iter(sessions)) is False
+
+        # the destination subject is resolved once per subject
+        assert find_mock.call_count == 2
+        for i, session in enumerate(sessions):
+            session.update.assert_called_once_with({"subject": {"_id": f"dest{i % 2}"}})
+        assert export.export_log.archive_results == {
+            "g/p/s/0": True,
+            "g/p/s/1": True,
+            "g/p/s/2": True,
+            "g/p/s/3": False,
+        }
+
+    def test_archive_sessions_subject_failure(self, mocker, container_export):
+        mocker.patch("container_export.ContainerHierarchy.from_container")
+        subjects = [flywheel.Subject(label=f"sub{i}", id=f"sub{i}") for i in range(2)]
+        sessions = list()
+        for i in range(2):
+            session = MagicMock(spec=dir(flywheel.Session))
+            session.id = session.label = str(i)
+            session.subject = subjects[i]
+            sessions.append(session)
+        export, mocks = container_export(
+            flywheel.Project(label="export"),
+            flywheel.Project(label="archive"),
+            flywheel.Project(label="origin"),
+        )
+        mocker.patch.object(
+            export.container_cache,
+            "get",
+            side_effect=lambda fw, ctype, cid: subjects[int(cid[-1])],
+        )
+
+        def find_or_create(origin, parent, **kwargs):
+            if origin.id == "sub1":
+                raise flywheel.rest.ApiException(status=500)
+            return flywheel.Subject(id="dest0"), False
+
+        mocker.patch.object(
+            export, "find_or_create_container_copy", side_effect=find_or_create
+        )
+        mocker.patch.object(
+            export,
+            "get_hierarchy",
+            side_effect=lambda session: MagicMock(path=f"g/p/s/{session.label}"),
+        )
+
+        assert export.archive_sessions(sessions) is False
+
+        # the sessions of the subject that failed are not moved
+        sessions[0].update.assert_called_once_with({"subject": {"_id": "dest0"}})
+        sessions[1].update.assert_not_called()
+        assert export.export_log.archive_results == {
+            "g/p/s/0": True,
+            "g/p/s/1": False,
+        }
+
+    def test_iter_map_containers(self, container_export):
+        export, _ = container_export(
+            "test",
+            None,
+            flywheel.Session(),
+            config={"max_container_workers": 2},
+            mock=True,
+        )
+        first_consumed = threading.Event()
+
+        def func(i):
+            if i == 1:
+                # only set if the first result is yielded before this ends
+                return first_consumed.wait(timeout=5)
+            return i
+
+        results = export.iter_map_containers(func, [0, 1])
+        assert next(results) == 0
+        first_consumed.set()
+        assert next(results) is True
+        assert export.map_containers(func, [0, 2]) == [0, 2]
+
+    def test_move_container_retry(self, mocker):
+        mocker.patch("time.sleep")
+        session = MagicMock(spec=dir(flywheel.Session))
+        session.update.side_effect = [flywheel.rest.ApiException(status=502), None]
+        ContainerExporter.move_container(session, {"subject": {"_id": "dest"}})
+        assert session.update.call_count == 2
+
+    @pytest.mark.parametrize("found", [True, False])
+    def test_archive_subject(self, mocker, container_export, found):
+        archive_project = flywheel.Project(label="archive", id="archive_id")
+        origin = MagicMock(spec=flywheel.Subject)
+        origin.container_type = "subject"
+        origin.sessions = MagicMock()
+        export, mocks = container_export("export", archive_project, origin, mock=True)
+        export.origin_hierarchy = MagicMock(path="g/p/subject")
+        found_subject = flywheel.Subject(id="found") if found else None
+        mocker.patch.object(export, "find_container_copy", return_value=found_subject)
+        archive_mock = mocker.patch.object(
+            export, "archive_sessions", return_value=True
+        )
+
+        assert export.archive() is True
+
+        if found:
+            archive_mock.assert_called_once_with(
+                origin.sessions.iter.return_value, found_subject
+            )
+            origin.update.assert_not_called()
+        else:
+            archive_mock.assert_not_called()
+            origin.update.assert_called_once_with({"project": "archive_id"})
+            export.export_log.add_archive_result.assert_called_once_with(
+                "g/p/subject", True
+            )
+
+    def test_container_slot(self, container_export):
+        export, _ = container_export(
+            "test", None, flywheel.Session(), config={}, mock=True
+        )
+        assert isinstance(export.container_slot(), nullcontext)
+        export.config["max_container_workers"] = 2
+        slot = export.container_slot()
+        assert slot is export.container_slot()
+        with slot:
+            with slot:
+                assert not slot.acquire(blocking=False)
+
+    @pytest.mark.parametrize(
+        "container",
+        [
+            flywheel.Subject(label="test", id="subject_id"),
+            flywheel.Session(
+                label="test", subject=flywheel.Subject(label="test", id="subject_id")
+            ),
+        ],
+    )
+    def test_get_subject_export_params(self, mocker, container_export, container):
         export, mocks = container_export("test", "test", container, mock=True)
+        mocks["context"].client.get_subject.return_value = "mocked"
 
         orig, proj, att, hier = export.get_subject_export_params()
 
-        assert orig == "mocked"
         assert proj == "test"
         if container.container_type == "subject":
+            # the origin container is cached
+            assert orig is container
             assert att == None
         else:
+            assert orig == "mocked"
             assert att == False
 
         assert mocks["hierarchy"].call_count == 1
+        # subsequent lookups are cached
+        export.get_subject_export_params()
+        if container.container_type == "subject":
+            mocks["context"].client.get_subject.assert_not_called()
+        else:
+            mocks["context"].client.get_subject.assert_called_once_with("subject_id")
 
     @pytest.mark.parametrize(
         "origin,ctype",
@@ -341,7 +1019,11 @@ def test_container_hierarchy():
         "group": flywheel.Group(id="test_group", label="Test Group"),
         "project": flywheel.Project(label="test_project"),
         "subject": flywheel.Subject(label="test_subject", sex="other"),
-        "session": flywheel.Session(age=31000000, label="test_session", weight=50,),
+        "session": flywheel.Session(
+            age=31000000,
+            label="test_session",
+            weight=50,
+        ),
     }
     # test from_dict
     test_hierarchy = ContainerHierarchy.from_dict(hierarchy_dict)
@@ -400,6 +1082,38 @@ def test_container_hierarchy():
     # test get_parent_hierarchy
     parent_hierarchy = test_hierarchy.get_parent_hierarchy()
     assert parent_hierarchy.container_type == "subject"
+    # the container type of a new hierarchy is resolved
+    new_hierarchy = ContainerHierarchy(
+        subject=flywheel.Subject(label="test_subject"),
+        session=flywheel.Session(label="test_session"),
+    )
+    parent_hierarchy = new_hierarchy.get_parent_hierarchy()
+    assert parent_hierarchy.session is None
+    assert parent_hierarchy.subject.label == "test_subject"
+
+
+def test_container_hierarchy_dicom_map_cache(mocker):
+    hierarchy = ContainerHierarchy(
+        group=flywheel.Group(id="test_group"),
+        subject=flywheel.Subject(label="test_subject", sex="female"),
+        session=flywheel.Session(label="test_session", weight=50),
+        acquisition=flywheel.Acquisition(label=["spam", "eggs"]),
+    )
+    map_spy = mocker.spy(ContainerHierarchy, "get_dicom_map_dict")
+    dicom_map = hierarchy.dicom_map
+    assert hierarchy.dicom_map is dicom_map
+    assert hierarchy.compatible_dicom_map is hierarchy.compatible_dicom_map
+    assert map_spy.call_count == 1
+    # VM 1 SeriesDescription list is joined
+    assert dicom_map["SeriesDescription"] == ["spam", "eggs"]
+    assert hierarchy.compatible_dicom_map["SeriesDescription"] == "spam\\eggs"
+    assert hierarchy.compatible_dicom_map["PatientSex"] == "F"
+    # changing the hierarchy invalidates the cached values
+    hierarchy.acquisition = flywheel.Acquisition(label="new")
+    assert hierarchy.dicom_map["SeriesDescription"] == "new"
+    assert hierarchy.compatible_dicom_map["SeriesDescription"] == "new"
+    assert hierarchy.path == "test_group/test_subject/test_session/new"
+    assert map_spy.call_count == 2
 
 
 MR_CLASSIFICATION_SCHEMA = {
@@ -611,6 +1325,16 @@ def test_file_exporter():
     export_parent.files = list()
     fn, created = file_exporter.find_or_create_file_copy(export_parent)
     assert created
+    # created copies are added to a shared index
+    file_index = FileCopyIndex.from_container(export_parent)
+    fn, created = file_exporter.find_or_create_file_copy(
+        export_parent, file_index=file_index
+    )
+    assert created
+    fn, created = file_exporter.find_or_create_file_copy(
+        export_parent, file_index=file_index
+    )
+    assert not created
     # test update_dicom
     _, temp_path = tempfile.mkstemp()
 
@@ -619,3 +1343,345 @@ def test_file_exporter():
     # returns local path if no header is defined
     assert file_exporter.update_dicom(temp_path)
     os.remove(temp_path)
+
+
+def test_file_exporter_download_cache(tmp_path):
+    file_entry = flywheel.FileEntry(name="a.nii", id="file_id", hash="h", info={})
+    downloads = list()
+
+    def download(path):
+        downloads.append(path)
+        with open(path, "w") as fp:
+            fp.write("contents")
+
+    file_entry.download = download
+    blob_cache = BlobCache(str(tmp_path / "cache"), 1024)
+    file_exporter = FileExporter(file_entry, {}, None, blob_cache=blob_cache)
+    for i in range(2):
+        download_dir = tmp_path / str(i)
+        download_dir.mkdir()
+        with EXPORT_METRICS.scope("file", f"download_{i}") as metrics:
+            path = file_exporter.download(str(download_dir))
+        assert path == str(download_dir / "a.nii")
+        with open(path) as fp:
+            assert fp.read() == "contents"
+        # copies from the cache are not counted as downloaded
+        assert metrics.counts["bytes_downloaded"] == (0 if i else len("contents"))
+    # the second download is copied from the cache
+    assert len(downloads) == 1
+
+
+def test_download_stream():
+    response = MagicMock()
+    response.raw = io.BytesIO(b"0123456789")
+    stream = DownloadStream(response, 10)
+    assert response.raw.decode_content
+    # the SDK only passes file objects through to the multipart encoder
+    assert isinstance(stream, io.IOBase) and stream.readable()
+    assert stream.read(4) == b"0123"
+    assert (stream.len, stream.tell()) == (10, 4)
+    assert stream.read() == b"456789"
+    assert stream.tell() == 10
+    assert stream.read(4) == b""
+    # the download ended before the expected length
+    response.raw = io.BytesIO(b"0123")
+    stream = DownloadStream(response, 10)
+    stream.read(8)
+    with pytest.raises(IOError):
+        stream.read(8)
+
+
+def test_download_stream_tee():
+    response = MagicMock()
+    response.raw = io.BytesIO(b"0123456789")
+    tee_fp = io.BytesIO()
+    stream = DownloadStream(response, 10, tee_fp=tee_fp)
+    assert stream.read(4) == b"0123"
+    assert stream.read() == b"456789"
+    assert tee_fp.getvalue() == b"0123456789"
+    # the tee is dropped when a write fails, without failing the read
+    response.raw = io.BytesIO(b"0123456789")
+    tee_fp = MagicMock()
+    tee_fp.write.side_effect = OSError
+    stream = DownloadStream(response, 10, tee_fp=tee_fp)
+    assert stream.read(4) == b"0123"
+    assert stream.read() == b"456789"
+    tee_fp.write.assert_called_once_with(b"0123")
+
+
+@pytest.mark.parametrize("size", [10, 3 * 1024 * 1024 + 1])
+def test_stream_file_copy_sdk_upload(size):
+    contents = os.urandom(size)
+    with FakeFlywheelAPI() as api:
+        api.add_container("group", "group")
+        project_id = api.add_container("project", "project", "group")
+        subject_id = api.add_container("subject", "subject", project_id)
+        session_id = api.add_container("session", "session", subject_id)
+        origin_id = api.add_container("acquisition", "origin", session_id)
+        export_id = api.add_container("acquisition", "export", session_id)
+        api.add_file(origin_id, "image.nii.gz", contents, type="nifti")
+        fw_client = api.get_client()
+        file_entry = fw_client.get_acquisition(origin_id).files[0]
+        file_exporter = FileExporter.from_client(fw_client, file_entry)
+
+        # the real SDK upload of the streamed download
+        assert file_exporter.stream_file_copy(fw_client.get_acquisition(export_id))
+
+        assert api.file_contents[(export_id, "image.nii.gz")] == contents
+        assert api.calls["download_file"] == 1
+        assert api.calls["upload_file"] == 1
+
+
+def test_stream_file_copy_cache(tmp_path):
+    file_entry = flywheel.FileEntry(
+        name="a.nii", id="file_id", hash="h", size=10, info={}
+    )
+    file_entry._parent = flywheel.Acquisition(id="parent_id")
+    response = MagicMock()
+    response.raw = io.BytesIO(b"0123456789")
+    uploads = list()
+
+    def upload(container_id, file, metadata):
+        uploads.append(file.contents.read())
+
+    blob_cache = BlobCache(str(tmp_path / "cache"), 1024)
+    file_exporter = FileExporter(
+        file_entry,
+        {},
+        upload,
+        download_function=MagicMock(return_value=response),
+        blob_cache=blob_cache,
+    )
+    assert file_exporter.stream_file_copy(flywheel.Acquisition(id="export_id"))
+    assert uploads == [b"0123456789"]
+    # the streamed bytes are cached
+    assert blob_cache.contains(file_entry)
+    dest_path = str(tmp_path / "dest")
+    assert blob_cache.get(file_entry, dest_path)
+    with open(dest_path, "rb") as fp:
+        assert fp.read() == b"0123456789"
+
+
+@pytest.mark.parametrize("error", [AttributeError, IOError])
+def test_stream_file_copy_error(error):
+    file_entry = flywheel.FileEntry(name="a.nii", id="file_id", size=10, info={})
+    file_entry._parent = flywheel.Acquisition(id="parent_id")
+    response = MagicMock()
+    response.raw = io.BytesIO(b"0123456789")
+    upload_func = MagicMock(side_effect=error)
+    file_exporter = FileExporter(
+        file_entry,
+        {},
+        upload_func,
+        download_function=MagicMock(return_value=response),
+    )
+
+    # streaming failures are not raised, the file is not streamed instead
+    assert file_exporter.stream_file_copy(flywheel.Acquisition(id="export_id")) is False
+    upload_func.assert_called_once()
+    response.close.assert_called_once()
+
+
+@pytest.mark.parametrize(
+    "file_type,size,headers,info,streamed",
+    [
+        ("nifti", 10, {}, {}, True),
+        ("nifti", None, {"Content-Length": "10"}, {}, True),
+        (
+            "nifti",
+            None,
+            {"Content-Length": "10", "Content-Encoding": "gzip"},
+            {},
+            False,
+        ),
+        # no header to apply to the DICOM
+        ("dicom", 10, {}, {}, True),
+        ("dicom", 10, {}, {"header": {"dicom": {"PatientID": "1"}}}, False),
+    ],
+)
+def test_file_exporter_stream_file_copy(
+    mocker, file_type, size, headers, info, streamed
+):
+    parent = flywheel.Acquisition(id="parent_id")
+    file_entry = flywheel.FileEntry(
+        name="a*file.nii",
+        id="file_id",
+        type=file_type,
+        size=size,
+        info=deepcopy(info),
+    )
+    file_entry._parent = parent
+    uploaded = dict()
+
+    def upload_func(container_id, file, metadata):
+        if isinstance(file, flywheel.FileSpec):
+            uploaded[file.name] = file.contents.read(4) + file.contents.read()
+        else:
+            uploaded[file] = None
+
+    response = MagicMock()
+    response.raw = io.BytesIO(b"0123456789")
+    response.headers = headers
+    download_func = MagicMock(return_value=response)
+    file_exporter = FileExporter(
+        file_entry, {}, upload_func, download_function=download_func
+    )
+    download_mock = mocker.patch.object(
+        file_exporter, "download", return_value="/tmp/afile.nii"
+    )
+    update_mock = mocker.patch.object(file_exporter, "update_dicom", return_value=True)
+
+    assert file_exporter.create_file_copy(parent) == "afile.nii"
+    if streamed:
+        download_func.assert_called_once_with("parent_id", "a*file.nii")
+        assert uploaded == {"afile.nii": b"0123456789"}
+        download_mock.assert_not_called()
+        response.close.assert_called_once()
+    else:
+        assert uploaded == {"/tmp/afile.nii": None}
+        download_mock.assert_called_once()
+    assert update_mock.called == file_exporter.requires_content_change()
+    assert file_exporter.requires_content_change() == ("header" in info)
+
+
+@pytest.mark.parametrize(
+    "file_type,info",
+    [("nifti", {}), ("dicom", {}), ("dicom", {"header": {"other": {}}})],
+)
+def test_create_file_copy_stream_fallback(mocker, file_type, info):
+    parent = flywheel.Acquisition(id="parent_id")
+    file_entry = flywheel.FileEntry(
+        name="a.file", id="file_id", type=file_type, size=10, info=info
+    )
+    file_entry._parent = parent
+    uploaded = list()
+
+    def upload_func(container_id, file, metadata):
+        if isinstance(file, flywheel.FileSpec):
+            # i.e. the SDK failing to serialize the streamed contents
+            raise AttributeError("swagger_types")
+        uploaded.append(file)
+
+    response = MagicMock()
+    response.raw = io.BytesIO(b"0123456789")
+    download_func = MagicMock(return_value=response)
+    file_exporter = FileExporter(
+        file_entry, {}, upload_func, download_function=download_func
+    )
+    download_mock = mocker.patch.object(
+        file_exporter, "download", return_value="/tmp/a.file"
+    )
+    update_mock = mocker.patch.object(file_exporter, "update_dicom")
+
+    assert not file_exporter.requires_content_change()
+    # the file is downloaded and uploaded after streaming failed
+    assert file_exporter.create_file_copy(parent) == "a.file"
+    download_func.assert_called_once()
+    download_mock.assert_called_once()
+    update_mock.assert_not_called()
+    assert uploaded == ["/tmp/a.file"]
+
+
+def test_file_copy_index():
+    origin_id = hash_value("origin")
+    file_entries = [
+        flywheel.FileEntry(name="a.txt", info={"export": {"origin_id": origin_id}}),
+        flywheel.FileEntry(name="b.txt", info={}),
+        flywheel.FileEntry(name="c.txt", info=None),
+    ]
+    file_index = FileCopyIndex(file_entries)
+    assert file_index.find(origin_id, ("a.txt",)) is file_entries[0]
+    assert file_index.find(origin_id, ("b.txt", "a.txt")) is file_entries[0]
+    assert file_index.find(origin_id, ("b.txt",)) is None
+    assert file_index.find(hash_value("other"), ("a.txt",)) is None
+    file_index.add(
+        flywheel.FileEntry(name="b.txt", info={"export": {"origin_id": origin_id}})
+    )
+    assert file_index.find(origin_id, ("b.txt",)).name == "b.txt"
+
+
+def test_classification_schema_cache(mocker):
+    mock_client = MagicMock(spec=dir(flywheel.Client))
+    mock_client.get_modality.return_value = {"classification": MR_CLASSIFICATION_SCHEMA}
+    cache = ClassificationSchemaCache()
+    assert cache.get(mock_client, None) == {}
+    for _ in range(3):
+        assert cache.get(mock_client, "MR") == MR_CLASSIFICATION_SCHEMA
+    mock_client.get_modality.assert_called_once_with("MR")
+
+    # 404s are cached as empty schemas
+    mock_client.get_modality.side_effect = flywheel.ApiException(status=404)
+    for _ in range(3):
+        assert cache.get(mock_client, "CT") == {}
+    assert mock_client.get_modality.call_count == 2
+
+    # other errors are raised and not cached
+    mock_client.get_modality.side_effect = flywheel.ApiException(status=400)
+    with pytest.raises(flywheel.ApiException):
+        cache.get(mock_client, "PT")
+    with pytest.raises(flywheel.ApiException):
+        cache.get(mock_client, "PT")
+
+    # expired entries are requested again
+    monotonic = mocker.patch("container_export.time.monotonic", return_value=0)
+    cache = ClassificationSchemaCache(ttl=10)
+    mock_client.get_modality.side_effect = None
+    mock_client.get_modality.reset_mock()
+    cache.get(mock_client, "MR")
+    monotonic.return_value = 5
+    cache.get(mock_client, "MR")
+    assert mock_client.get_modality.call_count == 1
+    monotonic.return_value = 11
+    cache.get(mock_client, "MR")
+    assert mock_client.get_modality.call_count == 2
+
+
+def test_classification_schema_cache_prefetch():
+    mock_client = MagicMock(spec=dir(flywheel.Client) + dir(flywheel.Flywheel))
+    mock_client.get_all_modalities.return_value = [
+        flywheel.Modality(id="MR", classification=MR_CLASSIFICATION_SCHEMA),
+        flywheel.Modality(id="CT", classification={"Intent": ["Localizer"]}),
+    ]
+    cache = ClassificationSchemaCache()
+    cache.prefetch(mock_client)
+    assert cache.get(mock_client, "MR") == MR_CLASSIFICATION_SCHEMA
+    assert cache.get(mock_client, "CT") == {"Intent": ["Localizer"]}
+    mock_client.get_modality.assert_not_called()
+
+    # failed prefetch falls back to per-modality requests
+    mock_client.get_all_modalities.side_effect = flywheel.ApiException(status=500)
+    mock_client.get_modality.return_value = {"classification": {}}
+    cache = ClassificationSchemaCache()
+    cache.prefetch(mock_client)
+    assert cache.get(mock_client, "MR") == {}
+    mock_client.get_modality.assert_called_once_with("MR")
+
+
+def test_container_cache():
+    mock_client = MagicMock(spec=dir(flywheel.Client) + dir(flywheel.Flywheel))
+    mock_client.get_project.side_effect = lambda x: flywheel.Project(id=x)
+    mock_client.get_subject.side_effect = lambda x: flywheel.Subject(id=x)
+    cache = ContainerCache()
+    assert cache.get(mock_client, "project", None) is None
+    containers = cache.get_many(mock_client, {"project": "p1", "subject": "s1"})
+    assert containers["project"].id == "p1"
+    assert containers["subject"].id == "s1"
+    assert cache.get(mock_client, "subject", "s1") is containers["subject"]
+    assert cache.get_many(mock_client, {"project": "p1"}) == {
+        "project": containers["project"]
+    }
+    mock_client.get_project.assert_called_once_with("p1")
+    mock_client.get_subject.assert_called_once_with("s1")
+    cache.add(flywheel.Session(id="se1", label="added"))
+    assert cache.get(mock_client, "session", "se1").label == "added"
+
+    # hierarchies share the cache
+    session = flywheel.Session(
+        id="se2", parents=flywheel.ContainerParents(project="p1", subject="s1")
+    )
+    hierarchy = ContainerHierarchy.from_container(
+        mock_client, session, container_cache=cache
+    )
+    assert hierarchy.subject is containers["subject"]
+    assert hierarchy.session is session
+    mock_client.get_subject.assert_called_once_with("s1")
@@ -1,11 +1,18 @@
 import filecmp
+import io
 import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 import pydicom
+import pytest
 from pydicom.data import get_testdata_files
 from pydicom.dataelem import RawDataElement
 from pydicom.tag import Tag
 
+import dicom_edit
 from dicom_edit import *
 from dicom_metadata import get_pydicom_header
 
@@ -16,6 +23,67 @@ def test_write_dcm_to_tempfile():
     write_dcm_to_tempfile(dcm)
 
 
+def test_locked_pydicom_config():
+    acquired = list()
+
+    def try_acquire():
+        acquired.append(dicom_edit.PYDICOM_CONFIG_LOCK.acquire(blocking=False))
+
+    with locked_pydicom_config(use_fw_callback=True):
+        assert pydicom.config.data_element_callback is not None
+        thread = threading.Thread(target=try_acquire)
+        thread.start()
+        thread.join()
+    assert acquired == [False]
+    assert pydicom.config.data_element_callback is None
+
+
+def test_concurrent_dicom_edits(mocker, tmp_path):
+    """Concurrent file or container exports never overlap pydicom.config changes"""
+    active = list()
+    overlaps = list()
+    fw_pydicom_config = dicom_edit.fw_pydicom_config
+
+    @contextmanager
+    def checked_config(**kwargs):
+        with fw_pydicom_config(**kwargs):
+            overlaps.append(bool(active))
+            active.append(kwargs)
+            expected_callback = kwargs.get("use_fw_callback", True)
+            # leave time for the other thread to change the config
+            time.sleep(0.01)
+            try:
+                yield
+            finally:
+                assert (pydicom.config.data_element_callback is not None) is (
+                    expected_callback
+                )
+                active.remove(kwargs)
+
+    mocker.patch("dicom_edit.fw_pydicom_config", checked_config)
+    dcm_path = get_testdata_files("MR_small.dcm")[0]
+    paths = [str(tmp_path / f"{i}.dcm") for i in range(2)]
+    for path in paths:
+        shutil.copyfile(dcm_path, path)
+    # the single-pass edit keeps the default config, the probing edit changes it
+    edits = [
+        (edit_dicom_single_pass, paths[0], {"PatientID": "single"}),
+        (edit_dicom_with_probing, paths[1], {"PatientID": "probing"}),
+    ]
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [
+            executor.submit(lambda edit, *args: [edit(*args) for _ in range(3)], *e)
+            for e in edits
+        ]
+        results = [future.result() for future in futures]
+
+    assert results == [[paths[0]] * 3, [paths[1]] * 3]
+    assert len(overlaps) > 6 and not any(overlaps)
+    assert pydicom.config.data_element_callback is None
+    assert pydicom.dcmread(paths[0]).PatientID == "single"
+    assert pydicom.dcmread(paths[1]).PatientID == "probing"
+
+
 def test_character_set_callback():
     raw_elem = RawDataElement(Tag(0x00080005), "UN", 14, b"iso8859", 770, False, True,)
     raw_elem_fix = character_set_callback(raw_elem)
@@ -43,6 +111,37 @@ def test_edit_dicom():
         assert edit_dicom("does_not_exist.dcm", {"PatientID": "Flywheel"}) is None
 
 
+def test_update_dataset():
+    dcm_path = get_testdata_files("MR_small.dcm")[0]
+    dcm = pydicom.dcmread(dcm_path)
+    assert update_dataset(dcm, {"PatientID": "Flywheel"}) == []
+    assert dcm.PatientID == "Flywheel"
+    assert update_dataset(dcm, {"PatientID": 2, "NotaTag": 2}) == [
+        "PatientID",
+        "NotaTag",
+    ]
+
+
+def test_edit_dicom_single_pass(mocker):
+    dcm_path = get_testdata_files("MR_small.dcm")[0]
+    dcm = pydicom.dcmread(dcm_path)
+    probe_spy = mocker.spy(dicom_edit, "get_dicom_save_config_kwargs")
+    with tempfile.TemporaryDirectory() as tempdir:
+        temp_path = os.path.join(tempdir, "test.dcm")
+        dcm.save_as(temp_path)
+        assert edit_dicom_single_pass(temp_path, {"PatientID": "Flywheel"})
+        assert pydicom.dcmread(temp_path).PatientID == "Flywheel"
+        # failed validation leaves the file untouched
+        assert edit_dicom_single_pass(temp_path, {"PatientID": 2}) is None
+        assert pydicom.dcmread(temp_path).PatientID == "Flywheel"
+        assert os.listdir(tempdir) == ["test.dcm"]
+        # probing path is only used on failure
+        assert edit_dicom(temp_path, {"PatientID": "Other"})
+        probe_spy.assert_not_called()
+        assert edit_dicom(temp_path, {"PatientID": 2}) is None
+        probe_spy.assert_called_once_with(temp_path)
+
+
 def test_dicom_list_updater_valid(caplog):
     caplog.set_level(logging.DEBUG)
     # Test updater with no difference between fw and DICOMs
@@ -55,8 +154,9 @@ def test_dicom_list_updater_valid(caplog):
         dcm_updater = DicomUpdater(
             [dcm_copy_path], header, files_log=logging.getLogger("test")
         )
-        # Only one file, everything is common
-        assert header == dcm_updater.local_common_dicom_dict
+        # Only one file, everything up to PixelData is common
+        assert dcm_updater.fw_header == dcm_updater.local_common_dicom_dict
+        assert set(header) - set(dcm_updater.fw_header) == {"DataSetTrailingPadding"}
         assert dcm_updater.safe_to_update
         assert not any(
             [
@@ -107,6 +207,158 @@ def test_dicom_list_updater_valid(caplog):
             assert not dcm_updater.update_dict
 
 
+class UnseekableWriter(io.RawIOBase):
+    """Writer without seek/tell so that zipfile uses data descriptors"""
+
+    def __init__(self, path):
+        self._fp = open(path, "wb")
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self._fp.write(data)
+
+    def close(self):
+        self._fp.close()
+        super().close()
+
+
+def test_zip_dicom_updater():
+    dcm_path = get_testdata_files("MR_small.dcm")[0]
+    header = get_pydicom_header(pydicom.dcmread(dcm_path))
+    header.update({"PatientID": "FLYWHEEL", "SeriesDescription": "FLYWHEEL"})
+    with tempfile.TemporaryDirectory() as tempdir:
+        zip_path = os.path.join(tempdir, "test.dicom.zip")
+        with zipfile.ZipFile(UnseekableWriter(zip_path), "w") as zipf:
+            zipf.write(dcm_path, "series/1.dcm", compress_type=zipfile.ZIP_DEFLATED)
+            zipf.write(dcm_path, "series/2.dcm", compress_type=zipfile.ZIP_STORED)
+            zipf.writestr("series/notes.txt", "not a dicom" * 100, zipfile.ZIP_STORED)
+            zipf.writestr("other.bin", b"\x00" * 1000, zipfile.ZIP_DEFLATED)
+        with zipfile.ZipFile(zip_path) as zipf:
+            orig_infos = {zinfo.filename: zinfo for zinfo in zipf.infolist()}
+            assert all(zinfo.flag_bits & 0x08 for zinfo in orig_infos.values())
+            orig_other = zipf.read("other.bin")
+
+        updater = ZipDicomUpdater(zip_path, header, logging.getLogger("test"))
+        assert updater.dicom_path_list == list(orig_infos)
+        assert updater.update_dict == {
+            "PatientID": "FLYWHEEL",
+            "SeriesDescription": "FLYWHEEL",
+        }
+        assert updater.update_dicoms() == ["series/1.dcm", "series/2.dcm"]
+        assert os.listdir(tempdir) == ["test.dicom.zip"]
+
+        with zipfile.ZipFile(zip_path) as zipf:
+            assert zipf.testzip() is None
+            infos = {zinfo.filename: zinfo for zinfo in zipf.infolist()}
+            assert list(infos) == list(orig_infos)
+            for name in ("series/1.dcm", "series/2.dcm"):
+                dcm = pydicom.dcmread(io.BytesIO(zipf.read(name)))
+                assert dcm.PatientID == "FLYWHEEL"
+            # non-DICOM members are copied as is
+            for name in ("series/notes.txt", "other.bin"):
+                assert infos[name].compress_type == orig_infos[name].compress_type
+                assert infos[name].compress_size == orig_infos[name].compress_size
+                assert infos[name].CRC == orig_infos[name].CRC
+            assert zipf.read("other.bin") == orig_other
+
+        # Nothing to update, archive is left alone
+        mtime = os.path.getmtime(zip_path)
+        assert DicomUpdater.update_fw_dicom(zip_path, header) == zip_path
+        assert os.path.getmtime(zip_path) == mtime
+
+
+def test_copy_zip_member_raw_fallback(monkeypatch, tmp_path):
+    src_path = str(tmp_path / "src.zip")
+    dst_path = str(tmp_path / "dst.zip")
+    with zipfile.ZipFile(src_path, "w") as zipf:
+        zipf.writestr("notes.txt", "not a dicom" * 100, zipfile.ZIP_DEFLATED)
+    with zipfile.ZipFile(src_path) as src_zipf, zipfile.ZipFile(
+        dst_path, "w"
+    ) as dst_zipf:
+        assert can_copy_zip_member_raw(src_zipf, dst_zipf)
+        # zipfile internals missing in this Python version
+        monkeypatch.setattr(
+            dicom_edit, "ZIP_WRITER_ATTRIBUTES", ZIP_WRITER_ATTRIBUTES + ("_missing",)
+        )
+        assert not can_copy_zip_member_raw(src_zipf, dst_zipf)
+        copy_zip_member_raw(src_zipf, dst_zipf, src_zipf.getinfo("notes.txt"))
+    with zipfile.ZipFile(dst_path) as zipf:
+        assert zipf.testzip() is None
+        assert zipf.getinfo("notes.txt").compress_type == zipfile.ZIP_DEFLATED
+        assert zipf.read("notes.txt") == b"not a dicom" * 100
+
+
+def test_get_chunk_size():
+    assert get_chunk_size(1, 8) == 1
+    assert get_chunk_size(100, 4) == 7
+    assert get_chunk_size(5000, 4) == MAX_DICOM_CHUNK_SIZE
+
+
+def test_iter_chunk_results():
+    items = list(range(50))
+    assert list(iter_chunk_results(sorted, items, 3)) == items
+    with get_dicom_process_pool(2) as executor:
+        # workers are spawned, not forked from a multi-threaded process
+        assert executor._mp_context.get_start_method() == "spawn"
+        assert list(iter_chunk_results(sorted, items, 2, executor)) == items
+
+
+@pytest.mark.parametrize(
+    "max_workers,shared_executor", [(1, False), (2, False), (2, True)]
+)
+def test_dicom_updater_workers(max_workers, shared_executor):
+    dcm_path = get_testdata_files("MR_small.dcm")[0]
+    header = get_pydicom_header(pydicom.dcmread(dcm_path))
+    header.update({"PatientID": "FLYWHEEL"})
+    with tempfile.TemporaryDirectory() as tempdir:
+        path_list = list()
+        zip_path = os.path.join(tempdir, "test.dicom.zip")
+        with zipfile.ZipFile(zip_path, "w") as zipf:
+            for i in range(6):
+                path = os.path.join(tempdir, f"{i}.dcm")
+                shutil.copyfile(dcm_path, path)
+                path_list.append(path)
+                zipf.write(dcm_path, f"{i}.dcm")
+
+        executor = get_dicom_process_pool(max_workers) if shared_executor else None
+        updater = DicomUpdater(
+            path_list,
+            header,
+            logging.getLogger("test"),
+            max_workers=max_workers,
+            executor=executor,
+        )
+        assert updater.use_process_pool == (max_workers > 1)
+        assert [d["path"] for d in updater.dicom_dict_list] == path_list
+        assert updater.update_dicoms() == path_list
+        for path in path_list:
+            assert pydicom.dcmread(path).PatientID == "FLYWHEEL"
+
+        assert DicomUpdater.update_fw_dicom(
+            zip_path, header, max_workers=max_workers, executor=executor
+        )
+        if executor is not None:
+            executor.shutdown()
+        with zipfile.ZipFile(zip_path) as zipf:
+            assert zipf.namelist() == [f"{i}.dcm" for i in range(6)]
+            for name in zipf.namelist():
+                dcm = pydicom.dcmread(io.BytesIO(zipf.read(name)))
+                assert dcm.PatientID == "FLYWHEEL"
+
+
+def test_edit_dicom_bytes(mocker):
+    dcm_path = get_testdata_files("MR_small.dcm")[0]
+    with open(dcm_path, "rb") as fp:
+        dcm_bytes = fp.read()
+    edited_bytes = edit_dicom_bytes(dcm_bytes, {"PatientID": "Flywheel"})
+    assert pydicom.dcmread(io.BytesIO(edited_bytes)).PatientID == "Flywheel"
+    probe_spy = mocker.spy(dicom_edit, "edit_dicom_with_probing")
+    assert edit_dicom_bytes(dcm_bytes, {"PatientID": 2}) is None
+    probe_spy.assert_called_once()
+
+
 def test_dicom_list_updater_invalid(caplog):
     # test no common tags
     dcm_test_files_list = [x for x in get_testdata_files() if x.endswith(".dcm")]
@@ -1,10 +1,20 @@
 import pydicom
 import pytest
 from pydicom.data import get_testdata_files
+import io
 import json
+import zipfile
 
 from pathlib import Path
-from dicom_metadata import assign_type, get_compatible_fw_header, get_pydicom_header
+from dicom_metadata import (
+    assign_type,
+    get_compatible_fw_header,
+    get_header_dict_list,
+    get_pydicom_header,
+    get_zip_header_dict_list,
+    is_header_keyword,
+    read_dicom_header,
+)
 
 
 def test_assign_type():
@@ -65,3 +75,37 @@ def test_get_pydicom_header_all_tags(in_file, out_file):
         for key, val in known_good.items():
             if val:
                 assert header[key] == val
+
+
+@pytest.mark.parametrize("in_file", ["MR_small.dcm", "CT_small.dcm"])
+def test_read_dicom_header(in_file):
+    test_dicom_path = get_testdata_files(in_file)[0]
+    dcm = read_dicom_header(test_dicom_path)
+    assert "PixelData" not in dcm
+    full_header = get_pydicom_header(pydicom.dcmread(test_dicom_path))
+    full_header = {k: v for k, v in full_header.items() if is_header_keyword(k)}
+    header_dict_list = get_header_dict_list([test_dicom_path])
+    assert header_dict_list[0].pop("path") == test_dicom_path
+    assert header_dict_list[0] == full_header
+
+
+def test_is_header_keyword():
+    assert is_header_keyword("PatientID")
+    assert is_header_keyword("NotAKeyword")
+    assert not is_header_keyword("PixelData")
+    assert not is_header_keyword("DataSetTrailingPadding")
+
+
+def test_get_zip_header_dict_list_large_value(tmp_path):
+    dcm = pydicom.dcmread(get_testdata_files("MR_small.dcm")[0])
+    # a value larger than the header defer size
+    dcm.PixelDataProviderURL = "x" * (1024 * 1024 + 1)
+    dcm_fp = io.BytesIO()
+    dcm.save_as(dcm_fp)
+    zip_path = tmp_path / "test.dicom.zip"
+    with zipfile.ZipFile(zip_path, "w") as zipf:
+        zipf.writestr("series/1.dcm", dcm_fp.getvalue())
+
+    header_dict_list = get_zip_header_dict_list(zip_path, ["series/1.dcm"])
+    assert header_dict_list[0]["path"] == "series/1.dcm"
+    assert header_dict_list[0]["PixelDataProviderURL"] == dcm.PixelDataProviderURL
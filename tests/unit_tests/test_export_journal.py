@@ -0,0 +1,97 @@
+import os
+
+import flywheel
+
+from export_journal import ExportJournal
+from export_log import ExportRecord
+from util import hash_value
+
+
+def test_export_journal(tmp_path):
+    journal_path = str(tmp_path / "journal.jsonl")
+    origin_session = flywheel.Session(id="origin_session")
+    origin_acquisition = flywheel.Acquisition(id="origin_acquisition")
+    session_copy = flywheel.Session(id="session_copy", label="session")
+    record = ExportRecord(
+        "acquisition", "acquisition", "group/project/acquisition", True, (), ("a",)
+    )
+
+    journal = ExportJournal.open(journal_path)
+    assert journal.get_container_copy(None, origin_session) is None
+    journal.add_container(origin_session, session_copy, True)
+    journal.add_file(session_copy, hash_value("origin_file"), "file.txt", False)
+    journal.complete_container(origin_acquisition, record)
+    journal.close()
+    # an entry left incomplete by an interrupted run
+    with open(journal_path, "a") as fp:
+        fp.write('{"event": "file", "parent_id": ')
+
+    journal = ExportJournal.open(journal_path)
+    container_copy, created = journal.get_container_copy(None, origin_session)
+    assert isinstance(container_copy, flywheel.Session)
+    assert (container_copy.id, container_copy.label) == ("session_copy", "session")
+    assert created is True
+    assert journal.get_file(session_copy, hash_value("origin_file")) == (
+        "file.txt",
+        False,
+    )
+    assert journal.get_file(session_copy, hash_value("other_file")) is None
+    assert journal.get_completed_record(origin_acquisition) == record
+    assert journal.get_completed_record(origin_session) is None
+    journal.add_file(session_copy, hash_value("other_file"), "other.txt", True)
+    journal.close()
+
+    journal = ExportJournal.open(journal_path)
+    assert journal.get_file(session_copy, hash_value("other_file")) == (
+        "other.txt",
+        True,
+    )
+    journal.close()
+
+
+def test_export_journal_discard(tmp_path):
+    journal_path = str(tmp_path / "journal.jsonl")
+    journal = ExportJournal.open(journal_path)
+    journal.add_container(
+        flywheel.Session(id="origin"), flywheel.Session(id="copy"), True
+    )
+    journal.close()
+    journal = ExportJournal.open(journal_path, resume=False)
+    assert journal.containers == dict()
+    journal.close()
+    # the existing journal was discarded
+    assert os.path.getsize(journal_path) == 0
+
+    journal = ExportJournal.open(journal_path)
+    journal.discard()
+    assert not os.path.exists(journal_path)
+
+
+def test_export_journal_export_project(tmp_path):
+    journal_path = str(tmp_path / "journal.jsonl")
+    origin = flywheel.Session(id="origin")
+    session_copy = flywheel.Session(id="copy", label="session")
+    journal = ExportJournal.open(journal_path, export_project_id="project_1")
+    journal.add_container(origin, session_copy, True)
+    journal.add_file(session_copy, hash_value("origin_file"), "file.txt", True)
+    journal.close()
+
+    journal = ExportJournal.open(journal_path, export_project_id="project_1")
+    assert journal.get_container_copy(None, origin)[0].id == "copy"
+    journal.close()
+    # the copies of another export project are not reused
+    journal = ExportJournal.open(journal_path, export_project_id="project_2")
+    assert journal.get_container_copy(None, origin) is None
+    assert journal.get_file(session_copy, hash_value("origin_file")) is None
+    journal.close()
+
+
+def test_export_journal_has_files(tmp_path):
+    journal = ExportJournal.open(str(tmp_path / "journal.jsonl"))
+    session_copy = flywheel.Session(id="copy")
+    files = [flywheel.FileEntry(id=f"file_{i}") for i in range(2)]
+    journal.add_file(session_copy, hash_value("file_0"), "0", False)
+    assert journal.has_files(session_copy, files[:1])
+    assert not journal.has_files(session_copy, files)
+    assert not journal.has_files(flywheel.Session(id="other"), files[:1])
+    journal.close()
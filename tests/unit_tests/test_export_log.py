@@ -1,11 +1,14 @@
 import csv
+import json
 import os
 import tempfile
 from pathlib import PurePosixPath
 
 import flywheel
+import pytest
 
-from export_log import ExportLog, ExportRecord
+from export_log import ExportFileRecord, ExportLog, ExportRecord
+from instrumentation import ScopeMetrics
 
 
 def test_export_record():
@@ -80,3 +83,169 @@ def test_export_log():
         exp_row_1 = list(record_dict.values())
         assert csv_rows[0] == exp_row_0
         assert csv_rows[1] == exp_row_1
+
+
+def test_export_log_extend():
+    export_project = flywheel.Project(group="export_group", label="export_project")
+    export_log = ExportLog(export_project)
+    export_log.add_container_record(
+        "group/project/subject", flywheel.Subject(label="subject", id="1"), True
+    )
+    child_log = export_log.get_child_log()
+    assert child_log.records == []
+    assert child_log.export_path == export_log.export_path
+    child_log.add_container_record(
+        "group/project/subject/session", flywheel.Session(label="session", id="2"), True
+    )
+    export_log.extend(child_log)
+    assert [r.container_label for r in export_log.records] == ["subject", "session"]
+    assert export_log.created_dict == {
+        "subjects": ["1"],
+        "sessions": ["2"],
+        "acquisitions": [],
+    }
+
+
+def test_export_log_archive_results(tmp_path):
+    export_project = flywheel.Project(group="export_group", label="export_project")
+    archive_project = flywheel.Project(group="archive_group", label="archive_project")
+    export_log = ExportLog(export_project, archive_project)
+    for label in ("ses1", "ses2"):
+        export_log.add_container_record(
+            f"group/project/subject/{label}", flywheel.Session(label=label), False
+        )
+        export_log.add_container_record(
+            f"group/project/subject/{label}/acq",
+            flywheel.Acquisition(label="acq"),
+            False,
+        )
+    child_log = export_log.get_child_log()
+    child_log.add_archive_result("group/project/subject/ses1", True)
+    export_log.extend(child_log)
+    export_log.add_archive_result("group/project/subject/ses2", False)
+    assert export_log.failed_archive_paths == ["group/project/subject/ses2"]
+    assert export_log.is_archived("group/project/subject/ses1/acq")
+    assert not export_log.is_archived("group/project/subject/ses2/acq")
+    assert export_log.is_archived("group/project/subject/ses20")
+
+    csv_path = tmp_path / "export_log.csv"
+    export_log.write_csv(csv_path, export_log.archive_path)
+    with open(csv_path) as csvfile:
+        archive_paths = [row["Archive Path"] for row in csv.DictReader(csvfile)]
+    assert archive_paths == [
+        "archive_group/archive_project/subject/ses1",
+        "archive_group/archive_project/subject/ses1/acq",
+        "",
+        "",
+    ]
+
+
+@pytest.mark.parametrize("archived", [None, "all", "partial"])
+def test_export_log_open(tmp_path, archived):
+    export_project = flywheel.Project(group="export_group", label="export_project")
+    archive_project = flywheel.Project(group="archive_group", label="archive_project")
+    export_log = ExportLog(export_project, archive_project)
+    csv_path = str(tmp_path / "export_log.csv")
+    jsonl_path = str(tmp_path / "export_log.jsonl")
+    export_log.open(csv_path, jsonl_path)
+    export_log.add_container_record(
+        "group/project/subject", flywheel.Subject(label="subject"), False
+    )
+    child_log = export_log.get_child_log()
+    for label in ("ses1", "ses2"):
+        child_log.add_container_record(
+            f"group/project/subject/{label}",
+            flywheel.Session(label=label),
+            True,
+            failed_files=["failed.dcm"] if label == "ses2" else [],
+        )
+    export_log.extend(child_log)
+    # records are written as they are added instead of being kept
+    assert export_log.records == []
+    assert export_log.has_failed_files
+    with open(csv_path) as csvfile:
+        assert len(list(csv.DictReader(csvfile))) == 3
+
+    if archived == "partial":
+        export_log.add_archive_result("group/project/subject/ses2", False)
+    export_log.close(export_log.archive_path if archived else None)
+    export_log.close()
+
+    with open(csv_path) as csvfile:
+        csv_rows = list(csv.DictReader(csvfile))
+    with open(jsonl_path) as jsonlfile:
+        jsonl_rows = [json.loads(line) for line in jsonlfile]
+    assert csv_rows == jsonl_rows
+    assert [row["Name"] for row in csv_rows] == ["subject", "ses1", "ses2"]
+    assert csv_rows[2]["Failed Files"] == "('failed.dcm',)"
+    if archived is None:
+        assert "Archive Path" not in csv_rows[0]
+    else:
+        ses2_path = "archive_group/archive_project/subject/ses2"
+        assert [row["Archive Path"] for row in csv_rows] == [
+            "archive_group/archive_project/subject",
+            "archive_group/archive_project/subject/ses1",
+            "" if archived == "partial" else ses2_path,
+        ]
+    assert sorted(os.listdir(tmp_path)) == ["export_log.csv", "export_log.jsonl"]
+
+
+def test_export_file_record():
+    metrics = ScopeMetrics()
+    metrics.counts.update(bytes_downloaded=100, bytes_uploaded=120, dicoms_edited=3)
+    metrics.stages["download"].add(0.5)
+    metrics.stages["upload"].add(0.25)
+    metrics.elapsed = 1.5
+    file_record = ExportFileRecord.from_metrics(
+        "group/project/subject/session/acq", "a.dicom.zip", "a.dicom.zip", True, metrics
+    )
+    assert file_record.get_csv_dict() == {
+        "Origin Path": "group/project/subject/session/acq",
+        "File": "a.dicom.zip",
+        "Export Name": "a.dicom.zip",
+        "Status": "created",
+        "Bytes Downloaded": 100,
+        "Bytes Uploaded": 120,
+        "DICOMs Edited": 3,
+        "Download s": 0.5,
+        "Header Parse s": 0.0,
+        "Edit s": 0.0,
+        "Rezip s": 0.0,
+        "Upload s": 0.25,
+        "Elapsed s": 1.5,
+    }
+    # files recorded by the journal of a previous run have no metrics
+    journal_record = ExportFileRecord.from_metrics(
+        "path", "b.txt", "b.txt", False, None
+    )
+    assert journal_record.status == "used_existing"
+    assert journal_record.get_csv_dict()["Elapsed s"] == 0
+    failed_record = ExportFileRecord.from_metrics("path", "c.txt", None, False, None)
+    assert failed_record.status == "failed"
+    assert failed_record.get_csv_dict()["Export Name"] == ""
+
+
+def test_export_log_file_records(tmp_path):
+    export_project = flywheel.Project(group="export_group", label="export_project")
+    export_log = ExportLog(export_project)
+    child_log = export_log.get_child_log()
+    child_log.add_file_record(ExportFileRecord("path", "a.txt", "a.txt", True))
+    export_log.extend(child_log)
+    assert [r.file_name for r in export_log.file_records] == ["a.txt"]
+
+    files_csv_path = str(tmp_path / "export_log_files.csv")
+    export_log = ExportLog(export_project)
+    export_log.open(str(tmp_path / "export_log.csv"), files_csv_path=files_csv_path)
+    child_log = export_log.get_child_log()
+    for name in ("a.txt", "b.txt"):
+        child_log.add_file_record(ExportFileRecord("path", name, None))
+    export_log.extend(child_log)
+    # file records are written as they are added instead of being kept
+    assert export_log.file_records == []
+    export_log.close()
+    with open(files_csv_path) as csvfile:
+        rows = list(csv.DictReader(csvfile))
+    assert [(row["File"], row["Status"]) for row in rows] == [
+        ("a.txt", "failed"),
+        ("b.txt", "failed"),
+    ]
@@ -0,0 +1,111 @@
+import json
+import threading
+from unittest.mock import MagicMock
+
+import flywheel
+import pytest
+
+from instrumentation import ExportMetrics
+
+
+@pytest.fixture
+def metrics(mocker):
+    clock = iter(range(1000))
+    mocker.patch("instrumentation.time.perf_counter", side_effect=lambda: next(clock))
+    return ExportMetrics()
+
+
+def test_stage_scopes(metrics):
+    session = flywheel.Session(label="ses", id="1")
+    file_entry = flywheel.FileEntry(name="a.dcm")
+    file_entry._parent = session
+    timed_upload = metrics.timed("upload")(lambda: "uploaded")
+
+    with metrics.stage("hierarchy"):
+        pass
+    with metrics.container_scope(session):
+        with metrics.stage("find"):
+            pass
+        with metrics.file_scope(file_entry):
+            assert timed_upload() == "uploaded"
+
+    result = metrics.to_dict()
+    assert result["stages"]["hierarchy"]["count"] == 1
+    assert result["stages"]["find"] == {
+        "count": 1,
+        "total_s": 1,
+        "mean_s": 1,
+        "max_s": 1,
+    }
+    assert list(result["containers"]) == ["session ses (1)"]
+    # stages are attributed to the innermost scope only
+    assert list(result["containers"]["session ses (1)"]["stages"]) == ["find"]
+    assert list(result["files"]["a.dcm (1)"]["stages"]) == ["upload"]
+
+    metrics.reset()
+    assert metrics.to_dict()["stages"] == {}
+
+
+def test_scope_per_thread(metrics):
+    session = flywheel.Session(label="ses", id="1")
+
+    def worker():
+        with metrics.stage("download"):
+            pass
+
+    with metrics.container_scope(session):
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+    result = metrics.to_dict()
+    assert result["stages"]["download"]["count"] == 1
+    assert result["containers"]["session ses (1)"]["stages"] == {}
+
+
+def test_counts_and_elapsed(metrics):
+    file_entry = flywheel.FileEntry(name="a.dcm")
+    metrics.add_count("bytes_downloaded", 10)
+    with metrics.file_scope(file_entry) as file_metrics:
+        metrics.add_count("bytes_downloaded", 5)
+        metrics.add_count("dicoms_edited")
+        with metrics.stage("edit"):
+            pass
+
+    assert file_metrics.counts == {"bytes_downloaded": 5, "dicoms_edited": 1}
+    assert file_metrics.get_stage_time("edit") == 1
+    assert file_metrics.get_stage_time("rezip") == 0
+    # the scope was entered at t=1 and exited at t=4
+    assert file_metrics.elapsed == 3
+    result = metrics.to_dict()
+    assert result["counts"] == {"bytes_downloaded": 15, "dicoms_edited": 1}
+    assert result["files"]["a.dcm (None)"]["elapsed_s"] == 3
+
+
+def test_instrument_client(metrics, tmp_path):
+    fw_client = MagicMock()
+    call_api = fw_client.api_client.call_api
+    call_api.side_effect = [{"_id": "1"}, flywheel.rest.ApiException(status=404)]
+    fw_client.api_client._export_metrics_instrumented = False
+    metrics.instrument_client(fw_client)
+    # instrumenting again does not wrap the client twice
+    metrics.instrument_client(fw_client)
+
+    api_call = fw_client.api_client.call_api
+    with metrics.scope("container", "session ses (1)"):
+        assert api_call("/sessions/{SessionId}", "GET", {"SessionId": "1"}) == {
+            "_id": "1"
+        }
+    with pytest.raises(flywheel.rest.ApiException):
+        api_call("/sessions/{SessionId}", "GET", {"SessionId": "2"})
+    call_api.assert_called_with("/sessions/{SessionId}", "GET", {"SessionId": "2"})
+
+    metrics_path = tmp_path / "metrics.json"
+    metrics.write_json(metrics_path)
+    result = json.loads(metrics_path.read_text())
+    assert result["api_call_count"] == 2
+    assert result["api_calls"]["GET /sessions/{SessionId}"]["count"] == 2
+    session_calls = result["containers"]["session ses (1)"]["api_calls"]
+    assert session_calls["GET /sessions/{SessionId}"]["count"] == 1
+    summary = metrics.format_summary()
+    assert "2 API calls" in summary
+    assert "api GET /sessions/{SessionId}" in summary
@@ -75,6 +75,22 @@ def test_get_common_list_dict():
     assert get_dict_list_common_dict([]) == dict()
 
 
+def test_dict_list_table():
+    dict_list = [
+        {"PatientID": "Flywheel", "ImageType": ["ORIGINAL"], "Empty": None, "A": 1},
+        {"PatientID": "Flywheel", "ImageType": ["ORIGINAL"], "A": 2, "B": 1},
+        {"PatientID": "Flywheel", "ImageType": ["DERIVED"], "Empty": None, "A": 2},
+    ]
+    table = DictListTable(dict_list)
+    assert table.row_count == 3
+    assert table.keys == ["PatientID", "ImageType", "Empty", "A", "B"]
+    # as with dict.get, a missing key matches a value of None
+    assert table.common_dict == {"PatientID": "Flywheel", "Empty": None}
+    assert table.differing_keys == ["ImageType", "A", "B"]
+    assert table.common_dict == get_dict_list_common_dict(dict_list)
+    assert DictListTable().common_dict == dict()
+
+
 def test_false_if_exc_is_timeout():
     assert false_if_exc_is_timeout(TypeError())
     assert all(
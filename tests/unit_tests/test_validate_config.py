@@ -72,7 +72,7 @@ class TestGetDestination:
             (flywheel.Subject(label="test"), does_not_raise()),
             (flywheel.Session(label="test"), does_not_raise()),
             (flywheel.Group(label="test"), pytest.raises(ValueError)),
-            (flywheel.Project(label="test"), pytest.raises(ValueError)),
+            (flywheel.Project(label="test"), does_not_raise()),
             (flywheel.Acquisition(label="test"), pytest.raises(ValueError)),
         ],
     )
@@ -238,6 +238,19 @@ class TestValidateContext:
             check_gear_rules_mock.assert_not_called()
             assert "No enabled rules were found. Moving on..." not in msgs
 
+    def test_validate_project_destination(self, mocker, gear_context):
+        gear_context.config = {"export_project": "test", "force_export": False}
+        mocker.patch("validate.get_project").return_value = flywheel.Project()
+        project = flywheel.Project(label="test", tags=["EXPORTED"])
+        mocker.patch("validate.get_destination").return_value = project
+        check_exported_mock = mocker.patch("validate.container_needs_export")
+
+        export, archive, dest = validate_context(gear_context)
+
+        # sessions are checked individually in batch mode
+        assert dest is project
+        check_exported_mock.assert_not_called()
+
     @pytest.mark.parametrize(
         "proj",
         [
@@ -1,7 +1,6 @@
 import hashlib
 import logging
 import re
-from functools import reduce
 
 from pathvalidate import sanitize_filename
 
@@ -77,6 +76,70 @@ def hash_value(value, algorithm="sha256", output_format="hex", salt=None):
     return result
 
 
+class DictListTable:
+    """
+    Columnar summary of a list of dictionaries (i.e. the DICOM headers of the
+        slices of a series) built in a single pass: the keys defined by any of
+        the dictionaries and the columns of the key-value pairs common to all
+        dictionaries so far. Each dictionary is compared to the common columns
+        at once and the columns are only narrowed key by key when it differs.
+    """
+
+    def __init__(self, dict_list=()):
+        """
+        Args:
+            dict_list (iterable): dictionaries to add as rows of the table
+        """
+        self.row_count = 0
+        # ordered set of the keys defined by any of the dictionaries
+        self._keys = dict()
+        self._common_keys = list()
+        self._common_values = list()
+        for row in dict_list:
+            self.add_row(row)
+
+    def add_row(self, row):
+        """
+        Add the key-value pairs of a dictionary to the table
+        Args:
+            row (dict): the dictionary to add
+        """
+        if self.row_count == 0:
+            self._common_keys = list(row.keys())
+            self._common_values = list(row.values())
+        else:
+            # as with dict.get, a missing key matches a common value of None
+            values = list(map(row.get, self._common_keys))
+            if values != self._common_values:
+                common_columns = [
+                    (key, common_value)
+                    for key, common_value, value in zip(
+                        self._common_keys, self._common_values, values
+                    )
+                    if value == common_value
+                ]
+                self._common_keys = [key for key, _ in common_columns]
+                self._common_values = [value for _, value in common_columns]
+        self._keys.update(row)
+        self.row_count += 1
+
+    @property
+    def keys(self):
+        """list of the keys defined by any of the dictionaries"""
+        return list(self._keys)
+
+    @property
+    def common_dict(self):
+        """dict with the key-value pairs that are identical in all dictionaries"""
+        return dict(zip(self._common_keys, self._common_values))
+
+    @property
+    def differing_keys(self):
+        """list of the keys that are missing or differ in some dictionaries"""
+        common_keys = set(self._common_keys)
+        return [key for key in self._keys if key not in common_keys]
+
+
 def get_dict_list_common_dict(dict_list):
     """
     Get a dictionary containing the common key-value pairs across all dictionaries.
@@ -88,16 +151,7 @@ def get_dict_list_common_dict(dict_list):
     Returns:
         dict: a dict with key-value pairs that are identical in all dictionaries
     """
-
-    def get_common_dict(dict1, dict2):
-        """get a dictionary of common key-value pairs from two dicts"""
-        return {k: v for k, v in dict1.items() if dict2.get(k) == v}
-
-    # Reduce will raise if list is empty
-    if not dict_list:
-        return dict()
-    # Refer to https://docs.python.org/3.0/library/functools.html for more info
-    return reduce(get_common_dict, dict_list)
+    return DictListTable(dict_list).common_dict
 
 
 def false_if_exc_is_timeout(exception):
@@ -33,7 +33,7 @@ def validate_context(gc):
         (tuple): tuple containing:
             (flywheel.Project): export project 
             (flywheel.Project or None): archive project
-            (flywheel.Session or flywheel.Subject): Destination container 
+            (flywheel.Project, flywheel.Session or flywheel.Subject): Destination container 
 
     """
     # Setup
@@ -94,8 +94,12 @@ def validate_context(gc):
         sys.exit(1)
 
     ####
-    # Check whether there is work to do
-    need_to_export = container_needs_export(destination, gc.config)
+    # Check whether there is work to do (sessions are checked individually in
+    # project batch mode)
+    if destination.container_type == "project":
+        need_to_export = True
+    else:
+        need_to_export = container_needs_export(destination, gc.config)
 
     if not need_to_export:
         log.warning(
@@ -149,7 +153,8 @@ def get_destination(fw, dest_id, errors=[]):
         dest_id (str): Destination id
 
     Returns:
-        (flywheel.Subject or flywheel.Session): Destination container, either session or subject
+        (flywheel.Project, flywheel.Subject or flywheel.Session): Destination
+            container, either project (batch export), session or subject
     """
     # Destination will be analysis since this is a gear run.
     #   Find parent to get export destination container
@@ -159,9 +164,9 @@ def get_destination(fw, dest_id, errors=[]):
 
     log.debug(f"Found destination container id {dest_container.id}")
 
-    if dest_container.container_type not in ["session", "subject"]:
+    if dest_container.container_type not in ["project", "session", "subject"]:
         raise ValueError(
-            "Only session and subject level exports are supported at this time!"
+            "Only project, session and subject level exports are supported at this time!"
         )
 
     return dest_container